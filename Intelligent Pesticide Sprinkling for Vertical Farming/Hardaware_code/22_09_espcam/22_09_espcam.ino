@@ -9,7 +9,10 @@ const char* password = "123456789";
 
 //flask server address
 const char* server_url = "http://10.39.32.231:5000/api/analysis/image";
-int severity = 0;  // global variable
+const char* tower_id = "tower-1";  // identifies this carriage's tower on the server
+int severity[2] = {0, 0};  // last infected percentage per level, sprayed on every pass
+int nextInspectionS = 0;  // seconds until the server wants this plant again (0 = next cycle)
+unsigned long nextInspectionAt[2] = {0, 0};  // millis() when each level is due
 
 
 //cam setup
@@ -111,7 +114,9 @@ void setup() {
   initCamera();
 }
 
-void sendPhoto() {
+void sendPhoto(int level, int plant) {
+  nextInspectionS = 0;  // on any failure, look again next cycle
+
   // 1. Capture frame
   camera_fb_t* fb = esp_camera_fb_get();
   if (!fb) {
@@ -122,7 +127,8 @@ void sendPhoto() {
   // 2. Prepare HTTP client
   WiFiClient client;
   HTTPClient http;
-  if (!http.begin(client, server_url)) {
+  String url = String(server_url) + "?tower=" + tower_id + "&level=" + level + "&plant=" + plant;
+  if (!http.begin(client, url)) {
     Serial.println("HTTP begin failed!");
     esp_camera_fb_return(fb);
     return;
@@ -161,18 +167,21 @@ void sendPhoto() {
   if (error) {
     Serial.print("JSON parse failed: ");
     Serial.println(error.c_str());
-    severity = -1;
+    severity[level] = -1;
     return;
   }
 
   // 6. Access infected_percentage field
   if (doc.containsKey("infected_percentage")) {
-    severity = doc["infected_percentage"].as<int>();  // round down to int
-    Serial.printf("Infection Severity: %d%%\n", severity);
+    severity[level] = doc["infected_percentage"].as<int>();  // round down to int
+    Serial.printf("Infection Severity: %d%%\n", severity[level]);
   } else {
-    severity = -1;
+    severity[level] = -1;
     Serial.println("Key 'infected_percentage' missing!");
   }
+
+  // 7. When to inspect this plant again (older servers don't send it)
+  nextInspectionS = doc["next_inspection_s"] | 0;
 }
 
 int getSprayDurationMs(int severity) {
@@ -195,14 +204,30 @@ void sprayForDuration(int ms) {
   Serial.println("[SPRAY] Pump OFF");
 }
 
+// Healthy, stable plants are inspected less often; the server decides how often
+bool inspectionDue(int level) {
+  return (long)(millis() - nextInspectionAt[level]) >= 0;
+}
+
+// A level that isn't due keeps being sprayed at its last known severity
+void inspectLevel(int level, int plant) {
+  if (inspectionDue(level)) {
+    Serial.printf("[LEVEL %d] Capturing plant %d (level %d)...\n", level, plant, level);
+    sendPhoto(level, plant);
+    nextInspectionAt[level] = millis() + (unsigned long)nextInspectionS * 1000UL;
+  } else {
+    Serial.printf("[LEVEL %d] Not due for inspection yet, spraying at last severity %d%%\n",
+                  level, severity[level]);
+  }
+  sprayForDuration(getSprayDurationMs(severity[level]));
+}
+
 void loop() {
 
   Serial.println("\n===== NEW CYCLE START =====");
 
   // --- Level 0 (plant 1) ---
-  Serial.println("[LEVEL 0] Capturing plant 1 (level 0)...");
-  sendPhoto();
-  sprayForDuration(getSprayDurationMs(severity));
+  inspectLevel(0, 1);
   delay(4000);  // short rest
 
   // --- Move UP to Level 1 ---
@@ -213,9 +238,7 @@ void loop() {
   delay(2000);
 
   // --- Level 1 (plant 2) ---
-  Serial.println("[LEVEL 1] Capturing plant 2 (level 1)...");
-  sendPhoto();
-  sprayForDuration(getSprayDurationMs(severity));
+  inspectLevel(1, 2);
   delay(3000);
 
 
@@ -1,13 +1,24 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from pymongo import MongoClient
 from datetime import datetime
+import logging
 import os
+import sys
 import time
-import cv2
+import atexit
+import threading
 import base64
-import numpy as np
-from ultralytics import YOLO
+
+# Reuse the shared helpers that live next to the main Flask server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "Software_Code", "Flask_code"))
+from mongo_writer import BufferedMongoWriter
+from inference_backends import load_backend, warm_up
+from detection_postprocess import ClassMap, summarize
+from frame_decode import decode_for_model
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from health import FAILED, READY, STARTING, HealthRegistry
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -23,24 +34,78 @@ ANALYSIS_FOLDER = "analysis_images"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(ANALYSIS_FOLDER, exist_ok=True)
 
-# Load the YOLOv8 model once when the application starts
-try:
-    MODEL_PATH = r'C:\Users\9c23o\Plant Infection Level Detection ML model Using YOLOV8\best.pt'
-    model = YOLO(MODEL_PATH)
-    print("YOLO model loaded successfully.")
-except Exception as e:
-    print(f"Error loading YOLO model: {e}")
-    model = None
+# Model backend and path, see Software_Code/Flask_code/server.py
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "ultralytics")
+MODEL_PATH = os.environ.get("MODEL_PATH", r'C:\Users\9c23o\Plant Infection Level Detection ML model Using YOLOV8\best.pt')
+
+# DEBUG also logs every upload; the default keeps console I/O off the request path
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+log = logging.getLogger("serve_ml")
+
+# Prometheus metrics served on /metrics, see Software_Code/Flask_code/metrics.py
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    "analysis_stage_seconds", "Time spent in each stage of an image analysis", ["stage"])
+requests_total = metrics.counter("analysis_requests_total", "Analysis requests by HTTP status", ["status"])
+
+# Startup state for /api/health/ready, see Software_Code/Flask_code/health.py
+health = HealthRegistry()
+health.register("model")
+health.register("mongodb", required=False)
+
+# Set by load_model() once the model is loaded and warmed up
+model = None
+class_map = None
+
+def load_model():
+    """Loads and warms up the model on a background thread, so the server answers while it loads."""
+    global model, class_map
+    health.set("model", STARTING, f"loading {MODEL_PATH}")
+    try:
+        if not os.path.exists(MODEL_PATH):
+            raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
+        loaded = load_backend(MODEL_BACKEND, MODEL_PATH)
+        class_map = ClassMap.from_names(loaded.names)
+        health.set("model", STARTING, "warming up")
+        warm_up(loaded)
+        model = loaded
+        health.set("model", READY, f"{MODEL_BACKEND}: {MODEL_PATH}")
+        log.info("YOLO model loaded successfully.")
+    except Exception as e:
+        log.error(f"Error loading YOLO model: {e}")
+        health.set("model", FAILED, f"{type(e).__name__}: {e}")
+
+def check_mongodb():
+    """Reports whether MongoDB answers; writes are buffered and journaled either way."""
+    try:
+        client.admin.command("ping")
+        health.set("mongodb", READY, MONGODB_URI)
+    except Exception as e:
+        health.set("mongodb", FAILED, f"{type(e).__name__}: {e}")
+
+threading.Thread(target=load_model, name="model-startup", daemon=True).start()
 
 # Initialize MongoDB
 try:
-    client = MongoClient(MONGODB_URI)
+    client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
     db = client[DATABASE_NAME]
     analysis_collection = db["analysis_data"]
-    print("MongoDB connected successfully.")
+    mongo_writer = BufferedMongoWriter(
+        analysis_collection, journal_path="mongo_journal.jsonl",
+        on_flush=lambda seconds, count: stage_seconds.observe(seconds, stage="mongo_insert"),
+    ).start()
+    atexit.register(mongo_writer.close)
+    log.info("MongoDB connected successfully.")
 except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
+    log.error(f"Error connecting to MongoDB: {e}")
+    health.set("mongodb", FAILED, f"{type(e).__name__}: {e}")
     client = None
+    mongo_writer = None
+
+if client is not None:
+    # The client connects lazily; find out in the background whether the server is up
+    threading.Thread(target=check_mongodb, name="mongodb-startup", daemon=True).start()
 
 
 # --- API Endpoints ---
@@ -55,11 +120,18 @@ def home():
 
 @app.route("/   ", methods=["POST"])
 def analyze_image_from_esp32():
+    response, status = analyze_image()
+    requests_total.inc(status=status)
+    return response, status
+
+def analyze_image():
     
     if client is None:
         return jsonify({"error": "Backend not connected to MongoDB."}), 500
     
     if model is None:
+        if health.state("model") == STARTING:
+            return jsonify({"error": "ML model is still loading, retry shortly."}), 503
         return jsonify({"error": "ML model not loaded."}), 500
 
     try:
@@ -68,33 +140,29 @@ def analyze_image_from_esp32():
         filename = f"plant_{timestamp}.jpg"
         filepath = os.path.join(UPLOAD_FOLDER, filename)
 
-        print(f"[INFO] Image saved: {filepath}")
-
-        # Decode image properly
-        np_arr = np.frombuffer(request.data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        # Save the uploaded JPEG as-is; re-encoding the decoded frame only loses quality
+        with stage_seconds.time(stage="body_read"):
+            data = request.get_data()
+        with stage_seconds.time(stage="upload_write"):
+            with open(filepath, "wb") as f:
+                f.write(data)
+        log.debug("Image saved: %s", filepath)
 
-        # Save image
-        cv2.imwrite(filepath, frame)
+        # Decode image properly, at reduced size if the upload is much larger than the model input
+        with stage_seconds.time(stage="decode"):
+            frame, _ = decode_for_model(data, model.imgsz)
+        if frame is None:
+            return jsonify({"error": "Failed to decode image. Ensure it is a valid JPEG."}), 400
 
         # Run object detection on the frame
-        results = model(frame, verbose=False)
-
-        # Process detections to get current counts
-        current_healthy = 0
-        current_infected = 0
-        for r in results:
-            for box in r.boxes:
-                class_id = int(box.cls[0].cpu().numpy())
-                class_name = model.names[class_id]
-                if class_name == 'Healthy_leaves':
-                    current_healthy += 1
-                elif class_name == 'Infected_leaves':
-                    current_infected += 1
-        
-        # Calculate infection percentage
-        total_leaves = current_healthy + current_infected
-        infected_percentage = (current_infected / total_leaves) * 100 if total_leaves > 0 else 0
+        with stage_seconds.time(stage="inference"):
+            detections = model([frame])[0]
+
+        # Count healthy/infected leaves and compute the infection percentage
+        summary = summarize(detections, class_map)
+        current_healthy = summary["healthy_count"]
+        current_infected = summary["infected_count"]
+        infected_percentage = summary["infected_percentage"]
         
         # Create a document to be saved
         analysis_document = {
@@ -104,9 +172,10 @@ def analyze_image_from_esp32():
             "timestamp": datetime.utcnow()
         }
 
-        # Save the analysis data to the MongoDB collection
-        analysis_collection.insert_one(analysis_document)
-        print(f"Analysis data received and saved: Healthy={current_healthy}, Infected={current_infected}.")
+        # Queue the analysis data for a batched MongoDB insert
+        with stage_seconds.time(stage="mongo_queue"):
+            mongo_writer.write(analysis_document)
+        log.debug("Analysis data received and queued: Healthy=%d, Infected=%d.", current_healthy, current_infected)
 
         # Return a simple JSON response with only the infection percentage
         return jsonify({
@@ -114,7 +183,7 @@ def analyze_image_from_esp32():
         }), 200
 
     except Exception as e:
-        print(f"Error processing analysis data: {e}")
+        log.exception(f"Error processing analysis data: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/analysis/latest", methods=["GET"])
@@ -132,7 +201,7 @@ def get_latest_analysis():
         else:
             return jsonify({"message": "No analysis data found."}), 404
     except Exception as e:
-        print(f"Error fetching latest analysis: {e}")
+        log.error(f"Error fetching latest analysis: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/analysis/history", methods=["GET"])
@@ -151,8 +220,24 @@ def get_analysis_history():
         
         return jsonify({"analyses": history_list}), 200
     except Exception as e:
-        print(f"Error fetching analysis history: {e}")
+        log.error(f"Error fetching analysis history: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/health/live", methods=["GET"])
+def liveness():
+    """Liveness probe: the process answers requests."""
+    return jsonify({"status": "alive", "uptime_s": health.snapshot()["uptime_s"]}), 200
+
+@app.route("/api/health/ready", methods=["GET"])
+def readiness():
+    """Readiness probe: 200 once the model is loaded and warmed up, else 503; both with per-component state."""
+    snapshot = health.snapshot()
+    return jsonify(snapshot), 200 if snapshot["ready"] else 503
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Per-stage latency histograms and request counters in the Prometheus text format."""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,107 @@
+import threading
+from datetime import timezone
+
+
+def _sort_key(doc):
+    return doc["timestamp"], str(doc["_id"])
+
+
+class RecentAnalysisCache:
+    """Write-through ring buffer of the most recent analysis documents.
+
+    The server creates every analysis record itself, so it adds each new
+    document here as it is written, with ``image_url`` already resolved. The
+    cache is filled from MongoDB once on a cold start (``warm``). After that,
+    /latest and the first pages of /history never need a database round trip.
+
+    Timestamps are stored as naive UTC, the same way pymongo returns them, so
+    cached and database documents serialize identically.
+    """
+
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        self._docs = []  # newest first
+        self._lock = threading.Lock()
+        self._warm = False
+        # True while the cache holds every document in the collection
+        self._complete = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def is_warm(self):
+        return self._warm
+
+    def _normalize(self, doc, image_url):
+        doc = dict(doc)
+        timestamp = doc["timestamp"]
+        if timestamp.tzinfo is not None:
+            doc["timestamp"] = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        doc["image_url"] = image_url
+        return doc
+
+    def _insert(self, doc):
+        key = _sort_key(doc)
+        if any(str(existing["_id"]) == key[1] for existing in self._docs):
+            return
+        position = 0
+        while position < len(self._docs) and _sort_key(self._docs[position]) > key:
+            position += 1
+        self._docs.insert(position, doc)
+        if len(self._docs) > self.capacity:
+            self._docs.pop()
+            self._complete = False
+
+    def add(self, doc, image_url=None):
+        """Adds a freshly written analysis document."""
+        doc = self._normalize(doc, image_url)
+        with self._lock:
+            self._insert(doc)
+
+    def warm(self, load_recent, resolve_image_url):
+        """Fills the cache on a cold start. Returns True if the database was read.
+
+        ``load_recent(n)`` must return the newest ``n`` documents.
+        """
+        with self._lock:
+            if self._warm:
+                return False
+            docs = list(load_recent(self.capacity))
+            for doc in docs:
+                self._insert(self._normalize(doc, resolve_image_url(doc.get("image_filename"))))
+            self._complete = len(docs) < self.capacity
+            self._warm = True
+            self.misses += 1
+            return True
+
+    def latest(self, count=True):
+        """Returns a copy of the newest document, or None. Only valid once warm."""
+        with self._lock:
+            if count:
+                self.hits += 1
+            return dict(self._docs[0]) if self._docs else None
+
+    def recent(self, limit, count=True):
+        """Returns the newest ``limit`` documents, or None if the cache can't answer."""
+        with self._lock:
+            if not self._warm or (limit > len(self._docs) and not self._complete):
+                if count:
+                    self.misses += 1
+                return None
+            if count:
+                self.hits += 1
+            return [dict(doc) for doc in self._docs[:limit]]
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def stats(self):
+        return {
+            "warm": self._warm,
+            "size": len(self._docs),
+            "capacity": self.capacity,
+            "complete": self._complete,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
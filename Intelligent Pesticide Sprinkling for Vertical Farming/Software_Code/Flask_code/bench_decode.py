@@ -0,0 +1,149 @@
+"""Benchmarks the ingest path: JPEG decode plus letterboxing to the model input.
+
+Compares the previous path (full-size decode, letterbox into a new array)
+with the current one (reduced-size decode, letterbox into a reused buffer)
+and reports time and allocated bytes per frame for each upload size. With
+--model it also runs the model on both decodes and checks that the counts
+and boxes agree.
+
+    python bench_decode.py --images val_images/
+    python bench_decode.py --sizes 640x480 1600x1200 --model best.onnx --backend onnx
+"""
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from compare_backends import match_detections
+from detection_postprocess import ClassMap, summarize
+from frame_decode import decode_for_model
+from inference_backends import letterbox, load_backend
+
+
+def legacy_letterbox(frame, size, color=114):
+    """Letterbox as it was before: a new output array and a separate resize."""
+    h, w = frame.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    left, top = (size - new_w) // 2, (size - new_h) // 2
+    out = np.full((size, size, 3), color, dtype=np.uint8)
+    resized = frame if (new_w, new_h) == (w, h) else cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    out[top:top + new_h, left:left + new_w] = resized
+    return out
+
+
+def legacy_path(data, imgsz, buffer):
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return legacy_letterbox(frame, imgsz)
+
+
+def reduced_path(data, imgsz, buffer):
+    frame, _ = decode_for_model(data, imgsz)
+    return letterbox(frame, imgsz, out=buffer)[0]
+
+
+def synthetic_jpeg(width, height):
+    """A leafy-looking test frame: smooth blobs plus sensor noise."""
+    rng = np.random.default_rng(width * height)
+    small = rng.integers(0, 255, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    frame = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    frame = cv2.add(frame, rng.integers(0, 20, frame.shape, dtype=np.uint8))
+    return cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def time_path(path, uploads, imgsz, runs):
+    buffer = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+    path(uploads[0], imgsz, buffer)
+    latencies = []
+    for _ in range(runs):
+        for data in uploads:
+            started = time.perf_counter()
+            path(data, imgsz, buffer)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return float(np.mean(latencies)), float(np.percentile(latencies, 50))
+
+
+def allocated_per_frame(path, uploads, imgsz):
+    """Peak bytes allocated while handling one frame (NumPy and OpenCV arrays are traced)."""
+    buffer = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+    peaks = []
+    tracemalloc.start()
+    for data in uploads:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = path(data, imgsz, buffer)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        del result
+    tracemalloc.stop()
+    return float(np.mean(peaks))
+
+
+def check_quality(model, uploads, imgsz, match_iou):
+    class_map = ClassMap.from_names(model.names)
+    ref_total = cand_total = matched_total = 0
+    pct_diffs = []
+    count_diffs = []
+    for data in uploads:
+        full = model([cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)])[0]
+        frame, factor = decode_for_model(data, imgsz)
+        reduced = model([frame])[0]
+        # Compare in full-size coordinates
+        reduced.xyxy = reduced.xyxy * factor
+        ref_total += len(full)
+        cand_total += len(reduced)
+        matched_total += len(match_detections(full, reduced, match_iou))
+        full_summary, reduced_summary = summarize(full, class_map), summarize(reduced, class_map)
+        pct_diffs.append(abs(full_summary["infected_percentage"] - reduced_summary["infected_percentage"]))
+        count_diffs.append(abs(full_summary["healthy_count"] - reduced_summary["healthy_count"])
+                           + abs(full_summary["infected_count"] - reduced_summary["infected_count"]))
+    print("--- Detection quality (reduced decode vs full decode) ---")
+    print(f"Detections: full={ref_total} reduced={cand_total} matched={matched_total}  "
+          f"Recall: {matched_total / ref_total if ref_total else 1.0:.4f}  "
+          f"Precision: {matched_total / cand_total if cand_total else 1.0:.4f}")
+    print(f"Leaf count abs diff per image: mean={np.mean(count_diffs):.2f} max={np.max(count_diffs)}  "
+          f"Infected % abs diff: mean={np.mean(pct_diffs):.3f} max={np.max(pct_diffs):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Folder of camera JPEGs (default: synthetic frames of --sizes)")
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1280x960", "1600x1200"])
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--model", help="Model file for the detection quality check")
+    parser.add_argument("--backend", default="ultralytics")
+    parser.add_argument("--match-iou", type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.images:
+        paths = sorted(p for ext in ("*.jpg", "*.jpeg") for p in glob.glob(os.path.join(args.images, ext)))
+        groups = {}
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            h, w = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape[:2]
+            groups.setdefault(f"{w}x{h}", []).append(data)
+    else:
+        groups = {size: [synthetic_jpeg(*map(int, size.split("x")))] for size in args.sizes}
+    if not groups:
+        raise SystemExit(f"No JPEGs found in {args.images}")
+
+    print(f"--- Decode + letterbox to {args.imgsz} (per frame) ---")
+    for size, uploads in groups.items():
+        for label, path in (("previous", legacy_path), ("reduced", reduced_path)):
+            mean_ms, p50_ms = time_path(path, uploads, args.imgsz, args.runs)
+            allocated = allocated_per_frame(path, uploads, args.imgsz)
+            print(f"{size:>10} {label:<9} mean={mean_ms:6.2f} ms  p50={p50_ms:6.2f} ms  "
+                  f"allocated={allocated / 1024:8.1f} KB  ({len(uploads)} image(s))")
+
+    if args.model:
+        model = load_backend(args.backend, args.model, imgsz=args.imgsz)
+        check_quality(model, [data for uploads in groups.values() for data in uploads], args.imgsz, args.match_iou)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+"""Load test that replays a fleet of ESP32 carriages against /api/analysis/image.
+
+Every simulated carriage behaves like loop() in 22_09_espcam.ino: it uploads
+a VGA JPEG for level 0 / plant 1, waits for the answer, sprays for as long as
+getSprayDurationMs() says, rests, moves up, uploads level 1 / plant 2 and so
+on. A carriage never has more than one request in flight and opens a new
+connection per upload, as HTTPClient does, and a request slower than the
+firmware's HTTP timeout counts as an error. Like inspectLevel(), a carriage
+skips the upload for a plant until the ``next_inspection_s`` of its last
+answer has passed, but still sprays it at that level's last severity;
+--fixed-schedule inspects every plant on every pass as the firmware did
+before. The fleet size is swept and each step reports
+throughput, p50/p95/p99 latency, error rate, skipped inspections, and the
+CPU and RSS of the server processes.
+
+By default every step starts a fresh server with an in-memory MongoDB
+(mongomock) and a stub model that answers after --stub-ms, so the test runs
+anywhere and measures the server's own overhead. --launch dev or gunicorn:N
+runs the real server with the configured model and MongoDB, and --server
+targets one that is already running (--pid to also sample its CPU/RSS).
+
+    python bench_fleet.py --fleet 1 10 50 100 --duration 60 --output fleet.json
+    python bench_fleet.py --fleet 10 50 --time-scale 0.1 --compare fleet.json
+    python bench_fleet.py --launch gunicorn:4 --images captures/ --fleet 20 40 80
+
+--time-scale shortens the firmware delays (0.1 runs a ten times faster
+cycle) to reach high request rates with fewer carriages.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+
+from bench_response_time import percentile
+from bench_workers import child_pids, memory_kb, start_server, wait_ready
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# loop() in 22_09_espcam.ino: (kind, level, plant) for uploads, (kind, ms) for delays
+FIRMWARE_CYCLE = [
+    ("capture", 0, 1),
+    ("spray",),
+    ("wait", 4000),   # short rest
+    ("wait", 2000),   # motorUp
+    ("wait", 2000),   # motorStop settle
+    ("capture", 1, 2),
+    ("spray",),
+    ("wait", 3000),
+    ("wait", 2000),   # motorDown
+    ("wait", 4000),   # pause before next cycle
+]
+# HTTPClient's default TCP timeout on the ESP32
+FIRMWARE_TIMEOUT_S = 5.0
+# config.jpeg_quality = 12 on the camera is roughly libjpeg quality 80
+CAMERA_JPEG_QUALITY = 80
+
+
+def spray_duration_ms(severity):
+    """getSprayDurationMs() from the firmware."""
+    if severity < 0:
+        return 0
+    if severity <= 24:
+        return 500
+    if severity <= 49:
+        return 1000
+    if severity <= 74:
+        return 1100
+    return 1200
+
+
+def cycle_seconds(time_scale):
+    """Length of one firmware cycle without upload and spray time."""
+    return sum(step[1] for step in FIRMWARE_CYCLE if step[0] == "wait") / 1000 * time_scale
+
+
+def camera_jpeg(seed, width=640, height=480):
+    """A VGA test frame for one plant: smooth leaf-like blobs plus sensor noise."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    frame = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    frame = cv2.add(frame, rng.integers(0, 12, frame.shape, dtype=np.uint8))
+    return cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, CAMERA_JPEG_QUALITY])[1].tobytes()
+
+
+def load_captures(folder):
+    paths = sorted(p for ext in ("*.jpg", "*.jpeg") for p in glob.glob(os.path.join(folder, ext)))
+    captures = []
+    for path in paths:
+        with open(path, "rb") as f:
+            captures.append(f.read())
+    if not captures:
+        raise SystemExit(f"No JPEGs found in {folder}")
+    return captures
+
+
+class Carriage(threading.Thread):
+    """One ESP32 carriage running the firmware loop until ``stop`` is set."""
+
+    def __init__(self, url, tower_id, images, time_scale, timeout, start_delay, stop, samples, adaptive=True):
+        super().__init__(name=f"carriage-{tower_id}", daemon=True)
+        self.url = url
+        self.tower_id = tower_id
+        self.images = images  # {(level, plant): [jpeg bytes, ...]}
+        self.time_scale = time_scale
+        self.timeout = timeout
+        self.start_delay = start_delay
+        self.stop = stop
+        self.samples = samples  # shared list of (started, ms, outcome)
+        self.severity = {}  # level -> last infected_percentage, like severity[] in the firmware
+        self.shots = 0
+        self.adaptive = adaptive
+        self.next_due = {}  # (level, plant) -> time.monotonic() when due
+        self.skips = []  # time.time() of each skipped inspection
+
+    def upload(self, level, plant):
+        captures = self.images[(level, plant)]
+        data = captures[self.shots % len(captures)]
+        self.shots += 1
+        req = urllib.request.Request(
+            f"{self.url}?tower={self.tower_id}&level={level}&plant={plant}",
+            data=data, headers={"Content-Type": "image/jpeg"}, method="POST",
+        )
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = resp.read()
+            outcome = "ok"
+        except urllib.error.HTTPError as e:
+            body, outcome = None, f"http_{e.code}"
+        except (socket.timeout, TimeoutError):
+            body, outcome = None, "timeout"
+        except OSError as e:
+            reason = getattr(e, "reason", e)
+            body = None
+            outcome = "timeout" if isinstance(reason, (socket.timeout, TimeoutError)) else "connection"
+        elapsed_ms = (time.perf_counter() - clock) * 1000
+        self.samples.append((started, elapsed_ms, outcome))
+
+        # Like sendPhoto(): a failed upload leaves the last severity in place,
+        # an unreadable answer sets it to -1 (no spray), and anything but a
+        # readable next_inspection_s means the next pass
+        next_inspection_s = 0
+        if body is not None:
+            try:
+                answer = json.loads(body)
+                self.severity[level] = int(answer["infected_percentage"])
+                next_inspection_s = int(answer.get("next_inspection_s") or 0)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.severity[level] = -1
+        # The server's seconds are firmware seconds, so they shrink with the delays
+        self.next_due[(level, plant)] = time.monotonic() + next_inspection_s * self.time_scale
+
+    def pause(self, ms):
+        self.stop.wait(ms / 1000 * self.time_scale)
+
+    def run(self):
+        # Carriages are switched on at different times, not in lockstep
+        if self.stop.wait(self.start_delay):
+            return
+        level = 0
+        while not self.stop.is_set():
+            for step in FIRMWARE_CYCLE:
+                if self.stop.is_set():
+                    return
+                if step[0] == "capture":
+                    level = step[1]
+                    if self.adaptive and time.monotonic() < self.next_due.get(step[1:], 0.0):
+                        self.skips.append(time.time())
+                    else:
+                        self.upload(step[1], step[2])
+                elif step[0] == "spray":
+                    self.pause(spray_duration_ms(self.severity.get(level, -1)))
+                else:
+                    self.pause(step[1])
+
+
+class ProcessSampler(threading.Thread):
+    """Samples CPU time and RSS of a process and its children from /proc."""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(name="process-sampler", daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.peak_rss_kb = 0
+        self.cpu_start = self.wall_start = None
+        self.cpu_end = self.wall_end = None
+
+    def pids(self):
+        try:
+            return [self.pid] + child_pids(self.pid)
+        except OSError:
+            return [self.pid]
+
+    def cpu_seconds(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                # utime and stime, fields 14 and 15 of stat(5)
+                total += int(fields[11]) + int(fields[12])
+            except (OSError, IndexError, ValueError):
+                pass
+        return total / os.sysconf("SC_CLK_TCK")
+
+    def rss_kb(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                total += memory_kb(pid)[0]
+            except OSError:
+                pass
+        return total
+
+    def begin(self):
+        """Starts the measurement window (after the ramp-up)."""
+        self.cpu_start, self.wall_start = self.cpu_seconds(), time.perf_counter()
+        self.peak_rss_kb = self.rss_kb()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.cpu_start is not None:
+                self.peak_rss_kb = max(self.peak_rss_kb, self.rss_kb())
+
+    def finish(self):
+        self.cpu_end, self.wall_end = self.cpu_seconds(), time.perf_counter()
+        self.stopped.set()
+        wall = self.wall_end - self.wall_start
+        return {
+            "cpu_percent": round(100 * (self.cpu_end - self.cpu_start) / wall, 1) if wall > 0 else None,
+            "peak_rss_mb": round(self.peak_rss_kb / 1024, 1),
+            "processes": len(self.pids()),
+        }
+
+
+def fetch_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            return json.load(resp)
+    except (OSError, ValueError):
+        return None
+
+
+def stage_means_ms(server):
+    """Mean time per analysis stage from the server's /metrics histograms."""
+    try:
+        with urllib.request.urlopen(f"{server}/metrics", timeout=10) as resp:
+            text = resp.read().decode()
+    except OSError:
+        return None
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if line.startswith(("analysis_stage_seconds_sum", "analysis_stage_seconds_count")):
+            name, value = line.rsplit(" ", 1)
+            stage = name.split('stage="', 1)[1].split('"', 1)[0]
+            target = sums if name.startswith("analysis_stage_seconds_sum") else counts
+            target[stage] = target.get(stage, 0) + float(value)
+    return {stage: round(1000 * sums[stage] / counts[stage], 2) for stage in sorted(sums) if counts.get(stage)}
+
+
+def server_stats(server):
+    """The server's own counters, for correlating client latency with its stages."""
+    inference = fetch_json(f"{server}/api/inference/stats") or {}
+    postprocess = fetch_json(f"{server}/api/postprocess/stats") or {}
+    pipeline = postprocess.get("pipeline") or {}
+    return {
+        "response_time": postprocess.get("response_time"),
+        "stage_mean_ms": stage_means_ms(server),
+        "inference": inference.get("inference"),
+        "inference_queue_wait": inference.get("queue_wait"),
+        "mean_batch_size": inference.get("mean_batch_size"),
+        "frame_cache": inference.get("frame_cache"),
+        "postprocess_dropped": pipeline.get("dropped"),
+        "mongo_writer": postprocess.get("mongo_writer"),
+    }
+
+
+def run_fleet(server, fleet, images, args, pid=None):
+    """Runs ``fleet`` carriages for the ramp-up plus --duration and summarizes the window."""
+    url = f"{server}/api/analysis/image"
+    ramp = args.ramp if args.ramp is not None else cycle_seconds(args.time_scale)
+    stop = threading.Event()
+    samples = []
+    rng = random.Random(args.seed + fleet)
+    carriages = [
+        Carriage(url, f"bench-{i:04d}", images(i), args.time_scale, args.timeout, rng.uniform(0, ramp), stop, samples,
+                 adaptive=not args.fixed_schedule)
+        for i in range(fleet)
+    ]
+    sampler = ProcessSampler(pid) if pid and os.path.exists(f"/proc/{pid}") else None
+    if sampler is not None:
+        sampler.start()
+    for carriage in carriages:
+        carriage.start()
+
+    time.sleep(ramp)
+    window_start = time.time()
+    if sampler is not None:
+        sampler.begin()
+    time.sleep(args.duration)
+    window_end = time.time()
+    resources = sampler.finish() if sampler is not None else None
+    stop.set()
+    for carriage in carriages:
+        carriage.join(timeout=args.timeout + 1)
+
+    # Only uploads that started inside the measurement window
+    window = [s for s in samples if window_start <= s[0] < window_end]
+    ok = [ms for _, ms, outcome in window if outcome == "ok"]
+    errors = {}
+    for _, _, outcome in window:
+        if outcome != "ok":
+            errors[outcome] = errors.get(outcome, 0) + 1
+    # Upper bound: two uploads per cycle per carriage, with instant answers and no spraying
+    offered = fleet * 2 / cycle_seconds(args.time_scale) if args.time_scale else None
+    return {
+        "fleet": fleet,
+        "seconds": round(window_end - window_start, 2),
+        "requests": len(window),
+        "ok": len(ok),
+        "errors": errors,
+        "skipped_inspections": sum(1 for c in carriages for t in c.skips if window_start <= t < window_end),
+        "error_rate": round(1 - len(ok) / len(window), 4) if window else None,
+        "offered_rps": round(offered, 2) if offered else None,
+        "throughput_rps": round(len(ok) / (window_end - window_start), 2),
+        "latency_ms": {
+            "mean": round(float(np.mean(ok)), 1) if ok else None,
+            "p50": round(percentile(ok, 0.50), 1),
+            "p95": round(percentile(ok, 0.95), 1),
+            "p99": round(percentile(ok, 0.99), 1),
+            "max": round(max(ok), 1) if ok else None,
+        },
+        "server_resources": resources,
+        "server": server_stats(server),
+    }
+
+
+def serve_offline(port, stub_ms, workdir):
+    """Runs server.py with mongomock and a stub model (the child process of --launch offline)."""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("--launch offline needs mongomock (pip install mongomock)")
+    # Images and the Mongo journal go to a scratch folder, not next to server.py
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+    import server
+    from detection_postprocess import ClassMap
+    from inference_backends import Detections
+
+    class StubModel:
+        """Answers after a fixed delay with a few boxes derived from the frame."""
+
+        names = {0: "Healthy_Leaves", 1: "Infected_Leaves"}
+        imgsz = server.MODEL_IMGSZ
+
+        def __call__(self, frames):
+            time.sleep(stub_ms / 1000 * (1 + 0.2 * (len(frames) - 1)))
+            results = []
+            for frame in frames:
+                h, w = frame.shape[:2]
+                count = 4 + int(frame[::32, ::32].mean()) % 8
+                rng = np.random.default_rng(count)
+                x1, y1 = rng.uniform(0, w * 0.8, count), rng.uniform(0, h * 0.8, count)
+                xyxy = np.stack([x1, y1, x1 + w * 0.1, y1 + h * 0.1], axis=1).astype(np.float32)
+                results.append(Detections(xyxy, rng.uniform(0.3, 0.9, count).astype(np.float32),
+                                          rng.integers(0, 2, count).astype(np.int64), self.names, frame))
+            return results
+
+    server.MongoClient = mongomock.MongoClient
+    server.model = StubModel()
+    server.class_map = ClassMap.from_names(server.model.names)
+    server.create_app(load=False)
+    server.app.run(host="127.0.0.1", port=port, threaded=True, use_reloader=False)
+
+
+def launch(mode, port, args):
+    """Starts a server for one sweep step. Returns (process, base URL, scratch dir or None)."""
+    if mode != "offline":
+        proc, server = start_server(mode, port)
+        return proc, server, None
+    workdir = tempfile.mkdtemp(prefix="bench_fleet_")
+    env = dict(os.environ)
+    if args.no_frame_cache:
+        env["FRAME_CACHE_MAX_AGE_S"] = "0"
+    cmd = [sys.executable, os.path.abspath(__file__), "--serve-offline", str(port),
+           "--stub-ms", str(args.stub_ms), "--workdir", workdir]
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc, f"http://127.0.0.1:{port}", workdir
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    latency = result["latency_ms"]
+    print(f"fleet={result['fleet']:<5} offered={result['offered_rps'] or 0:7.2f} req/s  "
+          f"served={result['throughput_rps']:7.2f} req/s  "
+          f"p50={latency['p50']:7.1f}  p95={latency['p95']:7.1f}  p99={latency['p99']:7.1f} ms  "
+          f"errors={100 * (result['error_rate'] or 0):5.2f}%", end="")
+    resources = result["server_resources"]
+    if resources:
+        print(f"  cpu={resources['cpu_percent']:6.1f}%  rss={resources['peak_rss_mb']:7.1f} MB", end="")
+    print()
+    if result.get("skipped_inspections"):
+        print(f"    skipped inspections (not due yet): {result['skipped_inspections']}")
+    if result["errors"]:
+        print(f"    errors: {result['errors']}")
+
+
+def compare(results, baseline_path, tolerance):
+    """Prints the change against an earlier run per fleet size. Returns True if something regressed."""
+    with open(baseline_path) as f:
+        baseline = {r["fleet"]: r for r in json.load(f)["results"]}
+    regressed = False
+    print(f"--- Compared with {baseline_path} (tolerance {tolerance:.0%}) ---")
+    for result in results:
+        before = baseline.get(result["fleet"])
+        if before is None:
+            continue
+        checks = [
+            ("throughput", before["throughput_rps"], result["throughput_rps"], False),
+            ("p95", before["latency_ms"]["p95"], result["latency_ms"]["p95"], True),
+            ("p99", before["latency_ms"]["p99"], result["latency_ms"]["p99"], True),
+        ]
+        parts = []
+        for name, old, new, lower_is_better in checks:
+            change = (new - old) / old if old else 0.0
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            regressed |= worse
+            parts.append(f"{name} {old} -> {new} ({change:+.1%}){' REGRESSED' if worse else ''}")
+        old_errors, new_errors = before["error_rate"] or 0, result["error_rate"] or 0
+        if new_errors > old_errors + 0.01:
+            regressed = True
+            parts.append(f"errors {old_errors:.2%} -> {new_errors:.2%} REGRESSED")
+        print(f"fleet={result['fleet']:<5} " + "  ".join(parts))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet", type=int, nargs="+", default=[1, 5, 10, 25, 50], help="Fleet sizes to sweep")
+    parser.add_argument("--duration", type=float, default=60.0, help="Measured seconds per fleet size")
+    parser.add_argument("--ramp", type=float, help="Seconds before measuring (default: one firmware cycle)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplier for the firmware delays")
+    parser.add_argument("--timeout", type=float, default=FIRMWARE_TIMEOUT_S, help="Per-upload timeout in seconds")
+    parser.add_argument("--images", help="Folder of VGA camera JPEGs (default: synthetic frames)")
+    parser.add_argument("--launch", default="offline",
+                        help="'offline' (mongomock + stub model), 'dev', 'gunicorn:N' or 'none' with --server")
+    parser.add_argument("--server", default="http://localhost:5000", help="Server to test with --launch none")
+    parser.add_argument("--pid", type=int, help="Process to sample CPU/RSS of with --launch none")
+    parser.add_argument("--port", type=int, default=5200, help="First port for launched servers")
+    parser.add_argument("--stub-ms", type=float, default=40.0, help="Inference time of the offline stub model")
+    parser.add_argument("--no-frame-cache", action="store_true", help="Disable the near-duplicate frame cache")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixed-schedule", action="store_true",
+                        help="Inspect every plant on every pass, ignoring next_inspection_s")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative change before flagging")
+    parser.add_argument("--serve-offline", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_offline:
+        serve_offline(args.serve_offline, args.stub_ms, args.workdir)
+        return
+
+    if args.images:
+        captures = load_captures(args.images)
+        # Each carriage photographs its own two plants
+        images = lambda i, captures=captures: {
+            (0, 1): [captures[(2 * i) % len(captures)]],
+            (1, 2): [captures[(2 * i + 1) % len(captures)]],
+        }
+    else:
+        # Two consecutive shots of a plant differ only by sensor noise
+        images = lambda i: {(level, plant): [camera_jpeg(args.seed * 100003 + i * 10 + plant)]
+                            for level, plant in ((0, 1), (1, 2))}
+
+    print(f"Firmware cycle: {cycle_seconds(args.time_scale):.1f} s of delays, 2 uploads per cycle, "
+          f"timeout {args.timeout:.1f} s, server: {args.launch if args.launch != 'none' else args.server}")
+    results = []
+    for i, fleet in enumerate(args.fleet):
+        workdir = None
+        if args.launch == "none":
+            proc, server, pid = None, args.server.rstrip("/"), args.pid
+        else:
+            proc, server, workdir = launch(args.launch, args.port + i, args)
+            pid = proc.pid
+        try:
+            if proc is not None:
+                wait_ready(proc, server, args.startup_timeout)
+            results.append(run_fleet(server, fleet, images, args, pid=pid))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=30)
+            if workdir is not None:
+                shutil.rmtree(workdir, ignore_errors=True)
+        print_result(results[-1])
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {k: v for k, v in vars(args).items() if k not in ("serve_offline", "workdir", "compare", "output")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Measures p50/p99 response time of /api/analysis/image on a running server.
+
+Start the server once with POSTPROCESS_ASYNC=1 and once with POSTPROCESS_ASYNC=0
+and run this script against each to compare:
+
+    python bench_response_time.py --image plant.jpg -n 200 -c 4
+"""
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def post_image(url, data):
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "image/jpeg"}, method="POST")
+    started = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        resp.read()
+        status = resp.status
+    return (time.perf_counter() - started) * 1000, status
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://localhost:5000")
+    parser.add_argument("--image", required=True, help="JPEG file to upload")
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("-c", "--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+
+    url = f"{args.server}/api/analysis/image"
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        samples = list(pool.map(lambda _: post_image(url, data), range(args.requests)))
+
+    latencies = [ms for ms, status in samples if status == 200]
+    with urllib.request.urlopen(f"{args.server}/api/postprocess/stats", timeout=10) as resp:
+        server_stats = json.load(resp)
+
+    print(f"Post-processing async: {server_stats['async_enabled']}")
+    print(f"Requests: {len(samples)}  OK: {len(latencies)}  Concurrency: {args.concurrency}")
+    print(f"Client p50: {percentile(latencies, 0.50):.1f} ms  p99: {percentile(latencies, 0.99):.1f} ms")
+    print(f"Server p50: {server_stats['response_time']['p50_ms']:.1f} ms  "
+          f"p99: {server_stats['response_time']['p99_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Measures how long server.py takes to import and to start serving after a restart.
+
+Import: runs ``python -X importtime -c "import server"`` in a fresh
+interpreter and reports the total and the slowest direct imports.
+
+Startup: starts the server (``dev`` = python server.py, ``gunicorn:N``) and
+from the moment of launch polls every --poll seconds for
+
+- live: first 200 from /api/health/live (the process accepts requests)
+- ready: first 200 from /api/health/ready (model loaded and warmed up)
+- analysis: first 200 for an uploaded image
+
+while uploading the image the way a carriage would, counting what it gets
+back in the meantime: a refused connection, a quick 503 or a result. Each
+configuration runs with the model loaded in the background
+(STARTUP_BACKGROUND=1, the default) and blocking the startup (=0).
+
+    python bench_startup.py --image plant.jpg
+    MODEL_BACKEND=onnx MODEL_PATH=best.onnx python bench_startup.py --image plant.jpg --configs dev gunicorn:2 --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+from bench_workers import HERE, start_server
+
+MODES = {"background": "1", "blocking": "0"}
+
+
+def import_times(top=8):
+    """Returns (total ms, [(module, cumulative ms), ...]) for ``import server`` in a fresh interpreter."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"], cwd=HERE,
+                          capture_output=True, text=True, env=dict(os.environ, STREAM_CONFIG=""))
+    if proc.returncode != 0:
+        raise RuntimeError(f"import server failed:\n{proc.stderr[-2000:]}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, _, rest = line.partition(":")
+        _, cumulative, name = rest.split("|")
+        # Nesting is shown by two spaces of indent per level
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative) / 1000))
+    server_index = next(i for i, (_, name, _) in enumerate(entries) if name == "server")
+    depth, _, total = entries[server_index]
+    # Children are listed before their parent, back to the previous entry at the same depth or above
+    children = []
+    for child_depth, name, ms in reversed(entries[:server_index]):
+        if child_depth <= depth:
+            break
+        if child_depth == depth + 2:
+            children.append((name, ms))
+    return total, sorted(children, key=lambda c: -c[1])[:top]
+
+
+def upload(url, data):
+    """Returns what a carriage would see: an HTTP status or 'refused'."""
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "image/jpeg"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return "refused"
+
+
+def get_status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except (OSError, ValueError):
+        return None, None
+
+
+def measure_startup(config, mode, port, data, args):
+    launched = time.perf_counter()
+    proc, server = start_server(config, port, {"STARTUP_BACKGROUND": MODES[mode]})
+    marks = {"live": None, "ready": None, "analysis": None}
+    uploads = Counter()
+    snapshot = None
+    try:
+        while None in marks.values() and time.perf_counter() - launched < args.timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Server exited with code {proc.returncode}")
+            if marks["live"] is None and get_status(f"{server}/api/health/live")[0] == 200:
+                marks["live"] = time.perf_counter() - launched
+            if marks["ready"] is None:
+                status, body = get_status(f"{server}/api/health/ready")
+                if status == 200:
+                    marks["ready"] = time.perf_counter() - launched
+                    snapshot = body
+            if marks["analysis"] is None:
+                status = upload(f"{server}/api/analysis/image", data)
+                uploads[status] += 1
+                if status == 200:
+                    marks["analysis"] = time.perf_counter() - launched
+            time.sleep(args.poll)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    components = {name: c["ready_after_s"] for name, c in (snapshot or {}).get("components", {}).items()}
+    return {"config": config, "mode": mode, **marks, "uploads": dict(uploads), "components": components}
+
+
+def median_of(runs, key):
+    values = [run[key] for run in runs if run[key] is not None]
+    return statistics.median(values) if values else None
+
+
+def print_summary(config, mode, runs):
+    def seconds(value):
+        return f"{value:6.2f} s" if value is not None else "   n/a  "
+
+    uploads = Counter()
+    for run in runs:
+        uploads.update({str(k): v for k, v in run["uploads"].items()})
+    print(f"{config:<11} {mode:<10} live={seconds(median_of(runs, 'live'))}  "
+          f"ready={seconds(median_of(runs, 'ready'))}  analysis={seconds(median_of(runs, 'analysis'))}  "
+          f"uploads before it: {dict(uploads)}")
+    components = runs[-1]["components"]
+    if components:
+        print(f"{'':<22} components ready after (s, from import): {components}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", required=True, help="JPEG file to upload")
+    parser.add_argument("--configs", nargs="+", default=["dev"],
+                        help="'dev' for python server.py, 'gunicorn:N' for N workers")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["background", "blocking"])
+    parser.add_argument("--repeat", type=int, default=1, help="Restarts per configuration and mode (median)")
+    parser.add_argument("--poll", type=float, default=0.05, help="Seconds between probes")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--port", type=int, default=5200, help="Port for the gunicorn configurations")
+    parser.add_argument("--skip-import", action="store_true")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+
+    results = {"startup": []}
+    if not args.skip_import:
+        total, children = import_times()
+        results["import"] = {"total_ms": total, "slowest": children}
+        print(f"import server: {total:.0f} ms")
+        for name, ms in children:
+            print(f"  {name:<24} {ms:7.1f} ms")
+        print()
+
+    for i, config in enumerate(args.configs):
+        for mode in args.modes:
+            runs = [measure_startup(config, mode, args.port + i, data, args) for _ in range(args.repeat)]
+            results["startup"].extend(runs)
+            print_summary(config, mode, runs)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
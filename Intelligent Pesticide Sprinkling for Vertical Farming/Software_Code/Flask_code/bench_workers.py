@@ -0,0 +1,150 @@
+"""Compares the development server with multi-worker gunicorn (Linux only).
+
+Starts each configuration in turn, uploads the image from --concurrency
+clients for --duration seconds and reports requests per second plus the
+memory of every server process. RSS counts shared pages in every process
+that maps them; PSS splits them between the processes, so the PSS total is
+what the configuration really costs and shows how much of the preloaded
+model the workers share.
+
+    python bench_workers.py --image plant.jpg --configs dev gunicorn:2 gunicorn:4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_response_time import percentile, post_image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def child_pids(pid):
+    pids = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            pids.extend(int(p) for p in f.read().split())
+    return pids
+
+
+def memory_kb(pid):
+    """Returns (rss_kb, pss_kb) of one process from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name] = int(rest.split()[0])
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+
+def start_server(config, port, extra_env=None):
+    env = dict(os.environ, **(extra_env or {}))
+    if config == "dev":
+        # server.py always listens on 5000
+        cmd = [sys.executable, "server.py"]
+        port = 5000
+    else:
+        _, _, workers = config.partition(":")
+        env["WEB_WORKERS"] = workers or "2"
+        env["BIND"] = f"127.0.0.1:{port}"
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"]
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def wait_ready(proc, server, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        try:
+            # 503 (an HTTPError, so an OSError) until the model is loaded and warmed up
+            with urllib.request.urlopen(f"{server}/api/health/ready", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {timeout} s")
+
+
+def drive_load(url, data, concurrency, duration):
+    deadline = time.time() + duration
+
+    def client(_):
+        samples = []
+        while time.time() < deadline:
+            try:
+                samples.append(post_image(url, data))
+            except OSError:
+                samples.append((0.0, 0))
+        return samples
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return [s for samples in pool.map(client, range(concurrency)) for s in samples]
+
+
+def run_config(config, port, data, args):
+    proc, server = start_server(config, port)
+    try:
+        wait_ready(proc, server, args.startup_timeout)
+        # Let every worker finish its warm-up before measuring
+        time.sleep(args.settle)
+        samples = drive_load(f"{server}/api/analysis/image", data, args.concurrency, args.duration)
+        workers = child_pids(proc.pid) if config != "dev" else [proc.pid]
+        memory = {pid: memory_kb(pid) for pid in [proc.pid] + [w for w in workers if w != proc.pid]}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    latencies = [ms for ms, status in samples if status == 200]
+    return {
+        "config": config,
+        "workers": len(workers),
+        "requests": len(samples),
+        "ok": len(latencies),
+        "rps": len(latencies) / args.duration,
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "master": proc.pid if config != "dev" else None,
+        "memory": memory,
+    }
+
+
+def print_result(result):
+    print(f"--- {result['config']} ({result['workers']} worker process(es)) ---")
+    print(f"Requests: {result['requests']}  OK: {result['ok']}  {result['rps']:.1f} req/s  "
+          f"p50={result['p50_ms']:.1f} ms  p99={result['p99_ms']:.1f} ms")
+    for pid, (rss, pss) in result["memory"].items():
+        role = "master" if pid == result["master"] else "worker"
+        print(f"  {role:<6} pid={pid:<7} RSS={rss / 1024:7.1f} MB  PSS={pss / 1024:7.1f} MB")
+    total_rss = sum(rss for rss, _ in result["memory"].values())
+    total_pss = sum(pss for _, pss in result["memory"].values())
+    print(f"  total  RSS={total_rss / 1024:.1f} MB  PSS={total_pss / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", required=True, help="JPEG file to upload")
+    parser.add_argument("--configs", nargs="+", default=["dev", "gunicorn:2", "gunicorn:4"],
+                        help="'dev' for python server.py, 'gunicorn:N' for N workers")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load per configuration")
+    parser.add_argument("--port", type=int, default=5100, help="Port for the gunicorn configurations")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--settle", type=float, default=3.0, help="Seconds to wait after the server answers")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+
+    for i, config in enumerate(args.configs):
+        print_result(run_config(config, args.port + i, data, args))
+
+
+if __name__ == "__main__":
+    main()
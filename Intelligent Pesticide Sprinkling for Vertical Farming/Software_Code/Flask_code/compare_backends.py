@@ -0,0 +1,124 @@
+"""Checks accuracy parity and benchmarks two model backends on the same images.
+
+    python compare_backends.py --images val_images/ \\
+        --reference ultralytics:best.pt --candidate onnx:best.onnx
+
+For every image the candidate's detections are matched to the reference's
+(same class, IoU >= --match-iou). The script reports recall/precision of the
+candidate against the reference, the difference in infected percentage, and
+per-image latency and throughput for both backends.
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detection_postprocess import ClassMap, summarize
+from inference_backends import load_backend, warm_up
+
+
+def box_iou(a, b):
+    """IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod((br - tl).clip(0), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_detections(ref, cand, iou_threshold):
+    """Greedy one-to-one matching by IoU within each class. Returns matched IoUs."""
+    matched = []
+    for cls in np.intersect1d(ref.cls, cand.cls):
+        ref_boxes = ref.xyxy[ref.cls == cls]
+        cand_boxes = cand.xyxy[cand.cls == cls]
+        iou = box_iou(ref_boxes, cand_boxes)
+        while iou.size and iou.max() >= iou_threshold:
+            i, j = np.unravel_index(iou.argmax(), iou.shape)
+            matched.append(iou[i, j])
+            iou[i, :] = -1
+            iou[:, j] = -1
+    return matched
+
+
+def benchmark(model, frames, runs):
+    latencies = []
+    for _ in range(runs):
+        for frame in frames:
+            started = time.perf_counter()
+            model([frame])
+            latencies.append((time.perf_counter() - started) * 1000)
+    total_s = sum(latencies) / 1000
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(np.mean(latencies)),
+        "images_per_s": len(latencies) / total_s if total_s else 0.0,
+    }
+
+
+def parse_spec(spec):
+    backend, _, path = spec.partition(":")
+    return backend, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Folder of test images")
+    parser.add_argument("--reference", default="ultralytics:best.pt", help="backend:path of the reference model")
+    parser.add_argument("--candidate", required=True, help="backend:path of the model to check")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--limit", type=int, default=200, help="Use at most this many images")
+    parser.add_argument("--match-iou", type=float, default=0.5)
+    parser.add_argument("--runs", type=int, default=3, help="Benchmark passes over the image set")
+    args = parser.parse_args()
+
+    paths = sorted(p for ext in ("*.jpg", "*.jpeg", "*.png") for p in glob.glob(os.path.join(args.images, ext)))
+    frames = [cv2.imread(p) for p in paths[:args.limit]]
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        raise SystemExit(f"No images found in {args.images}")
+
+    models = {}
+    for label, spec in (("reference", args.reference), ("candidate", args.candidate)):
+        backend, path = parse_spec(spec)
+        models[label] = load_backend(backend, path, imgsz=args.imgsz, conf=args.conf)
+        warm_up(models[label])
+
+    class_map = ClassMap.from_names(models["reference"].names)
+    ref_total = cand_total = matched_total = 0
+    matched_ious = []
+    pct_diffs = []
+    for frame in frames:
+        ref = models["reference"]([frame])[0]
+        cand = models["candidate"]([frame])[0]
+        matched = match_detections(ref, cand, args.match_iou)
+        ref_total += len(ref)
+        cand_total += len(cand)
+        matched_total += len(matched)
+        matched_ious.extend(matched)
+        pct_diffs.append(abs(summarize(ref, class_map)["infected_percentage"]
+                             - summarize(cand, class_map)["infected_percentage"]))
+
+    print(f"Images: {len(frames)}")
+    print("--- Accuracy parity (candidate vs reference) ---")
+    print(f"Detections: reference={ref_total} candidate={cand_total} matched={matched_total}")
+    print(f"Recall: {matched_total / ref_total if ref_total else 1.0:.4f}  "
+          f"Precision: {matched_total / cand_total if cand_total else 1.0:.4f}  "
+          f"Mean IoU of matches: {np.mean(matched_ious) if matched_ious else 0.0:.4f}")
+    print(f"Infected % abs diff: mean={np.mean(pct_diffs):.3f}  max={np.max(pct_diffs):.3f}")
+
+    print("--- Latency (single image, batch of 1) ---")
+    for label, model in models.items():
+        stats = benchmark(model, frames, args.runs)
+        print(f"{label:<10} {model.name:<12} p50={stats['p50_ms']:.1f} ms  p95={stats['p95_ms']:.1f} ms  "
+              f"mean={stats['mean_ms']:.1f} ms  {stats['images_per_s']:.1f} img/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Turns per-frame detections into leaf counts and infection severity.
+
+Class IDs are resolved once from the model's class names, and counting is a
+single ``np.bincount`` over the NumPy class array, so nothing here loops over
+boxes in Python.
+"""
+import numpy as np
+
+# Class names as written in data.yaml
+HEALTHY_CLASS = "Healthy_Leaves"
+INFECTED_CLASS = "Infected_Leaves"
+
+
+class ClassMap:
+    """Class IDs of the healthy and infected leaf classes for one model."""
+
+    def __init__(self, healthy_id, infected_id, num_classes):
+        self.healthy_id = healthy_id
+        self.infected_id = infected_id
+        self.num_classes = num_classes
+
+    @classmethod
+    def from_names(cls, names, healthy=HEALTHY_CLASS, infected=INFECTED_CLASS):
+        """Resolves class IDs from a model's ``names``. Raises if either class is missing."""
+        ids = {name: int(class_id) for class_id, name in dict(names).items()}
+        missing = [name for name in (healthy, infected) if name not in ids]
+        if missing:
+            raise ValueError(f"Model classes {sorted(ids)} do not include {missing}; "
+                             f"check the class names in data.yaml")
+        return cls(ids[healthy], ids[infected], max(ids.values()) + 1)
+
+
+def summarize(detections, class_map, conf_threshold=0.0):
+    """Counts healthy/infected leaves and computes infection percentages.
+
+    ``infected_percentage`` is the share of infected leaves by count.
+    ``infected_area_percentage`` weights each leaf by its box area, so a few
+    large infected leaves count for more than many small healthy ones.
+    """
+    keep = detections.conf >= conf_threshold
+    cls = detections.cls[keep]
+    xyxy = detections.xyxy[keep]
+
+    counts = np.bincount(cls, minlength=class_map.num_classes)
+    healthy = int(counts[class_map.healthy_id])
+    infected = int(counts[class_map.infected_id])
+    total = healthy + infected
+
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    area_by_class = np.bincount(cls, weights=areas, minlength=class_map.num_classes)
+    healthy_area = float(area_by_class[class_map.healthy_id])
+    infected_area = float(area_by_class[class_map.infected_id])
+    total_area = healthy_area + infected_area
+
+    return {
+        "healthy_count": healthy,
+        "infected_count": infected,
+        "infected_percentage": infected / total * 100 if total else 0.0,
+        "infected_area_percentage": infected_area / total_area * 100 if total_area else 0.0,
+    }
@@ -0,0 +1,155 @@
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+log = logging.getLogger(__name__)
+
+
+class EventHub:
+    """In-process fan-out of analysis events to server-sent-event clients.
+
+    Every subscriber gets its own bounded queue. ``publish`` never blocks: if a
+    slow client's queue is full its oldest event is dropped, so a stalled
+    browser tab can't hold up the workers that publish.
+
+    Each connected client occupies a server thread, so with ``max_subscribers``
+    set ``subscribe`` returns None once that many are connected (0 = no limit).
+    """
+
+    def __init__(self, client_queue_size=32, max_subscribers=0):
+        self.client_queue_size = client_queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            if self.max_subscribers and len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            while True:
+                try:
+                    q.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        self.published += 1
+
+    def stream(self, q, heartbeat=15.0):
+        """Yields SSE-formatted messages for one subscriber until it disconnects."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                event_id = event.get("_id")
+                prefix = f"id: {event_id}\n" if event_id else ""
+                yield f"{prefix}event: analysis\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "max_subscribers": self.max_subscribers,
+            "published": self.published,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+class MongoRelay:
+    """Feeds analyses written by *other* worker processes into this process.
+
+    With several workers each one has its own EventHub and recent-analysis
+    cache, and only sees the uploads it handled itself. The relay polls
+    MongoDB once per ``interval`` for documents created in the last
+    ``lookback`` seconds and hands the ones this process hasn't seen to
+    ``on_document``. That is one small query per worker, however many
+    dashboards are connected.
+    """
+
+    def __init__(self, collection, on_document, interval=1.0, lookback=15.0, max_seen=10000):
+        self.collection = collection
+        self.on_document = on_document
+        self.interval = interval
+        self.lookback = timedelta(seconds=lookback)
+        self.max_seen = max_seen
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.relayed = 0
+        self.errors = 0
+
+    def mark_seen(self, document_id):
+        """Records a document this process produced itself, so it isn't relayed back."""
+        with self._lock:
+            self._seen[str(document_id)] = True
+            while len(self._seen) > self.max_seen:
+                self._seen.popitem(last=False)
+
+    def start(self):
+        # Documents that already exist were loaded by the cache warm-up; don't replay them
+        try:
+            self.poll(publish=False)
+        except Exception as e:
+            log.warning(f"Relay could not read recent analyses: {e}")
+        self._thread = threading.Thread(target=self._run, name="mongo-relay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 2)
+
+    def poll(self, publish=True):
+        since = ObjectId.from_datetime(datetime.now(timezone.utc) - self.lookback)
+        for doc in self.collection.find({"_id": {"$gt": since}}).sort("_id", 1):
+            with self._lock:
+                if str(doc["_id"]) in self._seen:
+                    continue
+            self.mark_seen(doc["_id"])
+            if publish:
+                self.on_document(doc)
+                self.relayed += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.errors += 1
+                log.error(f"Relay poll failed: {e}")
+
+    def stats(self):
+        return {"interval_s": self.interval, "relayed": self.relayed, "errors": self.errors}
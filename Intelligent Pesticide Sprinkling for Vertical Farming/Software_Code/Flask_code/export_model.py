@@ -0,0 +1,31 @@
+"""Exports the trained best.pt to ONNX or OpenVINO for the CPU backends.
+
+    python export_model.py --weights best.pt --format onnx
+    MODEL_BACKEND=onnx MODEL_PATH=best.onnx python server.py
+"""
+import argparse
+
+from ultralytics import YOLO
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", required=True, help="Path to best.pt")
+    parser.add_argument("--format", choices=["onnx", "openvino"], default="onnx")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--static-batch", action="store_true",
+                        help="Export with a fixed batch size of 1 instead of a dynamic batch axis")
+    args = parser.parse_args()
+
+    model = YOLO(args.weights)
+    exported = model.export(
+        format=args.format,
+        imgsz=args.imgsz,
+        dynamic=not args.static_batch,
+        simplify=args.format == "onnx",
+    )
+    print(f"[INFO] Exported {args.weights} -> {exported}")
+
+
+if __name__ == "__main__":
+    main()
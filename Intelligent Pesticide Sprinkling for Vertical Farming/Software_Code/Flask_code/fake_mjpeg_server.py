@@ -0,0 +1,132 @@
+"""Local stand-in for ESP32-CAM ``/stream`` endpoints, for testing stream_ingest.py offline.
+
+Serves ``/stream/<n>`` for cameras 0..N-1 in the format of the ESP32
+CameraWebServer example: ``multipart/x-mixed-replace`` with chunked transfer
+encoding and a Content-Length per part. Each camera sends synthetic VGA
+JPEGs at ``fps``; ``drop_after`` makes it hang up after that many frames to
+exercise reconnects.
+
+    python fake_mjpeg_server.py --cameras 50 --fps 10 --port 8081
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from bench_fleet import camera_jpeg
+
+# Same boundary as the ESP32 CameraWebServer example
+PART_BOUNDARY = "123456789000000000000987654321"
+
+
+class FakeMjpegServer:
+    def __init__(self, cameras=1, fps=10.0, drop_after=0, chunked=True, content_length=True,
+                 host="127.0.0.1", port=0, distinct_frames=4):
+        self.cameras = cameras
+        self.fps = fps
+        self.drop_after = drop_after
+        self.chunked = chunked
+        self.content_length = content_length
+        self.host = host
+        self.port = port
+        self.frames = [camera_jpeg(seed) for seed in range(distinct_frames)]
+        self.frames_sent = 0
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name="fake-mjpeg", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join(10)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with self._server:
+            await self._stopped.wait()
+
+    def _body(self, data):
+        if not self.chunked:
+            return data
+        return f"{len(data):X}\r\n".encode() + data + b"\r\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            path = request.split(b" ", 2)[1].decode("latin-1")
+            prefix, _, number = path.rpartition("/")
+            if prefix != "/stream" or not number.isdigit() or int(number) >= self.cameras:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+                return
+            camera = int(number)
+            self.connections += 1
+            headers = (f"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace;boundary={PART_BOUNDARY}\r\n"
+                       f"Access-Control-Allow-Origin: *\r\n")
+            if self.chunked:
+                headers += "Transfer-Encoding: chunked\r\n"
+            writer.write((headers + "\r\n").encode("latin-1"))
+
+            sent = 0
+            period = 1.0 / self.fps
+            next_at = time.monotonic()
+            while not self.drop_after or sent < self.drop_after:
+                frame = self.frames[(camera + sent) % len(self.frames)]
+                part = f"\r\n--{PART_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                if self.content_length:
+                    part += f"Content-Length: {len(frame)}\r\n"
+                part += f"X-Timestamp: {time.time():.6f}\r\n\r\n"
+                writer.write(self._body(part.encode("latin-1")))
+                writer.write(self._body(frame))
+                await writer.drain()
+                sent += 1
+                self.frames_sent += 1
+                next_at += period
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--drop-after", type=int, default=0, help="Hang up after this many frames (0 = never)")
+    parser.add_argument("--no-chunked", action="store_true", help="Send the stream without chunked encoding")
+    parser.add_argument("--no-content-length", action="store_true", help="Leave Content-Length out of the parts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    server = FakeMjpegServer(args.cameras, args.fps, args.drop_after, not args.no_chunked,
+                             not args.no_content_length, args.host, args.port).start()
+    print(f"[INFO] Serving {args.cameras} fake camera(s) at {server.url}/stream/0 .. /stream/{args.cameras - 1}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Skips inference for frames that barely differ from the last one of the same plant.
+
+The carriages stop at the same positions every cycle, so consecutive shots of
+one plant are usually the same picture with a little sensor noise. Each
+camera position keeps the fingerprint of the last frame that went through
+the model, together with its detections:
+
+* the fingerprint is a 64x48 grayscale thumbnail (area-averaged, which
+  smooths out JPEG and sensor noise);
+* a new frame is a duplicate if, after removing the overall brightness
+  change, no thumbnail pixel differs by more than ``max_pixel_diff``.
+  Comparing the largest local change rather than an average means a
+  newly infected patch still forces a fresh inference;
+* an entry is only reused for ``max_age`` seconds after the inference it
+  came from, so detections are refreshed at least that often even for a
+  plant that never changes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+FINGERPRINT_SIZE = (64, 48)
+
+
+def fingerprint(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class NearDuplicateCache:
+    def __init__(self, max_age=120.0, max_pixel_diff=12, max_entries=1024):
+        self.max_age = max_age
+        self.max_pixel_diff = max_pixel_diff
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (fingerprint, detections, inference_ms, created)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.saved_ms = 0.0
+
+    def lookup(self, key, frame):
+        """Returns (cached_detections or None, fingerprint). Pass the fingerprint to ``store``."""
+        current = fingerprint(frame)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, current
+            cached, detections, inference_ms, created = entry
+            if time.monotonic() - created > self.max_age:
+                self.expired += 1
+                self.misses += 1
+                return None, current
+            diff = current - cached
+            diff -= int(diff.mean())
+            if np.abs(diff).max() > self.max_pixel_diff:
+                self.misses += 1
+                return None, current
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += inference_ms
+            return detections, current
+
+    def store(self, key, current, detections, inference_ms):
+        with self._lock:
+            self._entries[key] = (current, detections, inference_ms, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_age_s": self.max_age,
+            "max_pixel_diff": self.max_pixel_diff,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "inference_ms_saved": round(self.saved_ms, 1),
+        }
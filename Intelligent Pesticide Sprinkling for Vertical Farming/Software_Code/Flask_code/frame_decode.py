@@ -0,0 +1,68 @@
+"""Decodes uploaded JPEGs at the smallest resolution the model can use.
+
+The model letterboxes every frame down to ``imgsz`` anyway, so decoding a
+1600x1200 upload at full size for a 640 model wastes most of the decode. The
+JPEG header is read first (no decoding), and libjpeg's DCT scaling decodes
+straight to 1/2, 1/4 or 1/8 size when the result is still at least
+``imgsz`` on its long side. The model sees the same pixels it would have
+after its own resize, and boxes come back in the reduced frame's
+coordinates; the counts and percentages don't depend on the scale.
+"""
+import struct
+
+import cv2
+import numpy as np
+
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def jpeg_dimensions(data):
+    """Returns (width, height) from a JPEG's SOF header without decoding it, or None."""
+    view = memoryview(data)
+    if view[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    try:
+        while pos + 4 <= len(view):
+            if view[pos] != 0xFF:
+                return None
+            marker = view[pos + 1]
+            if marker == 0xFF:
+                pos += 1  # fill byte
+                continue
+            length = struct.unpack_from(">H", view, pos + 2)[0]
+            # SOF0..SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack_from(">HH", view, pos + 5)
+                return width, height
+            pos += 2 + length
+    except struct.error:
+        return None
+    return None
+
+
+def reduction_for(width, height, imgsz):
+    """Largest DCT scale factor that keeps the long side at least ``imgsz``."""
+    for factor in (8, 4, 2):
+        if max(width, height) // factor >= imgsz:
+            return factor
+    return 1
+
+
+def decode_for_model(data, imgsz):
+    """Decodes JPEG bytes for a model with input size ``imgsz``.
+
+    Returns (frame, factor) where ``factor`` is how much smaller the frame
+    is than the upload; frame is None if the bytes can't be decoded.
+    Non-JPEG uploads are decoded at full size.
+    """
+    # frombuffer wraps the request bytes without copying them
+    buffer = np.frombuffer(data, np.uint8)
+    dimensions = jpeg_dimensions(data)
+    factor = reduction_for(*dimensions, imgsz) if dimensions else 1
+    return cv2.imdecode(buffer, REDUCED_FLAGS[factor]), factor
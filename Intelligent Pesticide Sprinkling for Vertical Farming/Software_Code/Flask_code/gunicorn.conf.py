@@ -0,0 +1,78 @@
+"""Production entry point: several worker processes behind one port.
+
+    gunicorn -c gunicorn.conf.py
+    WEB_WORKERS=4 MODEL_BACKEND=onnx MODEL_PATH=best.onnx gunicorn -c gunicorn.conf.py
+
+Each worker is a separate process, so uploads are analysed in parallel
+instead of contending for one interpreter. The cores are split between the
+workers (WORKER_THREADS = cores / workers) so N workers don't each start a
+thread pool the size of the machine.
+
+For the ultralytics backend the model is loaded once in the master before it
+forks, so the workers share the weight pages copy-on-write instead of each
+holding its own copy. ONNX Runtime and OpenVINO sessions are not fork-safe,
+so with those backends every worker loads the model after the fork.
+OpenVINO memory-maps the exported .bin weights, so their pages are still
+shared through the page cache; ONNX Runtime keeps a private copy per worker
+(about 12 MB for the exported YOLOv8s graph).
+
+gunicorn only runs on Linux/macOS; on Windows use ``python server.py``.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_WORKERS", max(1, multiprocessing.cpu_count() // 2)))
+# Every open /api/analysis/stream connection holds one of these threads, so
+# each worker takes at most SSE_MAX_CLIENTS of them (503 beyond that, and the
+# dashboard polls instead) and keeps the remaining threads for uploads and
+# health checks
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 16))
+os.environ.setdefault("SSE_MAX_CLIENTS", str(max(1, threads // 2)))
+# Model loading and warm-up run on a thread after the fork, but a CPU-bound
+# load can still hold up the worker's heartbeat
+timeout = 120
+
+# Set before server.py is imported, which is when it reads these
+_threads_per_worker = max(1, multiprocessing.cpu_count() // workers)
+for _name in ("WORKER_THREADS", "MODEL_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_name, str(_threads_per_worker))
+if workers > 1:
+    # Lets every worker's dashboard stream see analyses handled by the other workers
+    os.environ.setdefault("EVENT_RELAY_INTERVAL_S", "1.0")
+
+# Import server.py in the master without loading the model or starting
+# services; on_starting and post_fork below decide where each happens
+preload_app = True
+wsgi_app = "server:create_app(load=False, start=False)"
+
+_SHARE_MODEL_BACKENDS = ("ultralytics",)
+
+
+def on_starting(server):
+    import server as app_module
+
+    if app_module.MODEL_BACKEND not in _SHARE_MODEL_BACKENDS:
+        # Loaded per worker in post_fork; see the module docstring
+        return
+    app_module.load_model()
+    # Keep the garbage collector from touching (and so copying) the preloaded
+    # objects in every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import server as app_module
+
+    # Loads the model if the master didn't; the worker serves health checks
+    # while it loads and warms up, see /api/health/ready
+    app_module.start_services(load=True)
+    server.log.info(f"Worker {worker.pid} started ({os.environ['WORKER_THREADS']} threads)")
+
+
+def worker_exit(server, worker):
+    import server as app_module
+
+    app_module.shutdown_services()
@@ -0,0 +1,72 @@
+"""Startup state of the server's components, for liveness and readiness probes.
+
+Each component (model, MongoDB, camera streams, ...) is registered with a
+state that the thread starting it moves along:
+
+    starting -> ready
+             -> failed (with the error as detail; may go back to starting on a retry)
+    disabled    (not configured, ignored for readiness)
+
+The server is ready once every *required* component is ready. Liveness
+only says the process answers requests, so a restart isn't triggered just
+because the model is still loading.
+"""
+import threading
+import time
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+DISABLED = "disabled"
+
+
+class HealthRegistry:
+    def __init__(self):
+        self._components = {}
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+
+    def register(self, name, required=True, state=STARTING, detail=None):
+        with self._lock:
+            self._components[name] = {
+                "state": state,
+                "required": required,
+                "detail": detail,
+                "since": time.monotonic(),
+                "ready_after_s": None,
+            }
+
+    def set(self, name, state, detail=None):
+        now = time.monotonic()
+        with self._lock:
+            component = self._components[name]
+            component["state"] = state
+            component["detail"] = detail
+            component["since"] = now
+            if state == READY and component["ready_after_s"] is None:
+                # Time from process start until the component first became usable
+                component["ready_after_s"] = round(now - self.started_at, 3)
+
+    def state(self, name):
+        component = self._components.get(name)
+        return component["state"] if component else None
+
+    def ready(self):
+        with self._lock:
+            return all(c["state"] in (READY, DISABLED) for c in self._components.values() if c["required"])
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            components = {
+                name: {
+                    "state": c["state"],
+                    "required": c["required"],
+                    "detail": c["detail"],
+                    "seconds_in_state": round(now - c["since"], 3),
+                    "ready_after_s": c["ready_after_s"],
+                }
+                for name, c in self._components.items()
+            }
+        ready = all(c["state"] in (READY, DISABLED) for c in components.values() if c["required"])
+        return {"ready": ready, "uptime_s": round(now - self.started_at, 3), "components": components}
@@ -0,0 +1,492 @@
+"""Exports analysis_data to day-partitioned Parquet files, incrementally, and queries them.
+
+Season-long questions (how did tower 3 develop since May, which plants
+crossed 25 %) scan months of analyses; running them against the production
+MongoDB competes with the server's writes. This copies the history into
+columnar files once, and each later run appends only what is new:
+
+    python history_export.py export --out analysis_parquet
+    python history_export.py query --out analysis_parquet --since 2026-05-01 --tower tower-3 --min-infected 25
+    python history_export.py compact --out analysis_parquet
+
+Layout, hive-style, so pyarrow, pandas, DuckDB or Spark read it as is:
+
+    analysis_parquet/
+      _export_state.json                   high-water mark and run bookkeeping
+      day=2026-10-15/part-<run>-0.parquet  one file per run that had data for the day
+      day=2026-10-16/part-<run>-0.parquet
+
+Columns are typed (UTC timestamps, int32 counts, float32 percentages,
+dictionary-encoded tower, plant and model version) and zstd-compressed.
+
+An export reads only documents with an ``_id`` above the high-water mark,
+in ``_id`` order over the primary index and with a projection, and writes one
+file per day it touches. The files are written under a temporary name and
+renamed once complete; the high-water mark moves only at the end of the
+run, and the files of a run that died half way are deleted by the next one. Documents
+younger than --settle seconds are left for the next run, so analyses still
+in the server's write buffer aren't skipped. ``compact`` merges the files
+of each day into one, sorted by time.
+
+Analyses that change or arrive after the high-water mark has passed them
+(rescored by reanalyze.py, or journaled during a MongoDB outage and
+replayed later) are not picked up by a normal run; ``export --since DAY``
+rewrites the days from DAY on.
+
+``scan()`` reads the files, never MongoDB: the time range prunes whole day
+partitions before a file is opened, and the other filters are checked
+against the Parquet row-group statistics, so only the matching row groups
+of the requested columns are read.
+
+Needs pyarrow (pip install pyarrow).
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    raise SystemExit("history_export.py needs pyarrow (pip install pyarrow)")
+
+STATE_FILE = "_export_state.json"
+DEFAULT_OUT = "analysis_parquet"
+ROW_GROUP_ROWS = 64 * 1024
+
+SCHEMA = pa.schema([
+    ("_id", pa.string()),
+    ("timestamp", pa.timestamp("ms", tz="UTC")),
+    ("tower_id", pa.dictionary(pa.int32(), pa.string())),
+    ("level", pa.int16()),
+    ("plant_id", pa.dictionary(pa.int32(), pa.string())),
+    ("healthy_count", pa.int32()),
+    ("infected_count", pa.int32()),
+    ("infected_percentage", pa.float32()),
+    ("infected_area_percentage", pa.float32()),
+    ("severity_ewma", pa.float32()),
+    ("severity_trend", pa.float32()),
+    ("next_inspection_s", pa.float32()),
+    ("inference_cached", pa.bool_()),
+    ("model_version", pa.dictionary(pa.int32(), pa.string())),
+    ("image_filename", pa.string()),
+    ("original_filename", pa.string()),
+])
+
+PROJECTION = {name: 1 for name in SCHEMA.names}
+PARTITIONING = ds.partitioning(pa.schema([("day", pa.date32())]), flavor="hive")
+# What readers see: the stored columns plus the partition column
+DATASET_SCHEMA = SCHEMA.append(pa.field("day", pa.date32()))
+
+
+def _utc(value):
+    # pymongo returns naive datetimes that are UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _convert(value, kind):
+    """Coerces one field to the column's Python type; anything unusable becomes null."""
+    if value is None:
+        return None
+    try:
+        if kind == "int":
+            return int(value)
+        if kind == "float":
+            return float(value)
+        if kind == "bool":
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def _kind(field):
+    value_type = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+    if pa.types.is_integer(value_type):
+        return "int"
+    if pa.types.is_floating(value_type):
+        return "float"
+    if pa.types.is_boolean(value_type):
+        return "bool"
+    return "str"
+
+
+KINDS = {field.name: _kind(field) for field in SCHEMA if field.name not in ("_id", "timestamp")}
+
+
+def document_row(doc):
+    """Returns (day, row) for one analysis document."""
+    timestamp = doc.get("timestamp")
+    # Documents without a usable timestamp fall back to the creation time in their _id
+    timestamp = _utc(timestamp) if isinstance(timestamp, datetime) else doc["_id"].generation_time
+    row = {"_id": str(doc["_id"]), "timestamp": timestamp}
+    for name, kind in KINDS.items():
+        row[name] = _convert(doc.get(name), kind)
+    return timestamp.date(), row
+
+
+def _record_batch(rows):
+    return pa.record_batch([pa.array([row[field.name] for row in rows], field.type) for field in SCHEMA],
+                           schema=SCHEMA)
+
+
+def _day_dir(root, day):
+    return os.path.join(root, f"day={day.isoformat()}")
+
+
+def _part_files(root):
+    return glob.glob(os.path.join(root, "day=*", "*.parquet"))
+
+
+class ExportState:
+    """High-water mark and bookkeeping of the export, saved atomically as JSON."""
+
+    def __init__(self, root):
+        self.path = os.path.join(root, STATE_FILE)
+        self.state = {"last_id": None, "rows": 0, "runs": 0, "running": None, "since": None, "compacting": None}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state.update(json.load(f))
+
+    def __getitem__(self, key):
+        return self.state[key]
+
+    def save(self, **changes):
+        self.state.update(changes, updated=datetime.now(timezone.utc).isoformat())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class PartitionWriter:
+    """Writes rows, arriving in time order, to a new file per day of this run.
+
+    One file is open at a time: when the day changes the file is finished
+    and renamed into place, so memory stays at one row group however many
+    days a run covers. A row for a day already finished (a late arrival)
+    starts another file for that day, which ``compact`` merges later.
+    """
+
+    def __init__(self, root, run_id, row_group_rows=ROW_GROUP_ROWS):
+        self.root = root
+        self.run_id = run_id
+        self.row_group_rows = row_group_rows
+        self._day = None
+        self._rows = []
+        self._file = None  # (ParquetWriter, tmp path, final path)
+        self._files_per_day = {}
+        self.rows = 0
+
+    def add(self, day, row):
+        if day != self._day:
+            self._finish()
+            self._day = day
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        if self._file is None:
+            directory = _day_dir(self.root, self._day)
+            os.makedirs(directory, exist_ok=True)
+            sequence = self._files_per_day.get(self._day, 0)
+            self._files_per_day[self._day] = sequence + 1
+            name = f"part-{self.run_id}-{sequence}.parquet"
+            # A leading dot keeps readers from picking up the file while it is incomplete
+            tmp_path = os.path.join(directory, f".{name}.tmp")
+            self._file = (pq.ParquetWriter(tmp_path, SCHEMA, compression="zstd"), tmp_path,
+                          os.path.join(directory, name))
+        self._file[0].write_batch(_record_batch(self._rows), row_group_size=self.row_group_rows)
+        self.rows += len(self._rows)
+        self._rows = []
+
+    def _finish(self):
+        self._flush()
+        if self._file is not None:
+            writer, tmp_path, path = self._file
+            writer.close()
+            os.replace(tmp_path, path)
+            self._file = None
+
+    def close(self):
+        """Finishes the last file; returns the days written."""
+        self._finish()
+        return sorted(self._files_per_day)
+
+    def abort(self):
+        if self._file is not None:
+            writer, tmp_path, _ = self._file
+            writer.close()
+            os.remove(tmp_path)
+            self._file = None
+
+
+def _remove_run(root, run_id):
+    for path in glob.glob(os.path.join(root, "day=*", f"part-{run_id}-*.parquet")):
+        os.remove(path)
+
+
+def _remove_days_from(root, day):
+    for directory in glob.glob(os.path.join(root, "day=*")):
+        if date.fromisoformat(os.path.basename(directory)[len("day="):]) >= day:
+            shutil.rmtree(directory)
+
+
+@contextmanager
+def _lock(root):
+    """Keeps a second export or compaction off the same folder while one runs (not enforced on Windows)."""
+    from mongo_writer import file_lock
+
+    with file_lock(os.path.join(root, "_export.lock"), blocking=False) as locked:
+        if not locked:
+            raise SystemExit(f"Another export or compaction is running on {root}")
+        yield
+
+
+def recover(root, state):
+    """Cleans up after a run or compaction that did not finish."""
+    for path in glob.glob(os.path.join(root, "day=*", ".*.tmp")):
+        os.remove(path)
+    compacting = state["compacting"]
+    if compacting:
+        directory = os.path.join(root, compacting["day"])
+        # Once the merged file is in place the parts it replaces go; before that the merge never happened
+        if os.path.exists(os.path.join(directory, compacting["into"])):
+            for name in compacting["replaces"]:
+                if os.path.exists(os.path.join(directory, name)):
+                    os.remove(os.path.join(directory, name))
+        state.save(compacting=None)
+    if state["running"]:
+        _remove_run(root, state["running"])
+        state.save(running=None)
+
+
+def export(collection, root, settle_s=60.0, since=None, batch_size=5000, row_group_rows=ROW_GROUP_ROWS,
+           now=None):
+    """Appends the analyses newer than the high-water mark to ``root``. Returns a summary dict."""
+    os.makedirs(root, exist_ok=True)
+    with _lock(root):
+        return _export(collection, root, settle_s, since, batch_size, row_group_rows, now)
+
+
+def _export(collection, root, settle_s, since, batch_size, row_group_rows, now):
+    from bson import ObjectId
+
+    state = ExportState(root)
+    recover(root, state)
+
+    # A --since run that died is repeated, or the days it already deleted would stay missing
+    since = since or (date.fromisoformat(state["since"]) if state["since"] else None)
+    now = now or datetime.now(timezone.utc)
+    cutoff = ObjectId.from_datetime(now - timedelta(seconds=settle_s))
+    run_id = str(ObjectId())
+    state.save(running=run_id, since=since.isoformat() if since else None)
+
+    id_range = {"$lt": cutoff}
+    query = {"_id": id_range}
+    if since:
+        _remove_days_from(root, since)
+        start = datetime.combine(since, dt_time(), timezone.utc)
+        # _id is assigned after the analysis, so it is never older than the timestamp
+        id_range["$gte"] = ObjectId.from_datetime(start)
+        query["timestamp"] = {"$gte": start.replace(tzinfo=None)}
+    elif state["last_id"]:
+        id_range["$gt"] = ObjectId(state["last_id"])
+
+    started = time.perf_counter()
+    writer = PartitionWriter(root, run_id, row_group_rows)
+    last_id = None
+    try:
+        for doc in collection.find(query, PROJECTION).sort("_id", 1).batch_size(batch_size):
+            day, row = document_row(doc)
+            if since and day < since:
+                continue
+            writer.add(day, row)
+            last_id = doc["_id"]
+        days = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+    if since:
+        # Everything up to the cutoff is now in the files, whatever the mark was before
+        previous = ObjectId(state["last_id"]) if state["last_id"] else None
+        last_id = max(filter(None, [last_id, previous]), default=None)
+    rows = state["rows"] + writer.rows if not since else sum(
+        pq.ParquetFile(path).metadata.num_rows for path in _part_files(root))
+    state.save(last_id=str(last_id) if last_id else state["last_id"], rows=rows, runs=state["runs"] + 1,
+               running=None, since=None)
+    return {"rows": writer.rows, "days": [day.isoformat() for day in days], "total_rows": rows,
+            "last_id": state["last_id"], "seconds": round(time.perf_counter() - started, 2)}
+
+
+def compact(root, min_files=2):
+    """Merges the files of each day that has at least ``min_files`` into one. Returns the days merged."""
+    with _lock(root):
+        return _compact(root, min_files)
+
+
+def _compact(root, min_files):
+    from bson import ObjectId
+
+    state = ExportState(root)
+    recover(root, state)
+    merged = []
+    for directory in sorted(glob.glob(os.path.join(root, "day=*"))):
+        names = sorted(os.path.basename(path) for path in glob.glob(os.path.join(directory, "part-*.parquet")))
+        if len(names) < min_files:
+            continue
+        table = pa.concat_tables(pq.read_table(os.path.join(directory, name), schema=SCHEMA) for name in names)
+        table = table.sort_by([("timestamp", "ascending"), ("_id", "ascending")])
+        into = f"part-{ObjectId()}-0.parquet"
+        tmp_path = os.path.join(directory, f".{into}.tmp")
+        pq.write_table(table, tmp_path, compression="zstd", row_group_size=ROW_GROUP_ROWS)
+        state.save(compacting={"day": os.path.basename(directory), "replaces": names, "into": into})
+        os.replace(tmp_path, os.path.join(directory, into))
+        for name in names:
+            os.remove(os.path.join(directory, name))
+        state.save(compacting=None)
+        merged.append(os.path.basename(directory)[len("day="):])
+    return merged
+
+
+def open_dataset(root):
+    """The exported history as a pyarrow Dataset, with ``day`` as a date32 partition column."""
+    return ds.dataset(root, format="parquet", partitioning=PARTITIONING, schema=DATASET_SCHEMA)
+
+
+def history_filter(start=None, end=None, tower_id=None, level=None, plant_id=None, min_infected=None,
+                   model_version=None):
+    """Builds the dataset filter; ``start`` and ``end`` are datetimes (UTC if naive), ``end`` exclusive."""
+    conditions = []
+    if start is not None:
+        start = _utc(start)
+        conditions += [ds.field("day") >= start.date(), ds.field("timestamp") >= start]
+    if end is not None:
+        end = _utc(end)
+        conditions += [ds.field("day") <= end.date(), ds.field("timestamp") < end]
+    if tower_id is not None:
+        conditions.append(ds.field("tower_id") == tower_id)
+    if level is not None:
+        conditions.append(ds.field("level") == level)
+    if plant_id is not None:
+        conditions.append(ds.field("plant_id") == plant_id)
+    if min_infected is not None:
+        conditions.append(ds.field("infected_percentage") >= min_infected)
+    if model_version is not None:
+        conditions.append(ds.field("model_version") == model_version)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def scan(root, columns=None, **filters):
+    """Rows of the exported history matching ``filters`` (see history_filter), as a pyarrow Table."""
+    if not _part_files(root):
+        return DATASET_SCHEMA.empty_table().select(columns or DATASET_SCHEMA.names)
+    return open_dataset(root).to_table(columns=columns, filter=history_filter(**filters))
+
+
+def decode_dictionaries(table):
+    """Plain string columns instead of dictionary-encoded ones, for grouping, sorting or CSV."""
+    return table.cast(pa.schema([pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type) else f
+                                 for f in table.schema]))
+
+
+def daily_summary(table, by=("day",)):
+    """Per day (and optionally tower/level/plant): inspections, mean and max infected percentage."""
+    summary = decode_dictionaries(table).group_by(list(by)).aggregate([
+        ("_id", "count"),
+        ("infected_percentage", "mean"),
+        ("infected_percentage", "max"),
+        ("infected_count", "sum"),
+    ])
+    return summary.sort_by([(key, "ascending") for key in by])
+
+
+def parse_day_or_time(value):
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Append new analyses to the Parquet files")
+    export_parser.add_argument("--out", default=DEFAULT_OUT)
+    export_parser.add_argument("--settle", type=float, default=60.0,
+                               help="Leave analyses younger than this many seconds for the next run")
+    export_parser.add_argument("--since", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                               help="Rewrite the days from this one on")
+    export_parser.add_argument("--batch-size", type=int, default=5000, help="Documents per MongoDB round trip")
+    export_parser.add_argument("--read-preference", default="secondaryPreferred",
+                               help="Read from a secondary when the deployment has one")
+    export_parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017/")
+    export_parser.add_argument("--database", default="smart_pesticide_db")
+
+    query_parser = commands.add_parser("query", help="Filter the Parquet files and summarize per day")
+    query_parser.add_argument("--out", default=DEFAULT_OUT)
+    query_parser.add_argument("--since", type=parse_day_or_time, help="ISO date or time, inclusive")
+    query_parser.add_argument("--until", type=parse_day_or_time, help="ISO date or time, exclusive")
+    query_parser.add_argument("--tower")
+    query_parser.add_argument("--level", type=int)
+    query_parser.add_argument("--plant")
+    query_parser.add_argument("--min-infected", type=float, help="Only analyses at or above this percentage")
+    query_parser.add_argument("--model-version")
+    query_parser.add_argument("--by", nargs="+", default=["day"], choices=["day", "tower_id", "level", "plant_id"])
+    query_parser.add_argument("--csv", help="Also write the matching rows to this CSV file")
+
+    compact_parser = commands.add_parser("compact", help="Merge the files of each day into one")
+    compact_parser.add_argument("--out", default=DEFAULT_OUT)
+    compact_parser.add_argument("--min-files", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        from pymongo import MongoClient
+
+        client = MongoClient(args.mongodb_uri, serverSelectionTimeoutMS=5000, readPreference=args.read_preference)
+        summary = export(client[args.database]["analysis_data"], args.out, args.settle, args.since, args.batch_size)
+        print(f"[INFO] Exported {summary['rows']} analyses into {len(summary['days'])} day(s) "
+              f"in {summary['seconds']} s; {summary['total_rows']} in {args.out}, up to _id {summary['last_id']}")
+    elif args.command == "compact":
+        days = compact(args.out, args.min_files)
+        print(f"[INFO] Compacted {len(days)} day(s)" + (f": {days[0]} .. {days[-1]}" if days else ""))
+    else:
+        columns = sorted({"_id", "infected_percentage", "infected_count", *args.by})
+        if args.csv:
+            columns = DATASET_SCHEMA.names
+        started = time.perf_counter()
+        table = scan(args.out, columns, start=args.since, end=args.until, tower_id=args.tower, level=args.level,
+                     plant_id=args.plant, min_infected=args.min_infected, model_version=args.model_version)
+        elapsed = time.perf_counter() - started
+        print(f"[INFO] {table.num_rows} analyses matched in {elapsed * 1000:.0f} ms")
+        if table.num_rows:
+            summary = daily_summary(table, args.by)
+            header = [*args.by, "analyses", "mean_infected_%", "max_infected_%", "infected_leaves"]
+            print("  ".join(f"{name:>14}" for name in header))
+            for row in summary.to_pylist():
+                values = [row[key] for key in args.by] + [row["_id_count"], row["infected_percentage_mean"],
+                                                          row["infected_percentage_max"], row["infected_count_sum"]]
+                print("  ".join(f"{value:>14.2f}" if isinstance(value, float) else f"{str(value):>14}"
+                                for value in values))
+        if args.csv:
+            import pyarrow.csv
+
+            pyarrow.csv.write_csv(decode_dictionaries(table), args.csv)
+            print(f"[INFO] Wrote {table.num_rows} rows to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import base64
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Compound index backing the (timestamp, _id) keyset pagination
+HISTORY_INDEX = [("timestamp", -1), ("_id", -1)]
+HISTORY_SORT = [("timestamp", -1), ("_id", -1)]
+# Per-plant lookups and trend aggregations filtered by location
+PLANT_INDEX = [("tower_id", 1), ("level", 1), ("plant_id", 1), ("timestamp", -1)]
+
+
+def ensure_indexes(collection):
+    """Creates the indexes the history and trend queries rely on (no-op if they exist)."""
+    collection.create_index(HISTORY_INDEX, name="timestamp_id_desc")
+    collection.create_index(PLANT_INDEX, name="plant_timestamp_desc")
+
+
+def parse_time(value):
+    """Parses an ISO-8601 query parameter such as ``2025-09-22T10:00:00Z``."""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def encode_cursor(doc):
+    raw = f"{doc['timestamp'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, object_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(object_id)
+    except (ValueError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def build_history_query(cursor=None, time_from=None, time_to=None):
+    """Builds the MongoDB filter for one page of history, newest first."""
+    clauses = []
+    if time_from is not None or time_to is not None:
+        time_range = {}
+        if time_from is not None:
+            time_range["$gte"] = time_from
+        if time_to is not None:
+            time_range["$lt"] = time_to
+        clauses.append({"timestamp": time_range})
+    if cursor:
+        timestamp, object_id = decode_cursor(cursor)
+        clauses.append({"$or": [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": object_id}},
+        ]})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def build_projection(fields):
+    """Turns ``?fields=a,b`` into a projection. Keys needed for paging are always kept."""
+    if not fields:
+        return None
+    projection = {name.strip(): 1 for name in fields.split(",") if name.strip()}
+    if projection.pop("image_url", None):
+        projection["image_filename"] = 1
+    projection["timestamp"] = 1
+    projection["_id"] = 1
+    return projection
+
+
+class ImageExistenceCache:
+    """Remembers whether annotated images exist so history pages don't stat every file.
+
+    The server marks images as present when it writes them; anything else is
+    looked up once with ``check(filename)`` and cached for ``ttl`` seconds.
+    """
+
+    def __init__(self, check, ttl=300.0, max_entries=100000):
+        self.check = check
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def mark(self, filename, exists=True):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[filename] = (exists, time.monotonic())
+
+    def exists(self, filename):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None and now - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        found = self.check(filename)
+        self.mark(filename, found)
+        return found
+
+    def image_url(self, filename):
+        if filename and self.exists(filename):
+            return f"/api/images/{filename}"
+        return None
@@ -0,0 +1,171 @@
+"""MongoDB catalog of the images in the image store.
+
+One document per stored file, written when the image is saved, so listing
+and existence checks are index lookups instead of directory scans:
+
+    {"_id": "3f/3f2a...c1.jpg", "timestamp": ..., "size": 48213,
+     "width": 640, "height": 480, "tier": "full",
+     "analysis_ids": [ObjectId(...)], "tower_id": ..., "level": ..., "plant_id": ...}
+
+Content-addressed images can be shared by several analyses, hence the list
+of analysis IDs. Images saved before the catalog existed are added by
+``python image_catalog.py`` (also run automatically when the catalog is empty).
+"""
+import argparse
+import base64
+from datetime import datetime, timezone
+
+from pymongo import MongoClient, UpdateOne
+
+from frame_decode import jpeg_dimensions
+
+CATALOG_SORT = [("timestamp", -1), ("_id", -1)]
+CATALOG_INDEX = [("timestamp", -1), ("_id", -1)]
+CATALOG_PLANT_INDEX = [("tower_id", 1), ("level", 1), ("plant_id", 1), ("timestamp", -1)]
+TIERS = ("full", "thumbnail")
+
+
+def encode_cursor(doc):
+    raw = f"{doc['timestamp'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, filename = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), filename
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def jpeg_size(path):
+    """Reads (width, height) from a JPEG file's header without decoding it. None if unknown."""
+    with open(path, "rb") as f:
+        # The SOF header follows APP segments (EXIF etc.), at most 64 KB each
+        return jpeg_dimensions(f.read(128 * 1024))
+
+
+class ImageCatalog:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index(CATALOG_INDEX, name="timestamp_id_desc")
+        self.collection.create_index(CATALOG_PLANT_INDEX, name="plant_timestamp_desc")
+        self.collection.create_index("analysis_ids", name="analysis_ids")
+
+    def record(self, filename, size, width, height, analysis_id=None, timestamp=None, location=None):
+        """Adds a freshly saved image, or links another analysis to an existing one."""
+        update = {
+            "$setOnInsert": {
+                "timestamp": timestamp or datetime.now(timezone.utc),
+                "size": size,
+                "width": width,
+                "height": height,
+                "tier": "full",
+            },
+        }
+        if location:
+            update["$set"] = {key: value for key, value in location.items() if value is not None}
+        if analysis_id is not None:
+            update["$addToSet"] = {"analysis_ids": analysis_id}
+        self.collection.update_one({"_id": filename}, update, upsert=True)
+
+    def mark_thumbnail(self, filename, size, width, height):
+        self.collection.update_one(
+            {"_id": filename},
+            {"$set": {"tier": "thumbnail", "size": size, "width": width, "height": height}},
+        )
+
+    def remove(self, filename):
+        self.collection.delete_one({"_id": filename})
+
+    def exists(self, filename):
+        return self.collection.find_one({"_id": filename}, {"_id": 1}) is not None
+
+    def is_empty(self):
+        return self.collection.find_one({}, {"_id": 1}) is None
+
+    def build_query(self, cursor=None, time_from=None, time_to=None, tier=None, location=None,
+                    analysis_id=None):
+        """MongoDB filter for one page of the listing, newest first."""
+        clauses = []
+        if time_from is not None or time_to is not None:
+            time_range = {}
+            if time_from is not None:
+                time_range["$gte"] = time_from
+            if time_to is not None:
+                time_range["$lt"] = time_to
+            clauses.append({"timestamp": time_range})
+        if tier:
+            if tier not in TIERS:
+                raise ValueError(f"Invalid tier: {tier}. Use one of {', '.join(TIERS)}")
+            clauses.append({"tier": tier})
+        if location:
+            clauses.append(dict(location))
+        if analysis_id is not None:
+            clauses.append({"analysis_ids": analysis_id})
+        if cursor:
+            timestamp, filename = decode_cursor(cursor)
+            clauses.append({"$or": [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": filename}},
+            ]})
+        if not clauses:
+            return {}
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def page(self, query, limit):
+        return list(self.collection.find(query).sort(CATALOG_SORT).limit(limit))
+
+    def rebuild(self, store, analysis_collection=None, batch_size=1000):
+        """Adds every image in ``store`` that isn't catalogued yet. Returns how many were seen."""
+        analysis_ids = {}
+        if analysis_collection is not None:
+            for doc in analysis_collection.find({"image_filename": {"$ne": None}}, {"image_filename": 1}):
+                analysis_ids.setdefault(doc["image_filename"], []).append(doc["_id"])
+
+        operations = []
+        seen = 0
+        for relative, path, stat, is_thumbnail in store.iter_files():
+            try:
+                dimensions = jpeg_size(path) or (None, None)
+            except OSError:
+                dimensions = (None, None)
+            update = {"$setOnInsert": {
+                "timestamp": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                "size": stat.st_size,
+                "width": dimensions[0],
+                "height": dimensions[1],
+                "tier": "thumbnail" if is_thumbnail else "full",
+            }}
+            if relative in analysis_ids:
+                update["$addToSet"] = {"analysis_ids": {"$each": analysis_ids[relative]}}
+            operations.append(UpdateOne({"_id": relative}, update, upsert=True))
+            seen += 1
+            if len(operations) >= batch_size:
+                self.collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return seen
+
+
+def main():
+    from image_store import ImageStore
+
+    parser = argparse.ArgumentParser(description="Adds images already on disk to the image catalog.")
+    parser.add_argument("--folder", default="analysis_images")
+    parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="smart_pesticide_db")
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongodb_uri, serverSelectionTimeoutMS=5000)[args.database]
+    catalog = ImageCatalog(db["image_catalog"])
+    catalog.ensure_indexes()
+    seen = catalog.rebuild(ImageStore(args.folder), db["analysis_data"])
+    print(f"[INFO] Catalogued {seen} images from {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Content-addressed store for annotated images, with retention and a disk quota.
+
+Files are named after the SHA-1 of their JPEG bytes and sharded by the first
+two hex digits (``3f/3f2a...c1.jpg``), so two uploads in the same second can't
+overwrite each other and no directory grows past a few thousand entries.
+Writes go to a temp file in the same directory and are renamed into place,
+so a reader never sees half a JPEG.
+
+Retention runs in the background:
+
+* images older than ``full_res_days`` are replaced by a thumbnail under
+  ``thumbs/`` with the same relative name, so their URLs keep working;
+* when the store is over ``quota_bytes`` the oldest files are deleted.
+
+Saving bytes that are already stored touches the file, so an image that was
+just referenced again counts as new. With several worker processes on one
+folder only the one holding ``.retention.lock`` applies retention; the
+others take over if it exits.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+
+from mongo_writer import file_lock
+
+log = logging.getLogger(__name__)
+
+THUMBS_DIR = "thumbs"
+RETENTION_LOCK = ".retention.lock"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
+
+
+class ImageStore:
+    def __init__(self, root, full_res_days=30, thumbnail_width=320, quota_bytes=0,
+                 jpeg_quality=90, retention_interval=600.0, on_evict=None, on_thumbnail=None):
+        # Absolute, so paths from locate() don't depend on who resolves them
+        self.root = os.path.abspath(root)
+        self.full_res_days = full_res_days
+        self.thumbnail_width = thumbnail_width
+        self.quota_bytes = quota_bytes
+        self.jpeg_quality = jpeg_quality
+        self.retention_interval = retention_interval
+        # Called with the relative name of every deleted image, and with
+        # (name, size, width, height) of every image replaced by a thumbnail
+        self.on_evict = on_evict
+        self.on_thumbnail = on_thumbnail
+        os.makedirs(os.path.join(root, THUMBS_DIR), exist_ok=True)
+
+        self._bytes = None  # unknown until the first retention pass
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.retention_owner = False
+        self.saved = 0
+        self.deduplicated = 0
+        self.thumbnailed = 0
+        self.evicted = 0
+
+    def save(self, frame):
+        """Encodes ``frame`` as JPEG and stores it. Returns (relative_filename, size_in_bytes)."""
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise IOError("Failed to encode annotated image")
+        return self.save_bytes(encoded.tobytes())
+
+    def save_bytes(self, data, extension=".jpg"):
+        digest = hashlib.sha1(data).hexdigest()
+        filename = f"{digest[:2]}/{digest}{extension}"
+        path = os.path.join(self.root, filename)
+        try:
+            # Same bytes already stored; make it the newest for eviction
+            os.utime(path)
+            self.deduplicated += 1
+            return filename, len(data)
+        except FileNotFoundError:
+            pass
+        self._write_atomic(path, data)
+        self.saved += 1
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += len(data)
+                if self.quota_bytes and self._bytes > self.quota_bytes:
+                    self._wake.set()
+        return filename, len(data)
+
+    def _write_atomic(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def locate(self, filename):
+        """Returns the path of the full-size image or its thumbnail, or None.
+
+        Names from before the store (flat ``annotated_plant_*.jpg``) resolve too.
+        """
+        for path in (os.path.join(self.root, filename), os.path.join(self.root, THUMBS_DIR, filename)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def iter_files(self):
+        """Yields (relative_name, path, stat, is_thumbnail) of every stored image."""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, name)
+                relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+                is_thumbnail = relative.startswith(THUMBS_DIR + "/")
+                if is_thumbnail:
+                    relative = relative[len(THUMBS_DIR) + 1:]
+                try:
+                    yield relative, path, os.stat(path), is_thumbnail
+                except FileNotFoundError:
+                    continue  # evicted by another worker meanwhile
+
+    def _thumbnail(self, relative, path, stat):
+        frame = cv2.imread(path)
+        if frame is None:
+            return False
+        height, width = frame.shape[:2]
+        if width > self.thumbnail_width:
+            size = (self.thumbnail_width, max(1, round(height * self.thumbnail_width / width)))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if not ok:
+            return False
+        thumb_path = os.path.join(self.root, THUMBS_DIR, relative)
+        self._write_atomic(thumb_path, encoded.tobytes())
+        # Keep the original age so quota eviction still sees it as old
+        os.utime(thumb_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.remove(path)
+        if self.on_thumbnail is not None:
+            self.on_thumbnail(relative, len(encoded), frame.shape[1], frame.shape[0])
+        return True
+
+    def apply_retention(self, now=None):
+        """Thumbnails images past ``full_res_days``, then deletes the oldest ones over quota."""
+        now = time.time() if now is None else now
+        cutoff = now - self.full_res_days * 86400
+        files = []
+        for relative, path, stat, is_thumbnail in self.iter_files():
+            if self.full_res_days and not is_thumbnail and stat.st_mtime < cutoff:
+                try:
+                    if self._thumbnail(relative, path, stat):
+                        self.thumbnailed += 1
+                        path = os.path.join(self.root, THUMBS_DIR, relative)
+                        stat = os.stat(path)
+                except (OSError, cv2.error) as e:
+                    log.warning(f"Could not thumbnail {relative}: {e}")
+            files.append((stat.st_mtime, stat.st_size, relative, path))
+
+        total = sum(size for _, size, _, _ in files)
+        if self.quota_bytes and total > self.quota_bytes:
+            files.sort()
+            for _, size, relative, path in files:
+                if total <= self.quota_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evicted += 1
+                if self.on_evict is not None:
+                    self.on_evict(relative)
+        with self._lock:
+            self._bytes = total
+        return total
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="image-retention", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+
+    def _run(self):
+        lock_path = os.path.join(self.root, RETENTION_LOCK)
+        while not self._stop.is_set():
+            # Held for as long as this process runs retention
+            with file_lock(lock_path, blocking=False) as locked:
+                if locked:
+                    self.retention_owner = True
+                    self._retention_loop()
+                    return
+            self._stop.wait(self.retention_interval)
+
+    def _retention_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.apply_retention()
+            except Exception as e:
+                log.error(f"Image retention failed: {e}")
+            self._wake.wait(self.retention_interval)
+            self._wake.clear()
+
+    def stats(self):
+        return {
+            "bytes": self._bytes,
+            "quota_bytes": self.quota_bytes,
+            "full_res_days": self.full_res_days,
+            "retention_owner": self.retention_owner,
+            "saved": self.saved,
+            "deduplicated": self.deduplicated,
+            "thumbnailed": self.thumbnailed,
+            "evicted": self.evicted,
+        }
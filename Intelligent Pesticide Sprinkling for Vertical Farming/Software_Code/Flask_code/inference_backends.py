@@ -0,0 +1,302 @@
+"""Pluggable model backends for plant infection detection.
+
+Every backend is called with a list of BGR frames and returns one
+``Detections`` per frame, so the server doesn't care whether the model runs
+through ultralytics/PyTorch, ONNX Runtime or OpenVINO.
+
+    model = load_backend("onnx", "best.onnx", imgsz=640)
+    detections = model([frame])[0]
+"""
+import ast
+import os
+import time
+
+import cv2
+import numpy as np
+
+BACKENDS = ("ultralytics", "onnx", "openvino")
+
+# Drawing colours (BGR) per class name, same as Live_Prediction.py
+CLASS_COLORS = {
+    "Healthy_Leaves": (0, 255, 0),
+    "Infected_Leaves": (0, 0, 255),
+}
+DEFAULT_COLOR = (128, 128, 128)
+
+
+class Detections:
+    """Detections for one frame, held as NumPy arrays in original image coordinates."""
+
+    def __init__(self, xyxy, conf, cls, names, orig_img):
+        self.xyxy = xyxy  # (N, 4) float32
+        self.conf = conf  # (N,) float32
+        self.cls = cls  # (N,) int64
+        self.names = names
+        self.orig_img = orig_img
+
+    def __len__(self):
+        return len(self.cls)
+
+    def plot(self):
+        """Returns a copy of the frame with boxes and labels drawn on it."""
+        frame = self.orig_img.copy()
+        for (x1, y1, x2, y2), conf, cls in zip(self.xyxy.astype(int), self.conf, self.cls):
+            name = self.names.get(int(cls), str(cls))
+            color = CLASS_COLORS.get(name, DEFAULT_COLOR)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+            cv2.putText(frame, f"{name}: {conf:.2f}", (x1, max(y1 - 10, 0)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+        return frame
+
+    @classmethod
+    def from_ultralytics(cls, result):
+        """Moves an ultralytics ``Results`` object to NumPy in one transfer per field."""
+        boxes = result.boxes
+        return cls(
+            boxes.xyxy.cpu().numpy().astype(np.float32).reshape(-1, 4),
+            boxes.conf.cpu().numpy().astype(np.float32).reshape(-1),
+            boxes.cls.cpu().numpy().astype(np.int64).reshape(-1),
+            dict(result.names),
+            result.orig_img,
+        )
+
+
+def letterbox(frame, size, out=None, color=114):
+    """Resizes keeping aspect ratio and pads to ``size`` x ``size``.
+
+    Returns the padded image plus the scale and (left, top) padding needed
+    to map boxes back to the original frame. ``out`` may be a preallocated
+    (size, size, 3) uint8 buffer to write into; the frame is then resized
+    straight into it and only the padding bands are filled, so nothing is
+    allocated per frame.
+    """
+    h, w = frame.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    left, top = (size - new_w) // 2, (size - new_h) // 2
+
+    if out is None:
+        out = np.empty((size, size, 3), dtype=np.uint8)
+    out[:top].fill(color)
+    out[top + new_h:].fill(color)
+    out[top:top + new_h, :left].fill(color)
+    out[top:top + new_h, left + new_w:].fill(color)
+    target = out[top:top + new_h, left:left + new_w]
+    if (new_w, new_h) == (w, h):
+        np.copyto(target, frame)
+    else:
+        cv2.resize(frame, (new_w, new_h), dst=target, interpolation=cv2.INTER_LINEAR)
+    return out, scale, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression. Returns indices of the boxes kept."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        xx1 = np.maximum(x1[i], x1[rest])
+        yy1 = np.maximum(y1[i], y1[rest])
+        xx2 = np.minimum(x2[i], x2[rest])
+        yy2 = np.minimum(y2[i], y2[rest])
+        inter = (xx2 - xx1).clip(0) * (yy2 - yy1).clip(0)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decode_yolov8(output, conf_threshold, iou_threshold, max_det=300):
+    """Turns one raw YOLOv8 output of shape (4 + nc, anchors) into boxes.
+
+    Returns (xyxy, conf, cls) in letterboxed input coordinates.
+    """
+    preds = output.T  # (anchors, 4 + nc)
+    class_scores = preds[:, 4:]
+    cls = class_scores.argmax(axis=1)
+    conf = class_scores[np.arange(len(cls)), cls]
+    mask = conf > conf_threshold
+    preds, cls, conf = preds[mask], cls[mask], conf[mask]
+
+    cx, cy, w, h = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+    xyxy = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    # Offsetting by class makes a single NMS pass class-aware
+    offsets = cls[:, None].astype(np.float32) * 4096.0
+    keep = nms(xyxy + offsets, conf, iou_threshold)[:max_det]
+    return xyxy[keep].astype(np.float32), conf[keep].astype(np.float32), cls[keep].astype(np.int64)
+
+
+class UltralyticsBackend:
+    """Runs the original ``best.pt`` through ultralytics/PyTorch."""
+
+    name = "ultralytics"
+    version = None
+
+    def __init__(self, model_path, imgsz=640, conf=0.25, iou=0.45, **_):
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.names = dict(self.model.names)
+
+    def __call__(self, frames):
+        results = self.model(frames, imgsz=self.imgsz, conf=self.conf, iou=self.iou, verbose=False)
+        return [Detections.from_ultralytics(r) for r in results]
+
+
+class OnnxBackend:
+    """Runs an exported YOLOv8 ONNX model with ONNX Runtime on the CPU.
+
+    Letterboxing and NMS are done here in NumPy, so the backend needs neither
+    torch nor ultralytics.
+    """
+
+    name = "onnx"
+    version = None
+
+    def __init__(self, model_path, imgsz=640, conf=0.25, iou=0.45, threads=0, names=None, providers=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options,
+                                            providers=providers or ["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # A static batch dimension of 1 means frames have to go through one at a time
+        self.fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        if isinstance(model_input.shape[2], int):
+            imgsz = model_input.shape[2]
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = names or self._names_from_metadata(metadata)
+        # Written by quantize.py; models straight from export_model.py have none
+        self.version = metadata.get("model_version")
+        self._buffers = []
+        self._batch = np.empty((0, 3, imgsz, imgsz), dtype=np.float32)
+
+    @staticmethod
+    def _names_from_metadata(metadata):
+        # ultralytics stores the class map as a Python dict literal
+        if "names" in metadata:
+            return {int(k): v for k, v in ast.literal_eval(metadata["names"]).items()}
+        raise ValueError("Model has no 'names' metadata; pass names= explicitly")
+
+    def preprocess(self, frames):
+        """Letterboxes frames into reusable buffers and returns an NCHW float32 batch.
+
+        The batch is a view of a buffer that is reused by the next call, so
+        it is only valid until then (the inference worker is single-threaded).
+        """
+        while len(self._buffers) < len(frames):
+            self._buffers.append(np.empty((self.imgsz, self.imgsz, 3), dtype=np.uint8))
+        if len(self._batch) < len(frames):
+            self._batch = np.empty((len(frames), 3, self.imgsz, self.imgsz), dtype=np.float32)
+        batch = self._batch[:len(frames)]
+        transforms = []
+        for i, frame in enumerate(frames):
+            padded, scale, pad = letterbox(frame, self.imgsz, out=self._buffers[i])
+            # BGR HWC uint8 -> RGB CHW float in [0, 1]
+            np.multiply(padded[:, :, ::-1].transpose(2, 0, 1), 1 / 255.0, out=batch[i], casting="unsafe")
+            transforms.append((scale, pad))
+        return batch, transforms
+
+    def _run(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def _infer(self, batch):
+        if self.fixed_batch and len(batch) != self.fixed_batch:
+            return np.concatenate([self._run(batch[i:i + 1]) for i in range(len(batch))])
+        return self._run(batch)
+
+    def __call__(self, frames):
+        batch, transforms = self.preprocess(frames)
+        outputs = self._infer(batch)
+        detections = []
+        for frame, output, (scale, (left, top)) in zip(frames, outputs, transforms):
+            xyxy, conf, cls = decode_yolov8(output, self.conf, self.iou)
+            xyxy -= np.array([left, top, left, top], dtype=np.float32)
+            xyxy /= scale
+            h, w = frame.shape[:2]
+            np.clip(xyxy, 0, [w, h, w, h], out=xyxy)
+            detections.append(Detections(xyxy, conf, cls, self.names, frame))
+        return detections
+
+
+class OpenVinoBackend(OnnxBackend):
+    """Runs an ONNX or OpenVINO IR (.xml) model with the OpenVINO CPU plugin."""
+
+    name = "openvino"
+
+    def __init__(self, model_path, imgsz=640, conf=0.25, iou=0.45, threads=0, names=None, **_):
+        import openvino as ov
+
+        core = ov.Core()
+        config = {"INFERENCE_NUM_THREADS": threads} if threads else {}
+        ov_model = core.read_model(model_path)
+        self.compiled = core.compile_model(ov_model, "CPU", config)
+        model_input = ov_model.inputs[0]
+        shape = model_input.get_partial_shape()
+        self.input_name = model_input.get_any_name()
+        self.fixed_batch = shape[0].get_length() if shape[0].is_static else None
+        if shape[2].is_static:
+            imgsz = shape[2].get_length()
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        if names is None:
+            names = self._names_from_export_dir(os.path.dirname(os.path.abspath(model_path)))
+        self.names = names
+        self._buffers = []
+        self._batch = np.empty((0, 3, imgsz, imgsz), dtype=np.float32)
+
+    @staticmethod
+    def _names_from_export_dir(export_dir):
+        # ultralytics writes metadata.yaml next to the exported IR
+        metadata_path = os.path.join(export_dir, "metadata.yaml")
+        if not os.path.exists(metadata_path):
+            raise ValueError("Model has no metadata.yaml; pass names= explicitly")
+        import yaml
+
+        with open(metadata_path) as f:
+            return {int(k): v for k, v in yaml.safe_load(f)["names"].items()}
+
+    def _run(self, batch):
+        return self.compiled(batch)[0]
+
+
+def load_backend(backend, model_path, imgsz=640, conf=0.25, iou=0.45, threads=0, names=None):
+    """Creates the configured backend. Raises if the model file is missing."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{backend}', expected one of {BACKENDS}")
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    if backend == "ultralytics":
+        return UltralyticsBackend(model_path, imgsz=imgsz, conf=conf, iou=iou)
+    if backend == "onnx":
+        return OnnxBackend(model_path, imgsz=imgsz, conf=conf, iou=iou, threads=threads, names=names)
+    return OpenVinoBackend(model_path, imgsz=imgsz, conf=conf, iou=iou, threads=threads, names=names)
+
+
+def warm_up(model, runs=3, shape=(480, 640, 3)):
+    """Runs a few dummy frames so the first real request doesn't pay for lazy init.
+
+    Returns the time of the last warm-up run in milliseconds.
+    """
+    frame = np.zeros(shape, dtype=np.uint8)
+    elapsed = 0.0
+    for _ in range(runs):
+        started = time.perf_counter()
+        model([frame])
+        elapsed = (time.perf_counter() - started) * 1000
+    return elapsed
@@ -0,0 +1,175 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class StageTimer:
+    """Keeps a rolling window of latency samples (in ms) for one pipeline stage."""
+
+    def __init__(self, window=1024):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+            self.total_ms += ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total, max_ms = self.count, self.total_ms, self.max_ms
+
+        def pct(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            "count": count,
+            "mean_ms": round(total / count, 3) if count else 0.0,
+            "p50_ms": round(pct(0.50), 3),
+            "p95_ms": round(pct(0.95), 3),
+            "p99_ms": round(pct(0.99), 3),
+            "max_ms": round(max_ms, 3),
+        }
+
+
+class BatchInferenceEngine:
+    """Queues decoded frames and runs them through the model in micro-batches.
+
+    A batch is flushed as soon as it holds ``max_batch_size`` frames or the
+    oldest frame has waited ``max_wait_ms``, whichever comes first. Each caller
+    gets back the detection result for its own frame. A frame whose caller
+    timed out while it was still queued is dropped from its batch, and
+    ``stop`` fails the frames still queued instead of leaving them pending.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=20, max_queue_size=256):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._running = False
+
+        self.queue_wait = StageTimer()
+        self.inference = StageTimer()
+        self.end_to_end = StageTimer()
+        self._batch_sizes = deque(maxlen=1024)
+        self.batches = 0
+        self.frames = 0
+        self.errors = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        while True:
+            try:
+                _, future, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("Inference engine stopped"))
+
+    def submit(self, frame, timeout=10.0):
+        """Queues a frame and blocks until its detection result is ready."""
+        future = Future()
+        try:
+            self._queue.put_nowait((frame, future, time.perf_counter()))
+        except queue.Full:
+            self.rejected += 1
+            raise
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Skipped by the worker if it hasn't reached the batch yet
+            future.cancel()
+            self.timeouts += 1
+            raise
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self._running:
+            # Drops frames whose caller already gave up
+            batch = [item for item in self._collect_batch() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.queue_wait.record((started - enqueued) * 1000)
+
+            frames = [frame for frame, _, _ in batch]
+            try:
+                results = self.model(frames)
+            except Exception as e:
+                self.errors += len(batch)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            self.inference.record((finished - started) * 1000)
+            self._batch_sizes.append(len(batch))
+            self.batches += 1
+            self.frames += len(batch)
+
+            for (_, future, enqueued), result in zip(batch, results):
+                self.end_to_end.record((finished - enqueued) * 1000)
+                future.set_result(result)
+
+    def stats(self):
+        sizes = list(self._batch_sizes)
+        return {
+            "running": self._running,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "frames": self.frames,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "mean_batch_size": round(sum(sizes) / len(sizes), 3) if sizes else 0.0,
+            "max_batch_size_seen": max(sizes) if sizes else 0,
+            "queue_wait": self.queue_wait.snapshot(),
+            "inference": self.inference.snapshot(),
+            "end_to_end": self.end_to_end.snapshot(),
+        }
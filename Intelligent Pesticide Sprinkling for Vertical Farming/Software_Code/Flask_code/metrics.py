@@ -0,0 +1,190 @@
+"""Histograms and counters rendered in the Prometheus text format.
+
+Small enough to need no client library: a metric keeps one set of bucket
+counts per label combination under a lock, and ``MetricsRegistry.render()``
+produces what a ``/metrics`` endpoint returns. Values that other objects
+already count (queue depths, drop counters) are read through callbacks at
+scrape time instead of being copied on every update.
+
+    registry = MetricsRegistry()
+    stage_seconds = registry.histogram("analysis_stage_seconds", "Time per stage", ["stage"])
+    with stage_seconds.time(stage="decode"):
+        frame = decode(data)
+
+Every process keeps its own metrics. With several gunicorn workers each
+scrape is answered by one of them; the ``pid`` label (on by default) keeps
+their series apart, so sum over it in queries.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from a frame-cache lookup (~0.1 ms) to a slow CPU inference batch
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self, extra_labels=()):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key, extra_labels)} {_format_value(v)}"
+                for key, v in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = 0
+            while index < len(self.buckets) and value > self.buckets[index]:
+                index += 1
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the ``with`` block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def collect(self, extra_labels=()):
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, list(extra_labels) + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, extra_labels)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """A gauge or counter whose value is read from ``read()`` at scrape time.
+
+    ``read`` returns a number, None (metric omitted), or a dict mapping label
+    value tuples to numbers.
+    """
+
+    def __init__(self, name, help_text, read, labelnames=(), kind="gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.read = read
+
+    def collect(self, extra_labels=()):
+        try:
+            values = self.read()
+        except Exception:
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labelnames, key, extra_labels)} {_format_value(v)}"
+                for key, v in sorted(values.items()) if v is not None]
+
+
+class MetricsRegistry:
+    def __init__(self, pid_label=True):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.extra_labels = (("pid", os.getpid()),) if pid_label else ()
+
+    def _add(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_function(self, name, help_text, read, labelnames=()):
+        return self._add(CallbackMetric(name, help_text, read, labelnames, kind="gauge"))
+
+    def counter_function(self, name, help_text, read, labelnames=()):
+        return self._add(CallbackMetric(name, help_text, read, labelnames, kind="counter"))
+
+    def render(self):
+        # Forked workers inherit the master's registry; label them by their own pid
+        if self.extra_labels:
+            self.extra_labels = (("pid", os.getpid()),)
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect(self.extra_labels))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from inference_engine import StageTimer
+
+log = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """Exclusive ``flock`` on ``path`` shared by every process; yields whether it was acquired.
+
+    Without fcntl (Windows) there is no pre-forking server, so the lock always
+    succeeds and only the in-process locks apply.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield True
+        return
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class BufferedMongoWriter:
+    """Write-behind buffer that groups analysis documents into insert_many calls.
+
+    Documents are flushed when ``batch_size`` of them are buffered or
+    ``flush_interval`` seconds have passed. If MongoDB rejects a batch, or the
+    buffer grows past ``max_buffered`` because inserts are too slow, documents
+    are appended to a local JSON-lines journal and replayed once MongoDB
+    accepts writes again. Every document gets its ``_id`` up front so a replay
+    never creates duplicates.
+
+    Several processes (gunicorn workers) may share one journal: appends and
+    the rename that starts a replay hold ``<journal>.lock``, and a whole
+    replay holds ``<journal>.replay.lock``, so only one process replays at a
+    time and nobody appends to a file that is being replayed.
+
+    The journal is only replayed after a successful flush, or when there was
+    nothing to flush. While MongoDB keeps failing, the background thread waits
+    ``flush_interval`` doubled after every failed round, up to ``max_backoff``
+    seconds, instead of timing out on every tick.
+
+    Works with any pymongo-compatible collection, including mongomock.
+    """
+
+    def __init__(self, collection, batch_size=50, flush_interval=1.0, max_buffered=5000,
+                 journal_path="mongo_journal.jsonl", replay_chunk_size=500, on_flush=None,
+                 max_backoff=30.0):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.journal_path = journal_path
+        self.replay_chunk_size = replay_chunk_size
+        self.max_backoff = max_backoff
+        # Called with (seconds, documents) after every successful insert_many
+        self.on_flush = on_flush
+
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._backoff = 0.0
+
+        self.flush_latency = StageTimer()
+        self.written = 0
+        self.batches = 0
+        self.journaled = 0
+        self.replayed = 0
+        self.failures = 0
+        self.bad_journal_lines = 0
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="mongo-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def write(self, document):
+        """Buffers a document and returns its ``_id`` without touching the database."""
+        document.setdefault("_id", ObjectId())
+        spill = None
+        with self._cond:
+            self._buffer.append(document)
+            if len(self._buffer) > self.max_buffered:
+                spill = self._buffer[:-self.batch_size]
+                self._buffer = self._buffer[-self.batch_size:]
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        if spill:
+            log.warning(f"MongoDB writer backlog too large, journaling {len(spill)} documents")
+            self._append_journal(spill)
+        return document["_id"]
+
+    def flush(self):
+        """Writes everything currently buffered. Returns the number of documents inserted."""
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        with self._flush_lock:
+            inserted = self._insert(batch)
+        if inserted < len(batch):
+            self._append_journal(batch)
+        return inserted
+
+    def close(self, timeout=10.0):
+        """Stops the background thread and flushes the remaining documents."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._backoff:
+                    # MongoDB is failing; don't wake up early for a full batch
+                    self._cond.wait_for(lambda: not self._running, timeout=self._backoff)
+                else:
+                    self._cond.wait_for(lambda: len(self._buffer) >= self.batch_size or not self._running,
+                                        timeout=self.flush_interval)
+                if not self._running:
+                    return
+            failures = self.failures
+            try:
+                self._flush_and_replay()
+            except Exception as e:
+                # Keep the writer alive; whatever was not written stays in
+                # the buffer or the journal for the next round
+                self.failures += 1
+                log.exception(f"MongoDB writer iteration failed: {e}")
+            if self.failures > failures:
+                self._backoff = min(max(self._backoff * 2, self.flush_interval), self.max_backoff)
+            else:
+                self._backoff = 0.0
+
+    def _flush_and_replay(self):
+        """One round of the background thread. A failed flush skips the replay, which would fail too."""
+        pending = bool(self._buffer)
+        if self.flush() or not pending:
+            self.replay_journal()
+
+    def _insert(self, batch):
+        started = time.perf_counter()
+        try:
+            self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Documents that already made it (e.g. from an earlier partial
+            # replay) are fine; anything else goes back to the journal.
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+                self.failures += 1
+                log.error(f"MongoDB batch insert partially failed: {e}")
+                return 0
+        except Exception as e:
+            self.failures += 1
+            log.error(f"MongoDB batch insert failed: {e}")
+            return 0
+        elapsed = time.perf_counter() - started
+        self.flush_latency.record(elapsed * 1000)
+        if self.on_flush is not None:
+            self.on_flush(elapsed, len(batch))
+        self.written += len(batch)
+        self.batches += 1
+        return len(batch)
+
+    def _append_journal(self, documents, count=True):
+        with self._journal_lock, file_lock(self.journal_path + ".lock"):
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                for doc in documents:
+                    f.write(json_util.dumps(doc) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if count:
+                self.journaled += len(documents)
+
+    def replay_journal(self):
+        """Re-inserts journaled documents. Returns how many were replayed.
+
+        A ``.replaying`` file left behind by a crash mid-replay is picked up
+        first. Lines that cannot be parsed (e.g. truncated by a crash during a
+        journal write) are skipped and appended to ``<journal>.bad``.
+        """
+        replaying_path = self.journal_path + ".replaying"
+        if not (os.path.exists(replaying_path) or os.path.exists(self.journal_path)):
+            return 0
+        with self._replay_lock, file_lock(self.journal_path + ".replay.lock", blocking=False) as locked:
+            if not locked:
+                # Another worker process is replaying
+                return 0
+            return self._replay(replaying_path)
+
+    def _replay(self, replaying_path):
+        with self._journal_lock, file_lock(self.journal_path + ".lock"):
+            if not os.path.exists(replaying_path):
+                if not os.path.exists(self.journal_path):
+                    return 0
+                os.replace(self.journal_path, replaying_path)
+
+        documents, bad_lines = [], []
+        with open(replaying_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    documents.append(json_util.loads(line))
+                except Exception:
+                    bad_lines.append(line if line.endswith("\n") else line + "\n")
+        if bad_lines:
+            self.bad_journal_lines += len(bad_lines)
+            log.warning(f"Skipping {len(bad_lines)} unreadable journal lines, "
+                        f"moved to {self.journal_path}.bad")
+            with open(self.journal_path + ".bad", "a", encoding="utf-8") as f:
+                f.writelines(bad_lines)
+
+        replayed = 0
+        for i in range(0, len(documents), self.replay_chunk_size):
+            chunk = documents[i:i + self.replay_chunk_size]
+            with self._flush_lock:
+                inserted = self._insert(chunk)
+            if inserted < len(chunk):
+                # Still unavailable, keep the rest for the next attempt
+                self._append_journal(documents[i:], count=False)
+                break
+            replayed += inserted
+        os.remove(replaying_path)
+
+        if replayed:
+            self.replayed += replayed
+            log.info(f"Replayed {replayed} journaled documents into MongoDB")
+        return replayed
+
+    def stats(self):
+        journal_bytes = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        return {
+            "running": self._running,
+            "buffered": len(self._buffer),
+            "batch_size": self.batch_size,
+            "flush_interval_s": self.flush_interval,
+            "backoff_s": self._backoff,
+            "written": self.written,
+            "batches": self.batches,
+            "journaled": self.journaled,
+            "replayed": self.replayed,
+            "failures": self.failures,
+            "bad_journal_lines": self.bad_journal_lines,
+            "journal_bytes": journal_bytes,
+            "flush_latency": self.flush_latency.snapshot(),
+        }
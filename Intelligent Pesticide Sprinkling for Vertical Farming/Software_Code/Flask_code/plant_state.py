@@ -0,0 +1,240 @@
+"""Per-plant severity history and the adaptive re-inspection schedule built on it.
+
+Each plant, keyed by (tower, level, plant), is one row in a set of NumPy
+columns: an exponentially weighted moving average (EWMA) of its infection
+percentage, an EWMA of how far each inspection lands above that average
+(the trend, in percentage points), when it was last inspected and when it
+is due again. A few thousand plants take a few hundred kB, updates are O(1)
+under a lock, and listing the plants that are due is one vectorized
+comparison.
+
+After every inspection ``InspectionSchedule`` picks the next interval:
+
+- worsening (trend at or above ``worsening`` points per inspection): ``min_s``
+- healthy and stable (EWMA at or below ``healthy``, |trend| below ``stable``):
+  ``base_s`` doubled for every stable inspection in a row, up to ``max_s``
+- otherwise ``base_s`` shortened in proportion to the severity, down to ``min_s``
+
+The columns are written to an ``.npz`` snapshot every ``snapshot_interval``
+seconds and on stop(), and loaded again on start(), so a restart keeps the
+history.
+
+    store = PlantStateStore(InspectionSchedule(0, 60, 600), path="plant_state.npz").start()
+    state = store.update(("tower-1", 0, "1"), infected_percentage)
+    state["interval_s"]  # -> seconds until the plant should be inspected again
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+COLUMNS = {
+    "ewma": np.float32,
+    "trend": np.float32,
+    "last_severity": np.float32,
+    "last_inspected": np.float64,  # epoch seconds
+    "next_due": np.float64,  # epoch seconds
+    "interval": np.float32,
+    "inspections": np.int32,
+    "stable_streak": np.int16,
+}
+
+
+class InspectionSchedule:
+    def __init__(self, min_s=0.0, base_s=60.0, max_s=600.0, healthy=10.0, stable=2.0, worsening=5.0):
+        self.min_s = min_s
+        self.base_s = max(base_s, min_s)
+        self.max_s = max(max_s, self.base_s)
+        self.healthy = healthy
+        self.stable = stable
+        self.worsening = worsening
+
+    def next_interval(self, ewma, trend, stable_streak):
+        """Returns (interval in seconds, new stable streak)."""
+        if trend >= self.worsening:
+            return self.min_s, 0
+        if ewma <= self.healthy and abs(trend) < self.stable:
+            # Capped: the interval has long reached max_s by then
+            stable_streak = min(stable_streak + 1, 32)
+            return min(self.max_s, self.base_s * 2.0 ** (stable_streak - 1)), stable_streak
+        return max(self.min_s, self.base_s * (1.0 - ewma / 100.0)), 0
+
+
+def _encode_key(key):
+    return json.dumps(list(key))
+
+
+def _decode_key(text):
+    return tuple(json.loads(text))
+
+
+class PlantStateStore:
+    def __init__(self, schedule, alpha=0.3, trend_alpha=0.3, path=None, snapshot_interval=60.0, capacity=256):
+        self.schedule = schedule
+        self.alpha = alpha
+        self.trend_alpha = trend_alpha
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._rows = {}  # key -> row
+        self._keys = []  # row -> key
+        self._columns = {name: np.zeros(capacity, dtype) for name, dtype in COLUMNS.items()}
+        self._stop = threading.Event()
+        self._thread = None
+        self._dirty = False
+        self.updates = 0
+        self.snapshots = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def start(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                self.load()
+                log.info(f"Loaded the state of {len(self)} plants from {self.path}")
+            except Exception as e:
+                log.warning(f"Could not load plant state from {self.path}: {e}")
+        if self.path and self.snapshot_interval:
+            self._thread = threading.Thread(target=self._run, name="plant-state-snapshot", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        if self.path and self._dirty:
+            self.save()
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            if self._dirty:
+                try:
+                    self.save()
+                except Exception as e:
+                    log.warning(f"Plant state snapshot failed: {e}")
+
+    def _row(self, key):
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._keys)
+            if row == len(self._columns["ewma"]):
+                # Double the capacity, like a list, so appends stay amortized O(1)
+                for name, column in self._columns.items():
+                    grown = np.zeros(2 * len(column), column.dtype)
+                    grown[:len(column)] = column
+                    self._columns[name] = grown
+            self._rows[key] = row
+            self._keys.append(key)
+        return row
+
+    def update(self, key, severity, at=None):
+        """Records an inspection of plant ``key`` and schedules the next one. Returns its new state."""
+        at = time.time() if at is None else at
+        c = self._columns
+        with self._lock:
+            row = self._row(key)
+            if c["inspections"][row] == 0:
+                ewma, trend = severity, 0.0
+            else:
+                previous = float(c["ewma"][row])
+                ewma = previous + self.alpha * (severity - previous)
+                # How far this inspection is above (or below) the average, smoothed;
+                # reacts to a jump at once, where the change of the EWMA would lag
+                trend = float(c["trend"][row]) + self.trend_alpha * ((severity - previous) - float(c["trend"][row]))
+            interval, streak = self.schedule.next_interval(ewma, trend, int(c["stable_streak"][row]))
+            c["ewma"][row] = ewma
+            c["trend"][row] = trend
+            c["last_severity"][row] = severity
+            c["last_inspected"][row] = max(at, c["last_inspected"][row])
+            c["next_due"][row] = at + interval
+            c["interval"][row] = interval
+            c["inspections"][row] += 1
+            c["stable_streak"][row] = streak
+            self._dirty = True
+            self.updates += 1
+            return self._state(row)
+
+    def _state(self, row):
+        c = self._columns
+        return {
+            "ewma": round(float(c["ewma"][row]), 2),
+            "trend": round(float(c["trend"][row]), 2),
+            "last_severity": round(float(c["last_severity"][row]), 2),
+            "last_inspected": float(c["last_inspected"][row]),
+            "next_due": float(c["next_due"][row]),
+            "interval_s": round(float(c["interval"][row]), 1),
+            "inspections": int(c["inspections"][row]),
+        }
+
+    def get(self, key):
+        with self._lock:
+            row = self._rows.get(key)
+            return self._state(row) if row is not None else None
+
+    def schedule_list(self, due_only=False, now=None, limit=100):
+        """Plants ordered by when they are due, most overdue first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            count = len(self._keys)
+            next_due = self._columns["next_due"][:count]
+            rows = np.argsort(next_due, kind="stable")
+            if due_only:
+                rows = rows[next_due[rows] <= now]
+            rows = rows[:limit]
+            plants = []
+            for row in rows:
+                tower_id, level, plant_id = self._keys[row]
+                state = self._state(row)
+                state.update(tower_id=tower_id, level=level, plant_id=plant_id,
+                             due_in_s=round(state["next_due"] - now, 1))
+                plants.append(state)
+        return plants
+
+    def save(self):
+        with self._lock:
+            count = len(self._keys)
+            arrays = {name: column[:count].copy() for name, column in self._columns.items()}
+            arrays["keys"] = np.array([_encode_key(key) for key in self._keys], dtype=str)
+            self._dirty = False
+        # Written next to the target and renamed, so a crash never leaves half a snapshot;
+        # the pid keeps several workers from writing the same temporary file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+        self.snapshots += 1
+
+    def load(self):
+        with np.load(self.path, allow_pickle=False) as data:
+            keys = [_decode_key(text) for text in data["keys"]]
+            columns = {name: data[name].astype(dtype) for name, dtype in COLUMNS.items()}
+        capacity = max(len(self._columns["ewma"]), len(keys))
+        with self._lock:
+            self._keys = keys
+            self._rows = {key: row for row, key in enumerate(keys)}
+            for name, dtype in COLUMNS.items():
+                column = np.zeros(capacity, dtype)
+                column[:len(keys)] = columns[name]
+                self._columns[name] = column
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            count = len(self._keys)
+            c = self._columns
+            intervals = c["interval"][:count]
+            return {
+                "plants": count,
+                "due": int(np.count_nonzero(c["next_due"][:count] <= now)),
+                "worsening": int(np.count_nonzero(c["trend"][:count] >= self.schedule.worsening)),
+                "mean_interval_s": round(float(intervals.mean()), 1) if count else None,
+                "updates": self.updates,
+                "snapshots": self.snapshots,
+                "bytes": sum(column.nbytes for column in c.values()),
+            }
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from inference_engine import StageTimer
+
+log = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+
+
+class PostProcessPipeline:
+    """Bounded worker pool for the work that does not decide the spray.
+
+    Jobs are plain callables (box drawing, JPEG encoding, file writes, the
+    MongoDB insert). When the queue is full the drop policy decides what
+    happens: ``drop_oldest`` discards the oldest queued job, ``drop_newest``
+    rejects the new one, and ``block`` waits up to ``block_timeout`` seconds
+    for space before rejecting.
+    """
+
+    def __init__(self, workers=2, max_queue_size=64, drop_policy=DROP_OLDEST, block_timeout=1.0):
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._active = 0
+
+        self.job_latency = StageTimer()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"postprocess-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def submit(self, job):
+        """Queues a job. Returns False if the drop policy rejected it."""
+        with self._cond:
+            if len(self._jobs) >= self.max_queue_size:
+                if self.drop_policy == DROP_OLDEST:
+                    self._jobs.popleft()
+                    self.dropped += 1
+                elif self.drop_policy == BLOCK:
+                    self._cond.wait_for(lambda: len(self._jobs) < self.max_queue_size,
+                                        timeout=self.block_timeout)
+                if len(self._jobs) >= self.max_queue_size:
+                    self.dropped += 1
+                    return False
+            self._jobs.append((job, time.perf_counter()))
+            self.submitted += 1
+            self._cond.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._jobs or not self._running)
+                if not self._jobs:
+                    return
+                job, enqueued = self._jobs.popleft()
+                self._active += 1
+                self._cond.notify_all()
+            try:
+                job()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                log.error(f"Post-processing job failed: {e}")
+            finally:
+                self.job_latency.record((time.perf_counter() - enqueued) * 1000)
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """Waits until every queued job has finished."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._jobs and self._active == 0, timeout=timeout)
+
+    def shutdown(self, timeout=10.0):
+        self.drain(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        return {
+            "running": self._running,
+            "workers": self.workers,
+            "drop_policy": self.drop_policy,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": len(self._jobs),
+            "active": self._active,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "job_latency": self.job_latency.snapshot(),
+        }
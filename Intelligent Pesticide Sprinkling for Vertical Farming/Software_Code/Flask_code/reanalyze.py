@@ -0,0 +1,379 @@
+"""Re-scores stored captures with a new model, in bulk and resumably.
+
+After retraining best.pt the counts in ``analysis_data`` still come from the
+old model. This walks the analyses that have the original camera JPEG
+(``original_filename``, saved since uploads are kept byte-for-byte), runs
+the model on those files in a pool of worker processes, each with its own
+copy of the model and batched inference, and writes the new counts back
+with one bulk_write per chunk.
+
+Analyses from before originals were kept only have the annotated image
+(``image_filename``). They are re-scored from that image, boxes and labels
+drawn in, so their counts are less reliable; such documents get
+``rescored_from: "annotated_image"`` and the run warns about them.
+--originals-only skips them instead.
+
+Every rescored document gets ``model_version`` and the scores of each
+version under ``model_scores.<version>``; the counts it had before are kept
+under the version that produced them (``original`` if unknown).
+--shadow only fills in ``model_scores`` and leaves the dashboard's counts
+alone, for comparing a candidate model on real history first.
+
+Progress is checkpointed after every written chunk, so an interrupted run
+continues where it stopped; documents already carrying the version are
+skipped anyway.
+
+    python reanalyze.py --model best_v2.pt --model-version v2
+    python reanalyze.py --model best_v2.onnx --backend onnx --workers 4 --shadow
+    python reanalyze.py --model best_v2.pt --folder ../../Hardaware_code/22_09_espcam/uploads
+
+--folder re-scores a folder of captures that have no analysis document
+(such as serve_ml.py's uploads/) into the ``reanalysis_results``
+collection, keyed by file name.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from pymongo import MongoClient, UpdateOne
+
+from image_store import THUMBS_DIR, ImageStore
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+SCORE_FIELDS = ("healthy_count", "infected_count", "infected_percentage", "infected_area_percentage")
+
+# Set in each worker process by init_worker()
+_model = None
+_class_map = None
+_settings = None
+
+
+def model_version_for(path, backend):
+    """Default version name, the one the server would store for this model.
+
+    That is the ``model_version`` metadata quantize.py writes into ONNX
+    models, or else the first 12 hex digits of the model file's SHA-256.
+    """
+    if backend == "onnx":
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        version = session.get_modelmeta().custom_metadata_map.get("model_version")
+        if version:
+            return version
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def init_worker(settings):
+    """Loads the model once per worker process."""
+    global _model, _class_map, _settings
+    import cv2
+    from detection_postprocess import ClassMap
+    from inference_backends import load_backend
+
+    # Parallelism comes from the processes; one thread each avoids oversubscribing
+    cv2.setNumThreads(1)
+    threads = settings["threads"]
+    if settings["backend"] == "ultralytics":
+        import torch
+
+        torch.set_num_threads(threads)
+    _model = load_backend(settings["backend"], settings["model"], imgsz=settings["imgsz"],
+                          conf=settings["conf"], iou=settings["iou"], threads=threads)
+    _class_map = ClassMap.from_names(_model.names)
+    _settings = settings
+
+
+def score_chunk(items):
+    """Scores [(key, path), ...]. Returns [(key, scores or None, error or None), ...] and timings."""
+    from detection_postprocess import summarize
+    from frame_decode import decode_for_model
+
+    results = []
+    decode_s = infer_s = 0.0
+    pending = []
+
+    def flush():
+        nonlocal infer_s
+        if not pending:
+            return
+        started = time.perf_counter()
+        detections = _model([frame for _, frame in pending])
+        infer_s += time.perf_counter() - started
+        for (key, _), result in zip(pending, detections):
+            summary = summarize(result, _class_map, conf_threshold=_settings["count_conf"])
+            results.append((key, {
+                "healthy_count": summary["healthy_count"],
+                "infected_count": summary["infected_count"],
+                "infected_percentage": round(summary["infected_percentage"], 2),
+                "infected_area_percentage": round(summary["infected_area_percentage"], 2),
+            }, None))
+        pending.clear()
+
+    for key, path in items:
+        started = time.perf_counter()
+        try:
+            with open(path, "rb") as f:
+                frame, _ = decode_for_model(f.read(), _settings["imgsz"])
+        except OSError as e:
+            frame, error = None, str(e)
+        else:
+            error = None if frame is not None else "not a decodable image"
+        decode_s += time.perf_counter() - started
+        if frame is None:
+            results.append((key, None, error))
+            continue
+        pending.append((key, frame))
+        if len(pending) >= _settings["batch"]:
+            flush()
+    flush()
+    return results, decode_s, infer_s
+
+
+class Checkpoint:
+    """Last fully written key of a run, saved atomically as JSON."""
+
+    def __init__(self, path, version, source):
+        self.path = path
+        self.state = {"model_version": version, "source": source, "last_key": None, "processed": 0}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("model_version") == version and saved.get("source") == source:
+                self.state = saved
+            else:
+                print(f"[WARNING] Checkpoint {path} is for another model or source, starting over")
+
+    @property
+    def last_key(self):
+        return self.state["last_key"]
+
+    def save(self, last_key, processed):
+        self.state.update(last_key=last_key, processed=self.state["processed"] + processed,
+                          updated=datetime.now(timezone.utc).isoformat())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def analysis_items(collection, store, version, last_key, counters, annotated, originals_only=False):
+    """Yields (ObjectId, path) of analyses not yet scored by ``version``.
+
+    The path is the original upload, or for older analyses without one the
+    annotated image; the ids of those are added to ``annotated``.
+    """
+    from bson import ObjectId
+
+    has_original = {"original_filename": {"$ne": None}}
+    if originals_only:
+        query = dict(has_original)
+        counters["no_original"] = collection.count_documents(
+            {"original_filename": None, "model_version": {"$ne": version}})
+    else:
+        query = {"$or": [has_original, {"image_filename": {"$ne": None}}]}
+        counters["no_original"] = collection.count_documents(
+            {"original_filename": None, "image_filename": None, "model_version": {"$ne": version}})
+    query["model_version"] = {"$ne": version}
+    if last_key:
+        query["_id"] = {"$gt": ObjectId(last_key)}
+    projection = {"original_filename": 1, "image_filename": 1}
+    for doc in collection.find(query, projection).sort("_id", 1).batch_size(1000):
+        filename = doc.get("original_filename")
+        if filename is None:
+            filename = doc["image_filename"]
+            annotated.add(doc["_id"])
+            counters["from_annotated"] += 1
+        path = store.locate(filename)
+        if path is None:
+            counters["missing"] += 1
+        elif os.path.relpath(path, store.root).split(os.sep)[0] == THUMBS_DIR:
+            # Only a retention thumbnail is left; scoring it would not be comparable
+            counters["thumbnail_only"] += 1
+        else:
+            yield doc["_id"], path
+
+
+def folder_items(folder, last_key):
+    """Yields (relative name, path) of the JPEGs under ``folder`` in a stable order."""
+    names = []
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                names.append(os.path.relpath(os.path.join(dirpath, name), folder).replace(os.sep, "/"))
+    for name in sorted(names):
+        if last_key is None or name > last_key:
+            yield name, os.path.join(folder, name)
+
+
+def analysis_updates(collection, results, version, shadow, annotated=()):
+    """UpdateOne operations for rescored analysis documents."""
+    ids = [key for key, scores, _ in results if scores is not None]
+    previous = {doc["_id"]: doc for doc in collection.find(
+        {"_id": {"$in": ids}}, {field: 1 for field in SCORE_FIELDS + ("model_version", "model_scores")})}
+    now = datetime.now(timezone.utc)
+    operations = []
+    for key, scores, _ in results:
+        if scores is None:
+            continue
+        update = {f"model_scores.{version}": scores, "reanalyzed_at": now}
+        if key in annotated:
+            update["rescored_from"] = "annotated_image"
+        doc = previous.get(key, {})
+        old_version = doc.get("model_version") or "original"
+        if not shadow:
+            update.update(scores)
+            update["model_version"] = version
+            # Keep what the dashboard showed until now
+            if old_version not in doc.get("model_scores", {}) and "healthy_count" in doc:
+                update[f"model_scores.{old_version}"] = {f: doc[f] for f in SCORE_FIELDS if f in doc}
+        operations.append(UpdateOne({"_id": key}, {"$set": update}))
+    return operations
+
+
+def folder_updates(results, version, folder):
+    now = datetime.now(timezone.utc)
+    return [
+        UpdateOne({"_id": key}, {"$set": {
+            "folder": os.path.abspath(folder),
+            f"model_scores.{version}": scores,
+            "reanalyzed_at": now,
+        }}, upsert=True)
+        for key, scores, _ in results if scores is not None
+    ]
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="New model file")
+    parser.add_argument("--backend", default=os.environ.get("MODEL_BACKEND", "ultralytics"))
+    parser.add_argument("--model-version",
+                        help="Name stored with the scores (default: the model's version metadata, else its file hash)")
+    parser.add_argument("--imgsz", type=int, default=int(os.environ.get("MODEL_IMGSZ", 640)))
+    parser.add_argument("--conf", type=float, default=float(os.environ.get("MODEL_CONF", 0.25)))
+    parser.add_argument("--iou", type=float, default=float(os.environ.get("MODEL_IOU", 0.45)))
+    parser.add_argument("--count-conf", type=float, help="Confidence for counting leaves (default: --conf)")
+    parser.add_argument("--images", default="analysis_images", help="Image store folder of the server")
+    parser.add_argument("--folder", help="Re-score this folder of captures instead of analysis_data")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Inference threads per worker (default: cores / workers)")
+    parser.add_argument("--batch", type=int, default=8, help="Frames per model call")
+    parser.add_argument("--chunk", type=int, default=64, help="Images per worker task and per bulk write")
+    parser.add_argument("--shadow", action="store_true", help="Only add model_scores.<version>, keep the counts")
+    parser.add_argument("--originals-only", action="store_true",
+                        help="Skip analyses that have no original upload instead of using their annotated image")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: reanalysis_<version>.json)")
+    parser.add_argument("--limit", type=int, help="Stop after this many images")
+    parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="smart_pesticide_db")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        raise SystemExit(f"Model file not found: {args.model}")
+    version = args.model_version or model_version_for(args.model, args.backend)
+    source = os.path.abspath(args.folder) if args.folder else "analysis_data"
+    checkpoint = Checkpoint(args.checkpoint or f"reanalysis_{version}.json", version, source)
+
+    db = MongoClient(args.mongodb_uri, serverSelectionTimeoutMS=5000)[args.database]
+    counters = {"scored": 0, "written": 0, "from_annotated": 0, "unreadable": 0, "missing": 0, "thumbnail_only": 0,
+                "no_original": 0}
+    annotated = set()
+    if args.folder:
+        collection = db["reanalysis_results"]
+        items = folder_items(args.folder, checkpoint.last_key)
+    else:
+        collection = db["analysis_data"]
+        items = analysis_items(collection, ImageStore(args.images), version, checkpoint.last_key, counters,
+                               annotated, args.originals_only)
+    if args.limit:
+        items = (item for i, item in zip(range(args.limit), items))
+
+    settings = {
+        "backend": args.backend, "model": args.model, "imgsz": args.imgsz, "conf": args.conf, "iou": args.iou,
+        "count_conf": args.count_conf if args.count_conf is not None else args.conf, "batch": args.batch,
+        "threads": args.threads or max(1, (os.cpu_count() or 1) // args.workers),
+    }
+    if checkpoint.last_key:
+        print(f"[INFO] Resuming after {checkpoint.last_key} ({checkpoint.state['processed']} done before)")
+    print(f"[INFO] Re-scoring {source} with model version {version}: {args.workers} worker(s) x "
+          f"{settings['threads']} thread(s), batch {args.batch}")
+
+    started = time.perf_counter()
+    last_report = started
+    decode_s = infer_s = 0.0
+    with ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(settings,)) as pool:
+        # A few chunks in flight per worker keeps them busy while results are
+        # written in order, so the checkpoint only ever covers finished chunks
+        in_flight = deque()
+        chunks = chunked(items, args.chunk)
+        while True:
+            while len(in_flight) < 2 * args.workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.append((chunk[-1][0], pool.submit(score_chunk, chunk)))
+            if not in_flight:
+                break
+            last_key, future = in_flight.popleft()
+            results, chunk_decode_s, chunk_infer_s = future.result()
+            decode_s += chunk_decode_s
+            infer_s += chunk_infer_s
+            for key, scores, error in results:
+                if scores is None:
+                    counters["unreadable"] += 1
+                    print(f"[WARNING] Skipped {key}: {error}")
+            operations = (folder_updates(results, version, args.folder) if args.folder
+                          else analysis_updates(collection, results, version, args.shadow, annotated))
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            counters["scored"] += len(results)
+            counters["written"] += len(operations)
+            checkpoint.save(str(last_key), len(results))
+
+            now = time.perf_counter()
+            if now - last_report >= 10:
+                last_report = now
+                print(f"[INFO] {counters['scored']} images, {counters['scored'] / (now - started):.1f} images/s")
+
+    elapsed = time.perf_counter() - started
+    rate = counters["scored"] / elapsed if elapsed else 0.0
+    print(f"[INFO] Done: {counters['scored']} images in {elapsed:.1f} s ({rate:.1f} images/s), "
+          f"{counters['written']} documents updated")
+    if counters["scored"]:
+        # Summed over all workers, so these are per-image CPU-side costs
+        print(f"[INFO] Per image: decode {1000 * decode_s / counters['scored']:.1f} ms, "
+              f"inference {1000 * infer_s / counters['scored']:.1f} ms (in the workers)")
+    if counters["from_annotated"]:
+        print(f"[WARNING] {counters['from_annotated']} analyses had no original upload and were re-scored "
+              f"from their annotated image (rescored_from: annotated_image); drawn boxes can skew their counts")
+    if counters["no_original"]:
+        print(f"[WARNING] {counters['no_original']} analyses were NOT re-scored: they have no "
+              f"{'original upload' if args.originals_only else 'stored image'}")
+    skipped = {k: v for k, v in counters.items() if k not in ("scored", "written", "from_annotated") and v}
+    if skipped:
+        print(f"[INFO] Not re-scored: {skipped}")
+
+
+if __name__ == "__main__":
+    main()
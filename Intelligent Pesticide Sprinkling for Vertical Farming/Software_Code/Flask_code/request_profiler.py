@@ -0,0 +1,104 @@
+"""Profiles single analysis requests on demand.
+
+Profiling is off unless a folder is configured (PROFILE_DIR in server.py).
+Then a request is profiled when it carries ``?profile=1`` or when
+``arm(n)`` was called for the next ``n`` requests, which is how a request
+from a carriage is caught, since the firmware can't add the parameter.
+
+pyinstrument, a sampling profiler, is used when it is installed and writes
+an HTML report; otherwise cProfile writes a ``.prof`` file for pstats or
+snakeviz. Inference runs on the batching thread, so a profile shows the
+handler waiting for it; the per-stage histograms on /metrics cover the
+model itself.
+"""
+import cProfile
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+log = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    def __init__(self, output_dir=None, interval=0.001):
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        self.interval = interval
+        self._armed = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.profiled = 0
+
+    @property
+    def enabled(self):
+        return self.output_dir is not None
+
+    def arm(self, count=1):
+        """Profiles the next ``count`` requests. Returns how many are now armed."""
+        with self._lock:
+            self._armed += count
+            return self._armed
+
+    def wants(self, args):
+        """Whether the request with query ``args`` should be profiled; consumes one armed slot."""
+        if not self.enabled:
+            return False
+        if args.get("profile") == "1":
+            return True
+        with self._lock:
+            if self._armed > 0:
+                self._armed -= 1
+                return True
+        return False
+
+    @contextmanager
+    def profile(self, label):
+        """Profiles the ``with`` block. Yields a dict whose "path" is set to the report afterwards."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        stem = os.path.join(self.output_dir, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{sequence}")
+        report = {"path": None}
+        if pyinstrument is not None:
+            profiler = pyinstrument.Profiler(interval=self.interval)
+            profiler.start()
+            try:
+                yield report
+            finally:
+                profiler.stop()
+                report["path"] = stem + ".html"
+                with open(report["path"], "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+        else:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one cProfile at a time; another request has it
+                log.warning("Another request is being profiled, skipping this one")
+                yield report
+                return
+            try:
+                yield report
+            finally:
+                profiler.disable()
+                report["path"] = stem + ".prof"
+                profiler.dump_stats(report["path"])
+        self.profiled += 1
+        log.info("Request profile written to %s", report["path"])
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "output_dir": self.output_dir,
+            "profiler": "pyinstrument" if pyinstrument is not None else "cProfile",
+            "armed": self._armed,
+            "profiled": self.profiled,
+        }
@@ -1,12 +1,39 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 from pymongo import MongoClient
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timezone
 import os
-import cv2
-import numpy as np
-from ultralytics import YOLO
 import base64
+import queue
+import concurrent.futures
+import time
+import atexit
+import logging
+import sys
+import threading
+from inference_engine import BatchInferenceEngine, StageTimer
+from inference_backends import Detections, load_backend, warm_up
+from detection_postprocess import ClassMap, summarize
+from postprocess_pipeline import PostProcessPipeline
+from mongo_writer import BufferedMongoWriter
+from history_query import (
+    HISTORY_SORT, ImageExistenceCache, build_history_query, build_projection,
+    encode_cursor, ensure_indexes, parse_time,
+)
+from trends import build_trend_pipeline, format_trend_rows
+from event_hub import EventHub, MongoRelay
+from analysis_cache import RecentAnalysisCache
+from image_store import ImageStore
+from frame_cache import NearDuplicateCache
+from frame_decode import decode_for_model, jpeg_dimensions
+from image_catalog import ImageCatalog, encode_cursor as encode_catalog_cursor
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from request_profiler import RequestProfiler
+from stream_ingest import StreamIngest, load_cameras
+from health import DISABLED, FAILED, READY, STARTING, HealthRegistry
+from plant_state import InspectionSchedule, PlantStateStore
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -16,28 +43,456 @@ CORS(app)  # Enable CORS for frontend communication
 MONGODB_URI = "mongodb://localhost:27017/"
 DATABASE_NAME = "smart_pesticide_db"
 
+# Model backend: "ultralytics" for best.pt, or "onnx"/"openvino" for an exported
+# model (see export_model.py). All of these can be overridden from the environment.
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "ultralytics")
+MODEL_PATH = os.environ.get("MODEL_PATH", r'C:\Users\9c23o\Plant Infection Level Detection ML model Using YOLOV8\best.pt')
+MODEL_IMGSZ = int(os.environ.get("MODEL_IMGSZ", 640))
+MODEL_CONF = float(os.environ.get("MODEL_CONF", 0.25))
+MODEL_IOU = float(os.environ.get("MODEL_IOU", 0.45))
+MODEL_THREADS = int(os.environ.get("MODEL_THREADS", 0))
+MODEL_WARMUP_RUNS = int(os.environ.get("MODEL_WARMUP_RUNS", 3))
+# Stored with every analysis; defaults to the version in the model's metadata (see quantize.py)
+MODEL_VERSION = os.environ.get("MODEL_VERSION")
+# Detections below this confidence are not counted
+COUNT_CONF_THRESHOLD = float(os.environ.get("COUNT_CONF_THRESHOLD", MODEL_CONF))
+
+# Micro-batching: flush a batch at this many frames or after this many ms
+INFERENCE_MAX_BATCH = 8
+INFERENCE_MAX_WAIT_MS = 20
+INFERENCE_TIMEOUT_S = 10
+
+# A frame that barely differs from the last inferred frame of the same camera
+# position reuses its detections for up to this many seconds (0 = always infer)
+FRAME_CACHE_MAX_AGE_S = float(os.environ.get("FRAME_CACHE_MAX_AGE_S", 120))
+FRAME_CACHE_MAX_PIXEL_DIFF = int(os.environ.get("FRAME_CACHE_MAX_PIXEL_DIFF", 12))
+
+# Background post-processing (annotation, JPEG write, MongoDB insert).
+# Set POSTPROCESS_ASYNC=0 to do it inline before replying, e.g. for comparisons.
+POSTPROCESS_ASYNC = os.environ.get("POSTPROCESS_ASYNC", "1") == "1"
+POSTPROCESS_WORKERS = 2
+POSTPROCESS_QUEUE_SIZE = 64
+POSTPROCESS_DROP_POLICY = "drop_oldest"
+
+# Analysis documents are inserted in batches; if MongoDB is down they are
+# journaled to MONGO_JOURNAL_PATH and replayed once it is back. Worker
+# processes share the journal through file locks, see mongo_writer.py
+MONGO_WRITE_BATCH = 50
+MONGO_FLUSH_INTERVAL_S = 1.0
+MONGO_JOURNAL_PATH = "mongo_journal.jsonl"
+
+HISTORY_MAX_LIMIT = 500
+IMAGES_PAGE_SIZE = 50
+# Recent analyses kept in memory for /latest and the first pages of /history
+RECENT_CACHE_SIZE = 200
+
 # Ensure directories exist
 ANALYSIS_FOLDER = "analysis_images"
 os.makedirs(ANALYSIS_FOLDER, exist_ok=True)
 
-# Load the YOLOv8 model once when the application starts
-try:
-    MODEL_PATH = r'C:\Users\9c23o\Plant Infection Level Detection ML model Using YOLOV8\best.pt'
-    model = YOLO(MODEL_PATH)
-    print("YOLO model loaded successfully.")
-except Exception as e:
-    print(f"Error loading YOLO model: {e}")
-    model = None
-
-# Initialize MongoDB
-try:
-    client = MongoClient(MONGODB_URI)
-    db = client[DATABASE_NAME]
-    analysis_collection = db["analysis_data"]
-    print("MongoDB connected successfully.")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
-    client = None
+# Annotated images are kept full-size for this many days, then replaced by a
+# thumbnail; the oldest are deleted once the folder passes the quota (0 = none)
+IMAGE_FULL_RES_DAYS = int(os.environ.get("IMAGE_FULL_RES_DAYS", 30))
+IMAGE_QUOTA_MB = int(os.environ.get("IMAGE_QUOTA_MB", 0))
+IMAGE_THUMBNAIL_WIDTH = 320
+# Browsers may reuse an image this long before revalidating it with its ETag
+IMAGE_CACHE_MAX_AGE_S = 86400
+# Keep each camera upload byte-for-byte next to its annotated image
+SAVE_ORIGINAL_UPLOADS = os.environ.get("SAVE_ORIGINAL_UPLOADS", "1") == "1"
+
+# Adaptive re-inspection, see plant_state.py: each answer to an upload that
+# names tower, level and plant tells the carriage how many seconds to wait
+# before photographing that plant again; until then it keeps spraying at the
+# last severity without uploading. Worsening plants get INSPECT_MIN_S
+# (0 = the next pass, about 20 s later); healthy, stable ones back off to
+# INSPECT_MAX_S
+INSPECT_MIN_S = float(os.environ.get("INSPECT_MIN_S", 0))
+INSPECT_BASE_S = float(os.environ.get("INSPECT_BASE_S", 60))
+INSPECT_MAX_S = float(os.environ.get("INSPECT_MAX_S", 600))
+# Per-plant severity history, snapshotted this often so restarts keep it
+PLANT_STATE_PATH = "plant_state.npz"
+PLANT_STATE_SNAPSHOT_S = 60
+
+# Threads each process may use for inference and OpenCV (0 = library default).
+# gunicorn.conf.py sets this to cores / workers so workers don't oversubscribe.
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 0))
+# Dashboard streams each hold a server thread for as long as they are open, so
+# a worker accepts at most this many and answers the rest with 503; those
+# dashboards fall back to polling (0 = no limit, fine for the threaded dev server)
+SSE_MAX_CLIENTS = int(os.environ.get("SSE_MAX_CLIENTS", 0))
+# With several worker processes, poll MongoDB this often for analyses written
+# by the other workers (0 = off, the default for a single process)
+EVENT_RELAY_INTERVAL_S = float(os.environ.get("EVENT_RELAY_INTERVAL_S", 0))
+
+# DEBUG logs every step of every upload; INFO and above keep the console
+# (and its I/O) off the request path
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Folder for single-request profiles (unset = profiling off), see request_profiler.py
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+
+# JSON list of fixed cameras whose MJPEG streams are sampled and analyzed
+# like uploads (unset = off), see stream_ingest.py
+STREAM_CONFIG = os.environ.get("STREAM_CONFIG")
+# Default seconds between analyzed frames of one camera
+STREAM_SAMPLE_INTERVAL_S = float(os.environ.get("STREAM_SAMPLE_INTERVAL_S", 5))
+# Stream frames analyzed at the same time, on top of the web threads
+STREAM_MAX_CONCURRENT = int(os.environ.get("STREAM_MAX_CONCURRENT", 4))
+# Only the worker holding this lock pulls the streams, so N gunicorn
+# workers don't open N connections to every camera
+STREAM_LOCK_PATH = "stream_ingest.lock"
+
+# Load and warm up the model on a background thread so the server answers
+# (health checks, dashboard) right after a restart; analysis requests get a
+# 503 until the model is ready. 0 = block startup until it is.
+# MongoDB setup always runs in the background, retrying until it is reachable
+STARTUP_BACKGROUND = os.environ.get("STARTUP_BACKGROUND", "1") == "1"
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+log = logging.getLogger("server")
+
+# Set by load_model() and start_services(), see create_app()
+model = None
+class_map = None
+model_version = None
+inference_engine = None
+client = None
+analysis_collection = None
+mongo_writer = None
+postprocess_pipeline = None
+event_relay = None
+image_catalog = None
+stream_ingest = None
+_stream_lock_file = None
+
+# Content-addressed annotated images, see image_store.py
+image_store = ImageStore(
+    ANALYSIS_FOLDER,
+    full_res_days=IMAGE_FULL_RES_DAYS,
+    thumbnail_width=IMAGE_THUMBNAIL_WIDTH,
+    quota_bytes=IMAGE_QUOTA_MB * 1024 * 1024,
+    on_evict=lambda filename: forget_image(filename),
+    on_thumbnail=lambda *args: image_catalog.mark_thumbnail(*args) if image_catalog is not None else None,
+)
+
+def image_exists(filename):
+    """Checks the image catalog index, or the disk while MongoDB is unavailable."""
+    if image_catalog is not None:
+        try:
+            return image_catalog.exists(filename)
+        except Exception as e:
+            log.warning(f"Image catalog lookup failed: {e}")
+    return image_store.locate(filename) is not None
+
+def forget_image(filename):
+    image_cache.mark(filename, False)
+    if image_catalog is not None:
+        image_catalog.remove(filename)
+
+# Cached image existence checks for the history endpoint
+image_cache = ImageExistenceCache(image_exists)
+
+# Near-duplicate frames skip the model, see frame_cache.py
+frame_cache = None
+if FRAME_CACHE_MAX_AGE_S > 0:
+    frame_cache = NearDuplicateCache(max_age=FRAME_CACHE_MAX_AGE_S, max_pixel_diff=FRAME_CACHE_MAX_PIXEL_DIFF)
+
+# Write-through cache of the newest analysis documents
+analysis_cache = RecentAnalysisCache(RECENT_CACHE_SIZE)
+
+# Severity EWMA, trend and next inspection time per (tower, level, plant)
+plant_states = PlantStateStore(
+    InspectionSchedule(INSPECT_MIN_S, INSPECT_BASE_S, INSPECT_MAX_S),
+    path=PLANT_STATE_PATH,
+    snapshot_interval=PLANT_STATE_SNAPSHOT_S,
+)
+
+# Pushes each finished analysis to dashboards subscribed to /api/analysis/stream
+event_hub = EventHub(max_subscribers=SSE_MAX_CLIENTS)
+
+# Response time of the spray decision, reported by /api/postprocess/stats
+response_timer = StageTimer()
+
+# Prometheus metrics served on /metrics, see metrics.py
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    "analysis_stage_seconds", "Time spent in each stage of an image analysis", ["stage"])
+request_seconds = metrics.histogram(
+    "analysis_request_seconds", "Time from receiving an upload to answering with the spray decision")
+requests_total = metrics.counter("analysis_requests_total", "Analysis requests by HTTP status", ["status"])
+errors_total = metrics.counter("analysis_errors_total", "Failed analysis requests by reason", ["reason"])
+metrics.counter_function(
+    "analysis_frames_dropped_total", "Uploads whose analysis was not run or not stored, by reason",
+    lambda: {
+        ("inference_queue_full",): inference_engine.rejected if inference_engine is not None else 0,
+        ("inference_timeout",): inference_engine.timeouts if inference_engine is not None else 0,
+        ("postprocess_queue_full",): postprocess_pipeline.dropped if postprocess_pipeline is not None else 0,
+    },
+    ["reason"],
+)
+metrics.counter_function(
+    "postprocess_jobs_failed_total", "Post-processing jobs (image save, MongoDB write) that raised",
+    lambda: postprocess_pipeline.failed if postprocess_pipeline is not None else None)
+metrics.counter_function(
+    "frame_cache_hits_total", "Uploads answered from the near-duplicate frame cache",
+    lambda: frame_cache.hits if frame_cache is not None else None)
+metrics.gauge_function(
+    "inference_queue_depth", "Frames waiting for the inference worker",
+    lambda: inference_engine.stats()["queue_depth"] if inference_engine is not None else None)
+metrics.gauge_function(
+    "postprocess_queue_depth", "Post-processing jobs waiting for a worker",
+    lambda: postprocess_pipeline.stats()["queue_depth"] if postprocess_pipeline is not None else None)
+metrics.gauge_function(
+    "mongo_writer_buffered_documents", "Analysis documents waiting for the next MongoDB batch insert",
+    lambda: mongo_writer.stats()["buffered"] if mongo_writer is not None else None)
+metrics.counter_function(
+    "mongo_writer_journaled_documents_total", "Documents written to the local journal because MongoDB was unavailable",
+    lambda: mongo_writer.journaled if mongo_writer is not None else None)
+metrics.counter_function(
+    "stream_frames_total", "Frames received from camera streams, by what happened to them",
+    lambda: {
+        (outcome,): stream_ingest.stats()["totals"][outcome]
+        for outcome in ("frames", "skipped", "corrupt", "analyzed", "failed")
+    } if stream_ingest is not None else None,
+    ["outcome"],
+)
+metrics.counter_function(
+    "stream_reconnects_total", "Camera stream connections that dropped or failed and were retried",
+    lambda: stream_ingest.stats()["totals"]["reconnects"] if stream_ingest is not None else None)
+metrics.gauge_function(
+    "stream_cameras_connected", "Camera streams currently connected",
+    lambda: stream_ingest.stats()["totals"]["connected"] if stream_ingest is not None else None)
+
+# Profiles single requests on demand, see request_profiler.py
+profiler = RequestProfiler(PROFILE_DIR)
+
+# State of each component for /api/health/ready, see health.py. Uploads only
+# need the model; without MongoDB analyses are journaled and written later
+health = HealthRegistry()
+health.register("model")
+health.register("mongodb", required=False)
+health.register("streams", required=False, state=STARTING if STREAM_CONFIG else DISABLED)
+metrics.gauge_function(
+    "server_component_ready", "1 if the component is ready (or disabled), else 0",
+    lambda: {(name,): int(c["state"] in (READY, DISABLED)) for name, c in health.snapshot()["components"].items()},
+    ["component"],
+)
+
+# Set to stop startup retries when shutting down
+startup_stopped = threading.Event()
+
+def load_model():
+    """Loads the model once. Starts no threads, so it is safe to call before forking workers."""
+    global model, class_map, model_version
+    health.set("model", STARTING, f"loading {MODEL_PATH}")
+    try:
+        if not os.path.exists(MODEL_PATH):
+            raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
+        model = load_backend(MODEL_BACKEND, MODEL_PATH, imgsz=MODEL_IMGSZ, conf=MODEL_CONF,
+                             iou=MODEL_IOU, threads=MODEL_THREADS)
+        # Fails here, not with silent zero counts, if the class names don't match
+        class_map = ClassMap.from_names(model.names)
+        model_version = MODEL_VERSION or model.version
+        log.info(f"YOLO model loaded successfully ({MODEL_BACKEND}: {MODEL_PATH}, version {model_version}).")
+    except Exception as e:
+        log.error(f"Error loading YOLO model: {e}")
+        health.set("model", FAILED, f"{type(e).__name__}: {e}")
+        model = None
+
+def start_services(load=False):
+    """Starts the inference worker, MongoDB connection and background pools.
+
+    Threads and MongoClient connections don't survive fork(), so in a
+    multi-worker server this runs in every worker after it has been forked.
+    With ``load`` the model is loaded here if it wasn't already. Loading and
+    warm-up run on a background thread unless STARTUP_BACKGROUND is 0, as
+    does the MongoDB setup; see /api/health/ready for their progress.
+    """
+    global client, analysis_collection, mongo_writer, postprocess_pipeline, image_catalog
+
+    if WORKER_THREADS:
+        import cv2
+
+        cv2.setNumThreads(WORKER_THREADS)
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(WORKER_THREADS)
+
+    # Initialize MongoDB. The client connects lazily, so this doesn't wait for the server
+    try:
+        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
+        db = client[DATABASE_NAME]
+        analysis_collection = db["analysis_data"]
+        mongo_writer = BufferedMongoWriter(
+            analysis_collection,
+            batch_size=MONGO_WRITE_BATCH,
+            flush_interval=MONGO_FLUSH_INTERVAL_S,
+            journal_path=MONGO_JOURNAL_PATH,
+            on_flush=lambda seconds, count: stage_seconds.observe(seconds, stage="mongo_insert"),
+        ).start()
+        # Index of stored images for /api/images and existence checks
+        image_catalog = ImageCatalog(db["image_catalog"])
+    except Exception as e:
+        log.error(f"Error connecting to MongoDB: {e}")
+        health.set("mongodb", FAILED, f"{type(e).__name__}: {e}")
+        client = None
+        mongo_writer = None
+
+    image_store.start()
+    plant_states.start()
+
+    if POSTPROCESS_ASYNC:
+        postprocess_pipeline = PostProcessPipeline(
+            workers=POSTPROCESS_WORKERS,
+            max_queue_size=POSTPROCESS_QUEUE_SIZE,
+            drop_policy=POSTPROCESS_DROP_POLICY,
+        ).start()
+
+    atexit.register(shutdown_services)
+
+    if client is not None:
+        threading.Thread(target=prepare_mongodb, name="mongodb-startup", daemon=True).start()
+    if STARTUP_BACKGROUND:
+        threading.Thread(target=start_model, args=(load,), name="model-startup", daemon=True).start()
+    else:
+        start_model(load)
+
+def start_model(load):
+    """Loads (if asked) and warms up the model, then starts the inference worker and camera streams."""
+    global inference_engine
+
+    if load and model is None:
+        load_model()
+    if model is None:
+        if health.state("model") != FAILED:
+            health.set("model", FAILED, "No model loaded")
+        return
+
+    # Warm-up runs here and not in load_model() so a preloading master never
+    # starts the framework's thread pools before it forks
+    try:
+        if MODEL_WARMUP_RUNS:
+            health.set("model", STARTING, "warming up")
+            log.info(f"Model warm-up done, last run took {warm_up(model, MODEL_WARMUP_RUNS):.1f} ms")
+        # Start the batching inference worker so concurrent uploads share model calls
+        inference_engine = BatchInferenceEngine(
+            model,
+            max_batch_size=INFERENCE_MAX_BATCH,
+            max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        ).start()
+    except Exception as e:
+        log.error(f"Error warming up the model: {e}")
+        health.set("model", FAILED, f"{type(e).__name__}: {e}")
+        return
+    health.set("model", READY, f"{MODEL_BACKEND}: {MODEL_PATH}")
+
+    if STREAM_CONFIG:
+        start_stream_ingest()
+
+def start_stream_ingest():
+    global stream_ingest
+    if not acquire_stream_lock():
+        health.set("streams", DISABLED, "pulled by another worker")
+        return
+    try:
+        cameras = load_cameras(STREAM_CONFIG, STREAM_SAMPLE_INTERVAL_S)
+        stream_ingest = StreamIngest(cameras, run_analysis_for_stream,
+                                     max_concurrent=STREAM_MAX_CONCURRENT).start()
+        health.set("streams", READY, f"{len(cameras)} camera(s)")
+        log.info(f"Pulling {len(cameras)} camera stream(s) from {STREAM_CONFIG}")
+    except Exception as e:
+        log.error(f"Could not start camera stream ingest: {e}")
+        health.set("streams", FAILED, f"{type(e).__name__}: {e}")
+
+def prepare_mongodb():
+    """Waits for MongoDB, then creates the indexes, prepares the image catalog and starts the event relay."""
+    global event_relay
+    delay = 1.0
+    while True:
+        try:
+            client.admin.command("ping")
+            break
+        except Exception as e:
+            health.set("mongodb", FAILED, f"{type(e).__name__}: {e}")
+            log.warning(f"MongoDB not reachable, retrying in {delay:.0f} s: {e}")
+            if startup_stopped.wait(delay):
+                return
+            delay = min(delay * 2, 30.0)
+    log.info("MongoDB connected successfully.")
+
+    # Make sure history queries are served from an index
+    try:
+        ensure_indexes(analysis_collection)
+    except Exception as e:
+        log.warning(f"Could not create MongoDB indexes: {e}")
+
+    try:
+        image_catalog.ensure_indexes()
+        if image_catalog.is_empty():
+            # Catalogue images saved before the catalog existed
+            backfill_image_catalog()
+    except Exception as e:
+        log.warning(f"Could not prepare the image catalog: {e}")
+
+    if EVENT_RELAY_INTERVAL_S:
+        event_relay = MongoRelay(
+            analysis_collection,
+            relay_analysis,
+            interval=EVENT_RELAY_INTERVAL_S,
+        ).start()
+    health.set("mongodb", READY, MONGODB_URI)
+
+def acquire_stream_lock():
+    """Non-blocking lock so one worker process pulls the camera streams. Held until the process exits."""
+    global _stream_lock_file
+    try:
+        import fcntl
+    except ImportError:
+        # Windows: no pre-forking server there, so this is the only process
+        return True
+    _stream_lock_file = open(STREAM_LOCK_PATH, "w")
+    try:
+        fcntl.flock(_stream_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        _stream_lock_file.close()
+        _stream_lock_file = None
+        log.info("Camera streams are pulled by another worker")
+        return False
+    return True
+
+def backfill_image_catalog():
+    try:
+        seen = image_catalog.rebuild(image_store, analysis_collection)
+        log.info(f"Image catalog backfilled with {seen} existing images")
+    except Exception as e:
+        log.error(f"Image catalog backfill failed: {e}")
+
+def shutdown_services():
+    """Stops inference, finishes queued post-processing, then flushes buffered MongoDB writes."""
+    startup_stopped.set()
+    if stream_ingest is not None:
+        stream_ingest.stop()
+    if inference_engine is not None:
+        inference_engine.stop()
+    if postprocess_pipeline is not None:
+        postprocess_pipeline.shutdown()
+    if event_relay is not None:
+        event_relay.stop()
+    image_store.stop()
+    plant_states.stop()
+    if mongo_writer is not None:
+        mongo_writer.close()
+
+def create_app(load=True, start=True):
+    """Application factory used by ``python server.py`` and gunicorn.conf.py.
+
+    ``load=False`` and ``start=False`` leave loading the model and starting
+    the services to the caller; a pre-forking server does those in the
+    master or in each worker.
+    """
+    if start:
+        start_services(load=load)
+    elif load and model is None:
+        load_model()
+    return app
 
 # --- API Endpoints ---
 
@@ -52,231 +507,514 @@ def test_api():
     return jsonify({
         "status": "API is working",
         "mongodb_connected": client is not None,
-        "model_loaded": model is not None,
+        "model_loaded": inference_engine is not None,
+        "ready": health.ready(),
+        "model_backend": MODEL_BACKEND,
+        "model_version": model_version,
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "analysis_folder": ANALYSIS_FOLDER,
         "analysis_folder_exists": os.path.exists(ANALYSIS_FOLDER)
     }), 200
 
+def save_analysis(result, analysis_document, upload=None):
+    """Draws the detections, saves the annotated image and stores the analysis document.
+
+    ``upload`` is the original JPEG from the camera, stored as-is if given.
+    """
+    with stage_seconds.time(stage="plot"):
+        annotated_frame = result.plot()
+
+    # Named by content hash, so uploads in the same second can't overwrite each other
+    with stage_seconds.time(stage="imwrite"):
+        image_filename, image_size = image_store.save(annotated_frame)
+    analysis_document["image_filename"] = image_filename
+    image_cache.mark(image_filename)
+    log.debug("Annotated image saved: %s", image_filename)
+
+    # The camera's JPEG is already encoded; writing its bytes avoids a lossy re-encode
+    if upload is not None:
+        with stage_seconds.time(stage="upload_write"):
+            original_filename, original_size = image_store.save_bytes(upload)
+        analysis_document["original_filename"] = original_filename
+
+    with stage_seconds.time(stage="mongo_queue"):
+        document_id = mongo_writer.write(analysis_document)
+    log.debug("Analysis data queued with ID: %s", document_id)
+    catalog_image(image_filename, image_size, annotated_frame.shape[1], annotated_frame.shape[0], analysis_document)
+    if upload is not None:
+        width, height = jpeg_dimensions(upload) or (None, None)
+        catalog_image(original_filename, original_size, width, height, analysis_document)
+    if event_relay is not None:
+        event_relay.mark_seen(document_id)
+
+    publish_analysis(analysis_document, f'/api/images/{analysis_document["image_filename"]}')
+
+def catalog_image(image_filename, image_size, width, height, analysis_document):
+    """Records a saved image in the catalog. A failure only costs the listing entry."""
+    if image_catalog is None:
+        return
+    try:
+        image_catalog.record(
+            image_filename, image_size, width, height,
+            analysis_id=analysis_document["_id"],
+            timestamp=analysis_document["timestamp"],
+            location={key: analysis_document.get(key) for key in ("tower_id", "level", "plant_id")},
+        )
+    except Exception as e:
+        log.warning(f"Could not catalog image {image_filename}: {e}")
+
+def publish_analysis(analysis_document, image_url):
+    """Adds an analysis to the recent cache and pushes it to dashboard streams."""
+    analysis_cache.add(analysis_document, image_url)
+
+    timestamp = analysis_document["timestamp"]
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    event = dict(analysis_document)
+    event["_id"] = str(analysis_document["_id"])
+    event["timestamp"] = timestamp.isoformat()
+    event["image_url"] = image_url
+    event_hub.publish(event)
+
+def relay_analysis(doc):
+    """Takes in an analysis made by another worker: plant history, then the dashboard stream."""
+    if (all(doc.get(key) is not None for key in ("tower_id", "level", "plant_id"))
+            and doc.get("infected_percentage") is not None):
+        timestamp = doc["timestamp"]
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        plant_states.update((doc["tower_id"], doc.get("level"), doc.get("plant_id")),
+                            doc["infected_percentage"], at=timestamp.timestamp())
+    publish_analysis(doc, image_cache.image_url(doc.get("image_filename")))
+
+def get_plant_location(args):
+    """Reads the optional tower/level/plant identifiers from the query string."""
+    location = {}
+    if args.get("tower"):
+        location["tower_id"] = args.get("tower")
+    if args.get("level") is not None:
+        try:
+            location["level"] = int(args.get("level"))
+        except ValueError:
+            raise ValueError(f"Invalid level: {args.get('level')}")
+    if args.get("plant"):
+        location["plant_id"] = args.get("plant")
+    return location
+
 @app.route("/api/analysis/image", methods=["POST"])
 def analyze_image_from_esp32():
-    print("[DEBUG] Received image analysis request")
-    
+    request_started = time.perf_counter()
+    if profiler.wants(request.args):
+        with profiler.profile("analysis") as report:
+            response, status = analyze_image(request_started)
+        if report["path"]:
+            response.headers["X-Profile"] = os.path.basename(report["path"])
+    else:
+        response, status = analyze_image(request_started)
+    request_seconds.observe(time.perf_counter() - request_started)
+    requests_total.inc(status=status)
+    return response, status
+
+def analyze_image(request_started):
+    """Decides the spray for one upload. Returns (response, status)."""
+    log.debug("Received image analysis request")
+
+    try:
+        with stage_seconds.time(stage="body_read"):
+            data = request.get_data()
+        # The firmware tags each upload with ?tower=..&level=..&plant=..
+        location = get_plant_location(request.args)
+    except ValueError as e:
+        errors_total.inc(reason="bad_location")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception(f"Error reading upload: {e}")
+        errors_total.inc(reason="exception")
+        return jsonify({"error": str(e)}), 500
+
+    body, status = run_analysis(data, location, request.remote_addr, request_started)
+    response = jsonify(body)
+    if status == 503:
+        # Model still loading or inference queue full: worth retrying soon
+        response.headers["Retry-After"] = "1"
+    return response, status
+
+def run_analysis_for_stream(data, location, source):
+    """Analyzes a frame sampled from a camera stream, see stream_ingest.py."""
+    started = time.perf_counter()
+    body, status = run_analysis(data, location, source, started)
+    stage_seconds.observe(time.perf_counter() - started, stage="stream_analysis")
+    return body, status
+
+def run_analysis(data, location, source, request_started):
+    """Detection, spray decision and storage for one JPEG, shared by uploads and camera streams.
+
+    ``source`` tells cameras apart in the frame cache when there is no
+    tower id. Returns (body, status) with a plain dict, since stream frames
+    are analyzed outside a request.
+    """
     if client is None:
-        print("[ERROR] Backend not connected to MongoDB")
-        return jsonify({"error": "Backend not connected to MongoDB."}), 500
+        log.error("Backend not connected to MongoDB")
+        errors_total.inc(reason="mongodb_unavailable")
+        return {"error": "Backend not connected to MongoDB."}, 500
     
-    if model is None:
-        print("[ERROR] ML model not loaded")
-        return jsonify({"error": "ML model not loaded."}), 500
+    if inference_engine is None:
+        if health.state("model") == STARTING:
+            errors_total.inc(reason="model_loading")
+            return {"error": "ML model is still loading, retry shortly."}, 503
+        log.error("ML model not loaded")
+        errors_total.inc(reason="model_unavailable")
+        return {"error": "ML model not loaded."}, 500
 
     try:
-        if not request.data:
-            print("[ERROR] No image data received")
-            return jsonify({"error": "No image data received."}), 400
+        if not data:
+            log.error("No image data received")
+            errors_total.inc(reason="no_data")
+            return {"error": "No image data received."}, 400
         
-        print(f"[DEBUG] Received image data size: {len(request.data)} bytes")
-        
-        # Decode image from raw request data
-        np_arr = np.frombuffer(request.data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        log.debug("Received image data size: %d bytes from %s", len(data), source)
 
-        if frame is None:
-            print("[ERROR] Failed to decode image")
-            return jsonify({"error": "Failed to decode image. Ensure it is a valid JPEG."}), 400
+        # Decode image from raw request data, scaled down by libjpeg when the
+        # upload is at least twice the model's input size
+        with stage_seconds.time(stage="decode"):
+            frame, decode_factor = decode_for_model(data, MODEL_IMGSZ)
 
-        print(f"[DEBUG] Image decoded successfully. Shape: {frame.shape}")
+        if frame is None:
+            log.error("Failed to decode image")
+            errors_total.inc(reason="decode")
+            return {"error": "Failed to decode image. Ensure it is a valid JPEG."}, 400
 
-        timestamp_str = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        log.debug("Image decoded successfully. Shape: %s, reduced 1/%d", frame.shape, decode_factor)
 
-        # Run object detection on the frame and get the annotated result
-        print("[DEBUG] Running YOLO detection...")
-        results = model(frame, verbose=False)
-        annotated_frame = results[0].plot()
+        # Carriages re-shoot the same plant every cycle; an unchanged frame
+        # reuses the detections of the last one from the same position
+        cache_key = (location.get("tower_id") or source, location.get("level"), location.get("plant_id"))
+        cached = fingerprint = None
+        if frame_cache is not None:
+            with stage_seconds.time(stage="frame_cache"):
+                cached, fingerprint = frame_cache.lookup(cache_key, frame)
 
-        # Save the annotated image to the analysis_images folder
-        annotated_filename = f"annotated_plant_{timestamp_str}.jpg"
-        annotated_filepath = os.path.join(ANALYSIS_FOLDER, annotated_filename)
-        
-        success = cv2.imwrite(annotated_filepath, annotated_frame)
-        if success:
-            print(f"[INFO] Annotated image saved: {annotated_filepath}")
+        if cached is not None:
+            log.debug("Near-duplicate frame, reusing cached detections")
+            result = Detections(cached.xyxy, cached.conf, cached.cls, cached.names, frame)
         else:
-            print(f"[ERROR] Failed to save annotated image: {annotated_filepath}")
-            return jsonify({"error": "Failed to save annotated image"}), 500
-        
-        # Process detections to get current counts
-        current_healthy = 0
-        current_infected = 0
-        for r in results:
-            for box in r.boxes:
-                class_id = int(box.cls[0].cpu().numpy())
-                class_name = model.names[class_id]
-                if class_name == 'Healthy_leaves':
-                    current_healthy += 1
-                elif class_name == 'Infected_leaves':
-                    current_infected += 1
+            # Run object detection on the frame (queue wait plus the model's share of the batch)
+            log.debug("Running YOLO detection...")
+            inference_started = time.perf_counter()
+            try:
+                result = inference_engine.submit(frame, timeout=INFERENCE_TIMEOUT_S)
+            except queue.Full:
+                log.error("Inference queue full")
+                errors_total.inc(reason="inference_queue_full")
+                return {"error": "Inference queue full, retry later."}, 503
+            except concurrent.futures.TimeoutError:
+                log.error(f"Inference did not finish within {INFERENCE_TIMEOUT_S} s")
+                errors_total.inc(reason="inference_timeout")
+                return {"error": "Inference timed out, retry later."}, 503
+            inference_seconds = time.perf_counter() - inference_started
+            stage_seconds.observe(inference_seconds, stage="inference")
+            if frame_cache is not None:
+                # Without the frame itself, so entries stay a few hundred bytes
+                frame_cache.store(cache_key, fingerprint,
+                                  Detections(result.xyxy, result.conf, result.cls, result.names, None),
+                                  inference_seconds * 1000)
         
-        print(f"[DEBUG] Detection results - Healthy: {current_healthy}, Infected: {current_infected}")
+        # Count healthy/infected leaves and compute the infection percentage
+        summary = summarize(result, class_map, conf_threshold=COUNT_CONF_THRESHOLD)
+        infected_percentage = summary["infected_percentage"]
         
-        # Calculate infection percentage
-        total_leaves = current_healthy + current_infected
-        infected_percentage = (current_infected / total_leaves) * 100 if total_leaves > 0 else 0
+        log.debug("Detection results - Healthy: %d, Infected: %d", summary["healthy_count"], summary["infected_count"])
+
+        # Fold the result into the plant's history and decide when to look
+        # again. Only a full tower/level/plant location names one plant;
+        # untagged uploads keep the firmware's fixed cadence
+        analyzed_at = datetime.now(timezone.utc)
+        plant = None
+        if all(location.get(key) is not None for key in ("tower_id", "level", "plant_id")):
+            plant = plant_states.update(cache_key, infected_percentage, at=analyzed_at.timestamp())
         
-        # Create a document to be saved
+        # Create a document to be saved; save_analysis() fills in the image filenames
         analysis_document = {
-            "healthy_count": current_healthy,
-            "infected_count": current_infected,
+            "healthy_count": summary["healthy_count"],
+            "infected_count": summary["infected_count"],
             "infected_percentage": float(f"{infected_percentage:.2f}"),
-            "timestamp": datetime.now(timezone.utc),
-            "image_filename": annotated_filename
+            "infected_area_percentage": float(f"{summary['infected_area_percentage']:.2f}"),
+            "timestamp": analyzed_at,
+            "image_filename": None,
+            "tower_id": location.get("tower_id"),
+            "level": location.get("level"),
+            "plant_id": location.get("plant_id"),
+            "inference_cached": cached is not None,
         }
+        if model_version is not None:
+            # Unknown for .pt weights and ONNX files without metadata; reanalyze.py calls those "original"
+            analysis_document["model_version"] = model_version
+        if plant is not None:
+            analysis_document.update({
+                "severity_ewma": plant["ewma"],
+                "severity_trend": plant["trend"],
+                "next_inspection_s": plant["interval_s"],
+            })
+
+        upload = data if SAVE_ORIGINAL_UPLOADS else None
 
-        # Save the analysis data to the MongoDB collection
-        result = analysis_collection.insert_one(analysis_document)
-        print(f"[INFO] Analysis data saved with ID: {result.inserted_id}")
+        # Annotated image and MongoDB record only matter to the dashboard,
+        # so they are written after the spray decision has been returned
+        if postprocess_pipeline is not None:
+            if not postprocess_pipeline.submit(lambda: save_analysis(result, analysis_document, upload)):
+                log.warning("Post-processing queue full, analysis dropped")
+        else:
+            save_analysis(result, analysis_document, upload)
+
+        response_timer.record((time.perf_counter() - request_started) * 1000)
 
         # Return a simple JSON response
-        return jsonify({
+        body = {
             #"message": "Image analyzed and data saved.",
             #"healthy_count": current_healthy,
             #"infected_count": current_infected,
             "infected_percentage": infected_percentage,
             #"timestamp": analysis_document["timestamp"].isoformat(),
-            #"image_url": f"/api/images/{annotated_filename}",
-            #"image_filename": annotated_filename,
+            #"image_url": f"/api/images/{analysis_document['image_filename']}",
+            #"image_filename": analysis_document["image_filename"],
             #"image_path": annotated_filepath
-        }), 200
+        }
+        if plant is not None:
+            # Whole seconds, for the firmware's integer parsing
+            body["next_inspection_s"] = int(plant["interval_s"])
+        return body, 200
 
     except Exception as e:
-        print(f"[ERROR] Error processing analysis data: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        log.exception(f"Error processing analysis data: {e}")
+        errors_total.inc(reason="exception")
+        return {"error": str(e)}, 500
+
+@app.route("/api/health/live", methods=["GET"])
+def liveness():
+    """Liveness probe: the process answers requests, whatever its components are doing."""
+    return jsonify({"status": "alive", "uptime_s": health.snapshot()["uptime_s"]}), 200
+
+@app.route("/api/health/ready", methods=["GET"])
+def readiness():
+    """Readiness probe: 200 once every required component is ready, else 503; both with per-component state."""
+    snapshot = health.snapshot()
+    return jsonify(snapshot), 200 if snapshot["ready"] else 503
+
+@app.route("/api/inference/stats", methods=["GET"])
+def get_inference_stats():
+    """Reports queue depth, batch sizes and per-stage latency of the inference worker and near-duplicate frame cache hits."""
+    if inference_engine is None:
+        return jsonify({"error": "ML model not loaded."}), 500
+    stats = inference_engine.stats()
+    stats["frame_cache"] = frame_cache.stats() if frame_cache is not None else None
+    return jsonify(stats), 200
+
+@app.route("/api/postprocess/stats", methods=["GET"])
+def get_postprocess_stats():
+    """Reports spray-decision response times and the state of the post-processing pool."""
+    return jsonify({
+        "async_enabled": postprocess_pipeline is not None,
+        "response_time": response_timer.snapshot(),
+        "pipeline": postprocess_pipeline.stats() if postprocess_pipeline is not None else None,
+        "mongo_writer": mongo_writer.stats() if mongo_writer is not None else None,
+        "event_hub": event_hub.stats(),
+        "event_relay": event_relay.stats() if event_relay is not None else None,
+    }), 200
+
+@app.route("/api/streams/stats", methods=["GET"])
+def get_stream_stats():
+    """Reports connection state, frame counters and the last result of every camera stream."""
+    if stream_ingest is None:
+        return jsonify({"enabled": False}), 200
+    stats = stream_ingest.stats()
+    stats["enabled"] = True
+    return jsonify(stats), 200
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Per-stage latency histograms and error/drop counters in the Prometheus text format."""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route("/api/debug/profile", methods=["GET", "POST"])
+def profile_requests():
+    """POST arms profiling of the next ?count= analysis requests; GET reports the profiler state."""
+    if not profiler.enabled:
+        return jsonify({"error": "Profiling is off; set PROFILE_DIR to enable it."}), 404
+    if request.method == "POST":
+        try:
+            count = int(request.args.get("count", 1))
+        except ValueError:
+            return jsonify({"error": "count must be an integer."}), 400
+        profiler.arm(count)
+    return jsonify(profiler.stats()), 200
+
+@app.route("/api/plants/schedule", methods=["GET"])
+def get_inspection_schedule():
+    """Plants ordered by when they are next due for inspection, with their severity EWMA and trend.
+
+    ``?due=1`` lists only the overdue ones; ``?limit=`` caps the list (default 100).
+    """
+    try:
+        limit = min(int(request.args.get("limit", 100)), HISTORY_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    return jsonify({
+        "stats": plant_states.stats(),
+        "plants": plant_states.schedule_list(due_only=request.args.get("due") == "1", limit=limit),
+    }), 200
+
+@app.route("/api/cache/stats", methods=["GET"])
+def get_cache_stats():
+    """Reports hit/miss counters of the recent-analysis and image-existence caches."""
+    return jsonify({
+        "recent_analyses": analysis_cache.stats(),
+        "image_existence": {"hits": image_cache.hits, "misses": image_cache.misses},
+        "image_store": image_store.stats(),
+    }), 200
+
+@app.route("/api/analysis/stream", methods=["GET"])
+def stream_analyses():
+    """Server-sent events stream with one 'analysis' event per finished analysis."""
+    subscription = event_hub.subscribe()
+    if subscription is None:
+        return jsonify({"error": "Too many live dashboards on this worker, poll /api/analysis/latest instead."}), 503
+    return Response(
+        event_hub.stream(subscription),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def load_recent_analyses(limit):
+    return analysis_collection.find().sort(HISTORY_SORT).limit(limit)
 
 @app.route("/api/analysis/latest", methods=["GET"])
 def get_latest_analysis():
-    """Fetches the most recent analysis data and the corresponding annotated image filename."""
-    print("[DEBUG] Fetching latest analysis...")
-    
+    """Returns the most recent analysis, served from the in-memory cache."""
     if client is None:
         return jsonify({"error": "Backend not connected to MongoDB."}), 500
     
     try:
-        latest_analysis = analysis_collection.find_one(sort=[('timestamp', -1)])
+        cold = analysis_cache.warm(load_recent_analyses, image_cache.image_url)
+        latest_analysis = analysis_cache.latest(count=not cold)
         if latest_analysis:
-            print(f"[DEBUG] Found latest analysis: {latest_analysis}")
-            
             latest_analysis["_id"] = str(latest_analysis["_id"])
+            latest_analysis["image_url"] = image_cache.image_url(latest_analysis.get("image_filename"))
             latest_analysis["timestamp"] = latest_analysis["timestamp"].isoformat()
-            
-            image_filename = latest_analysis.get("image_filename")
-            if image_filename:
-                # Check if the image file actually exists
-                image_path = os.path.join(ANALYSIS_FOLDER, image_filename)
-                if os.path.exists(image_path):
-                    latest_analysis['image_url'] = f'/api/images/{image_filename}'
-                    print(f"[DEBUG] Image file exists: {image_path}")
-                else:
-                    latest_analysis['image_url'] = None
-                    print(f"[WARNING] Image file not found: {image_path}")
-            else:
-                latest_analysis['image_url'] = None
-                print("[WARNING] No image filename in latest analysis")
-            
             return jsonify(latest_analysis), 200
         else:
-            print("[DEBUG] No analysis data found in database")
             return jsonify({"message": "No analysis data found."}), 404
     except Exception as e:
-        print(f"[ERROR] Error fetching latest analysis: {e}")
+        log.error(f"Error fetching latest analysis: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/images/<path:filename>', methods=["GET"])
 def serve_image(filename):
-    """Endpoint to serve images from the analysis_images folder."""
-    print(f"[DEBUG] Serving image request for: {filename}")
+    """Endpoint to serve images from the image store, full-size or thumbnail."""
+    log.debug(f"Serving image request for: {filename}")
     
     try:
         # Add security check to prevent directory traversal
         if '..' in filename or filename.startswith('/'):
-            print(f"[ERROR] Invalid filename: {filename}")
+            log.error(f"Invalid filename: {filename}")
             return jsonify({"error": "Invalid filename"}), 400
             
-        image_path = os.path.join(ANALYSIS_FOLDER, filename)
-        print(f"[DEBUG] Looking for image at: {image_path}")
-        
-        if not os.path.exists(image_path):
-            print(f"[ERROR] Image not found: {image_path}")
-            # List available files for debugging
-            try:
-                files = os.listdir(ANALYSIS_FOLDER)
-                print(f"[DEBUG] Available files in {ANALYSIS_FOLDER}: {files}")
-            except:
-                print(f"[DEBUG] Could not list files in {ANALYSIS_FOLDER}")
+        image_path = image_store.locate(filename)
+        if image_path is None:
+            log.error(f"Image not found: {filename}")
             return jsonify({"error": "Image not found"}), 404
         
-        print(f"[DEBUG] Serving image: {image_path}")
-        return send_from_directory(ANALYSIS_FOLDER, filename, as_attachment=False)
+        log.debug(f"Serving image: {image_path}")
+        # ETag + Cache-Control: browsers reuse their copy and revalidate with
+        # If-None-Match, which is answered with 304 and no body
+        return send_file(image_path, as_attachment=False, conditional=True, etag=True,
+                         max_age=IMAGE_CACHE_MAX_AGE_S)
         
     except Exception as e:
-        print(f"[ERROR] Error serving image {filename}: {e}")
+        log.error(f"Error serving image {filename}: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/analysis/history", methods=["GET"])
-def get_analysis_history2():
-    """Fetches the most recent 10 analysis records from MongoDB for the frontend."""
+def get_analysis_history():
+    """Pages through analysis records, newest first.
+
+    Query parameters: ``limit`` (default 10, max 500), ``cursor`` (the
+    ``next_cursor`` of the previous page), ``from``/``to`` (ISO-8601 time
+    range) and ``fields`` (comma-separated projection).
+    """
     if client is None:
         return jsonify({"error": "Backend not connected to MongoDB."}), 500
     
     try:
-        history = analysis_collection.find().sort("timestamp", -1).limit(10)
+        limit = min(max(request.args.get('limit', 10, type=int), 1), HISTORY_MAX_LIMIT)
+        time_from = request.args.get('from')
+        time_to = request.args.get('to')
+        query = build_history_query(
+            cursor=request.args.get('cursor'),
+            time_from=parse_time(time_from) if time_from else None,
+            time_to=parse_time(time_to) if time_to else None,
+        )
+        projection = build_projection(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # The first page of unfiltered history comes straight from the cache
+        history = None
+        if not query and projection is None:
+            cold = analysis_cache.warm(load_recent_analyses, image_cache.image_url)
+            history = analysis_cache.recent(limit, count=not cold)
+        else:
+            analysis_cache.record_miss()
+        if history is None:
+            history = analysis_collection.find(query, projection).sort(HISTORY_SORT).limit(limit)
         history_list = []
+        next_cursor = None
         for doc in history:
+            next_cursor = encode_cursor(doc)
             doc["_id"] = str(doc["_id"])
             doc["timestamp"] = doc["timestamp"].isoformat() + "Z"
+            # Re-resolved even for cached documents: retention may have evicted the image
+            if "image_filename" in doc:
+                doc["image_url"] = image_cache.image_url(doc["image_filename"])
             history_list.append(doc)
         
-        return jsonify({"analyses": history_list}), 200
+        return jsonify({
+            "analyses": history_list,
+            "next_cursor": next_cursor if len(history_list) == limit else None,
+        }), 200
     except Exception as e:
-        print(f"Error fetching analysis history: {e}")
+        log.error(f"Error fetching analysis history: {e}")
         return jsonify({"error": str(e)}), 500
-    
-def get_analysis_history():
-    """Fetches the most recent analysis records from MongoDB for the frontend."""
-    print("[DEBUG] Fetching analysis history...")
-    
+
+@app.route("/api/analysis/trends", methods=["GET"])
+def get_analysis_trends():
+    """Aggregates infection statistics per time bucket on the database side.
+
+    Query parameters: ``bucket`` (minute/hour/day, default hour),
+    ``group_by`` (none/tower/level/plant), ``from``/``to`` (ISO-8601, default
+    the last 7 days) and ``tower``/``level``/``plant`` filters.
+    """
     if client is None:
         return jsonify({"error": "Backend not connected to MongoDB."}), 500
-    
+
     try:
-        # Get limit parameter from query string, default to 10
-        limit = request.args.get('limit', 10, type=int)
-        
-        history = analysis_collection.find().sort("timestamp", -1).limit(limit)
-        history_list = []
-        for doc in history:
-            doc["_id"] = str(doc["_id"])
-            doc["timestamp"] = doc["timestamp"].isoformat()
-            
-            image_filename = doc.get("image_filename")
-            if image_filename:
-                # Check if the image file actually exists
-                image_path = os.path.join(ANALYSIS_FOLDER, image_filename)
-                if os.path.exists(image_path):
-                    doc['image_url'] = f'/api/images/{image_filename}'
-                else:
-                    doc['image_url'] = None
-            else:
-                doc['image_url'] = None
+        time_from = request.args.get('from')
+        time_to = request.args.get('to')
+        pipeline = build_trend_pipeline(
+            bucket=request.args.get('bucket', 'hour'),
+            group_by=request.args.get('group_by', 'none'),
+            time_from=parse_time(time_from) if time_from else None,
+            time_to=parse_time(time_to) if time_to else None,
+            location=get_plant_location(request.args),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-            history_list.append(doc)
-        
-        print(f"[DEBUG] Returning {len(history_list)} analysis records")
-        return jsonify({"analyses": history_list}), 200
-        
+    try:
+        rows = format_trend_rows(analysis_collection.aggregate(pipeline))
+        return jsonify({"trends": rows}), 200
     except Exception as e:
-        print(f"[ERROR] Error fetching analysis history: {e}")
+        log.error(f"Error aggregating analysis trends: {e}")
         return jsonify({"error": str(e)}), 500
 
 # Add a test endpoint to create dummy data for testing
@@ -287,18 +1025,20 @@ def create_test_data():
         return jsonify({"error": "Backend not connected to MongoDB."}), 500
     
     try:
+        import cv2
+        import numpy as np
+
         # Create a dummy image (simple colored rectangle)
         dummy_image = np.zeros((300, 400, 3), dtype=np.uint8)
         dummy_image[:, :] = [0, 255, 0]  # Green color
         cv2.putText(dummy_image, 'TEST IMAGE', (50, 150), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 2)
         
-        timestamp_str = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
-        test_filename = f"test_image_{timestamp_str}.jpg"
-        test_filepath = os.path.join(ANALYSIS_FOLDER, test_filename)
-        
-        success = cv2.imwrite(test_filepath, dummy_image)
-        if not success:
+        try:
+            test_filename, test_size = image_store.save(dummy_image)
+        except IOError:
             return jsonify({"error": "Failed to create test image"}), 500
+        test_filepath = image_store.locate(test_filename)
+        image_cache.mark(test_filename)
         
         # Create test analysis document
         test_document = {
@@ -310,6 +1050,10 @@ def create_test_data():
         }
         
         result = analysis_collection.insert_one(test_document)
+        if event_relay is not None:
+            event_relay.mark_seen(result.inserted_id)
+        catalog_image(test_filename, test_size, dummy_image.shape[1], dummy_image.shape[0], test_document)
+        analysis_cache.add(test_document, f"/api/images/{test_filename}")
         
         return jsonify({
             "message": "Test data created successfully",
@@ -319,32 +1063,72 @@ def create_test_data():
         }), 200
         
     except Exception as e:
-        print(f"[ERROR] Error creating test data: {e}")
+        log.error(f"Error creating test data: {e}")
         return jsonify({"error": str(e)}), 500
 
-# List all available images
+# List stored images
 @app.route("/api/images", methods=["GET"])
 def list_images():
-    """List all available images in the analysis folder."""
+    """Pages through the image catalog, newest first.
+
+    Query parameters: ``limit`` (default 50, max 500), ``cursor`` (the
+    ``next_cursor`` of the previous page), ``from``/``to`` (ISO-8601),
+    ``tier`` (full/thumbnail), ``tower``/``level``/``plant`` and ``analysis_id``.
+    """
+    if image_catalog is None:
+        return jsonify({"error": "Backend not connected to MongoDB."}), 500
+
     try:
-        files = os.listdir(ANALYSIS_FOLDER)
-        image_files = [f for f in files if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif'))]
-        
+        limit = min(max(request.args.get('limit', IMAGES_PAGE_SIZE, type=int), 1), HISTORY_MAX_LIMIT)
+        time_from = request.args.get('from')
+        time_to = request.args.get('to')
+        analysis_id = request.args.get('analysis_id')
+        try:
+            analysis_id = ObjectId(analysis_id) if analysis_id else None
+        except InvalidId:
+            raise ValueError(f"Invalid analysis_id: {analysis_id}")
+        query = image_catalog.build_query(
+            cursor=request.args.get('cursor'),
+            time_from=parse_time(time_from) if time_from else None,
+            time_to=parse_time(time_to) if time_to else None,
+            tier=request.args.get('tier'),
+            location=get_plant_location(request.args),
+            analysis_id=analysis_id,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        images = []
+        next_cursor = None
+        for doc in image_catalog.page(query, limit):
+            next_cursor = encode_catalog_cursor(doc)
+            doc["filename"] = doc.pop("_id")
+            doc["url"] = f"/api/images/{doc['filename']}"
+            doc["timestamp"] = doc["timestamp"].isoformat() + "Z"
+            doc["analysis_ids"] = [str(i) for i in doc.get("analysis_ids", [])]
+            images.append(doc)
+
         return jsonify({
             "folder": ANALYSIS_FOLDER,
-            "total_files": len(files),
-            "image_files": image_files,
-            "all_files": files
+            "images": images,
+            "next_cursor": next_cursor if len(images) == limit else None,
         }), 200
         
     except Exception as e:
-        print(f"[ERROR] Error listing images: {e}")
+        log.error(f"Error listing images: {e}")
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
-    print(f"[INFO] Starting Flask server...")
-    print(f"[INFO] Analysis folder: {ANALYSIS_FOLDER}")
-    print(f"[INFO] Analysis folder exists: {os.path.exists(ANALYSIS_FOLDER)}")
+    log.info("Starting Flask server...")
+    log.info(f"Analysis folder: {ANALYSIS_FOLDER}")
+    log.info(f"Analysis folder exists: {os.path.exists(ANALYSIS_FOLDER)}")
     
-    # Enable debug mode for development
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    create_app()
+
+    # Development server. The reloader is off because it imports this module a
+    # second time, loading the model and opening MongoDB twice; for production
+    # use several workers: gunicorn -c gunicorn.conf.py
+    # threaded=True keeps long-lived /api/analysis/stream connections from
+    # blocking uploads.
+    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False, threaded=True)
\ No newline at end of file
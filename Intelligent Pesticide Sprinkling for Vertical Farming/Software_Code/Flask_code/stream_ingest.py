@@ -0,0 +1,467 @@
+"""Pulls MJPEG streams from fixed cameras and analyzes a sample of their frames.
+
+One asyncio event loop on a background thread holds a connection to every
+camera, so hundreds of streams cost a socket and a small buffer each rather
+than a thread. Frames are split out of the ``multipart/x-mixed-replace``
+stream (the ESP32-CAM ``/stream`` format, including its chunked transfer
+encoding) by their part headers, or by JPEG start/end markers when a part
+has no Content-Length; nothing is decoded. Each camera keeps at most one
+frame every ``interval_s`` seconds and never has more than one analysis
+running; the rest are dropped as they arrive. Kept frames go to the
+``analyze(jpeg_bytes, location, source)`` callable on a small thread pool,
+which in server.py is the same path an uploaded JPEG takes. When its answer
+carries ``next_inspection_s`` (the adaptive schedule in plant_state.py), the
+camera's next frame waits that long instead, but never less than
+``interval_s``.
+
+A dropped connection or a stalled stream is retried with exponential backoff
+and jitter, reset once frames flow again.
+
+RTSP/H.264 streams can't be split into frames without decoding them; point
+such cameras at an MJPEG restream instead (e.g. ffmpeg ... -f mpjpeg).
+
+Cameras are listed in a JSON file:
+
+    [{"name": "tower1-l0", "url": "http://10.0.0.21:81/stream",
+      "tower": "tower1", "level": 0, "plant": "1", "interval_s": 5}]
+
+Offline check against the fake server in fake_mjpeg_server.py, counting and
+validating sampled frames without a model:
+
+    python stream_ingest.py --fake 200 --fake-fps 10 --interval 2 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+# Part headers are a few lines; anything longer means we lost the framing
+MAX_HEADER_BYTES = 8192
+READ_SIZE = 64 * 1024
+
+
+class StreamError(Exception):
+    """The camera answered, but not with a stream we can read."""
+
+
+class ChunkedDecoder:
+    """Incremental decoder for ``Transfer-Encoding: chunked`` bodies."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._remaining = 0  # bytes left in the current chunk
+        self._need_crlf = False
+        self.done = False
+
+    def feed(self, data):
+        self._buf += data
+        out = bytearray()
+        while not self.done:
+            if self._remaining:
+                take = min(self._remaining, len(self._buf))
+                if not take:
+                    break
+                out += self._buf[:take]
+                del self._buf[:take]
+                self._remaining -= take
+                if not self._remaining:
+                    self._need_crlf = True
+                continue
+            if self._need_crlf:
+                if len(self._buf) < 2:
+                    break
+                del self._buf[:2]
+                self._need_crlf = False
+            end = self._buf.find(b"\r\n")
+            if end < 0:
+                if len(self._buf) > MAX_HEADER_BYTES:
+                    raise StreamError("Malformed chunk size line")
+                break
+            size_line = bytes(self._buf[:end]).split(b";", 1)[0].strip()
+            del self._buf[:end + 2]
+            try:
+                self._remaining = int(size_line, 16)
+            except ValueError:
+                raise StreamError(f"Malformed chunk size {size_line[:20]!r}")
+            if not self._remaining:
+                self.done = True
+        return bytes(out)
+
+
+class MultipartJpegParser:
+    """Splits JPEG frames out of an MJPEG byte stream without decoding them.
+
+    ``wants_frame()`` is asked once per frame, as soon as the frame starts;
+    bytes of unwanted frames are discarded instead of being copied out.
+    Without a ``boundary`` the stream is taken to be bare concatenated JPEGs.
+    """
+
+    def __init__(self, boundary, wants_frame):
+        self.marker = b"--" + boundary.encode("latin-1") if boundary else None
+        self.wants_frame = wants_frame
+        self._buf = bytearray()
+        self._state = "boundary" if self.marker else "soi"
+        self._length = None
+        self._take = False
+        self.frames = 0
+        self.skipped = 0
+        self.corrupt = 0
+
+    def feed(self, data):
+        """Returns the wanted frames completed by ``data``, as bytes."""
+        self._buf += data
+        frames = []
+        while True:
+            if self._state == "boundary":
+                start = self._buf.find(self.marker)
+                if start < 0:
+                    # Keep a possible partial marker at the end
+                    del self._buf[:max(0, len(self._buf) - len(self.marker))]
+                    break
+                end = self._buf.find(b"\r\n", start + len(self.marker))
+                if end < 0:
+                    del self._buf[:start]
+                    break
+                del self._buf[:end + 2]
+                self._state = "headers"
+            elif self._state == "headers":
+                end = self._buf.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(self._buf) > MAX_HEADER_BYTES:
+                        self.corrupt += 1
+                        self._state = "boundary"
+                        continue
+                    break
+                self._length = None
+                for line in bytes(self._buf[:end]).split(b"\r\n"):
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        try:
+                            self._length = int(value.strip())
+                        except ValueError:
+                            pass
+                del self._buf[:end + 4]
+                self._start_frame()
+                self._state = "body"
+            elif self._state == "body":
+                if self._length is not None:
+                    if len(self._buf) < self._length:
+                        if not self._take:
+                            self._length -= len(self._buf)
+                            self._buf.clear()
+                        break
+                    self._finish_frame(self._buf[:self._length], frames)
+                    del self._buf[:self._length]
+                else:
+                    end = self._buf.find(b"\r\n" + self.marker)
+                    if end < 0:
+                        break
+                    self._finish_frame(self._buf[:end], frames)
+                    del self._buf[:end]
+                self._state = "boundary"
+            elif self._state == "soi":
+                start = self._buf.find(SOI)
+                if start < 0:
+                    del self._buf[:max(0, len(self._buf) - 1)]
+                    break
+                del self._buf[:start]
+                self._start_frame()
+                self._state = "eoi"
+            else:  # "eoi", bare JPEG stream
+                end = self._buf.find(EOI, 2)
+                if end < 0:
+                    break
+                self._finish_frame(self._buf[:end + 2], frames)
+                del self._buf[:end + 2]
+                self._state = "soi"
+        return frames
+
+    def _start_frame(self):
+        self.frames += 1
+        self._take = self.wants_frame()
+        if not self._take:
+            self.skipped += 1
+
+    def _finish_frame(self, data, frames):
+        if not self._take:
+            return
+        if data[:2] != SOI:
+            self.corrupt += 1
+            return
+        frames.append(bytes(data))
+
+
+class CameraStream:
+    """Connection, sampling and counters for one camera."""
+
+    def __init__(self, name, url, location, interval_s):
+        self.name = name
+        self.url = url
+        self.location = location
+        self.interval_s = interval_s
+        self.connected = False
+        self.busy = False
+        self.next_due = 0.0
+        self.bytes = 0
+        self.analyzed = 0
+        self.failed = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.last_result = None
+        self.last_frame_at = None
+        self.parser = None
+        self.frames = self.skipped = self.corrupt = 0
+
+    def wants_frame(self):
+        now = time.monotonic()
+        if self.busy or now < self.next_due:
+            return False
+        self.next_due = now + self.interval_s
+        return True
+
+    def stats(self):
+        parser = self.parser
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "frames": self.frames + (parser.frames if parser else 0),
+            "skipped": self.skipped + (parser.skipped if parser else 0),
+            "corrupt": self.corrupt + (parser.corrupt if parser else 0),
+            "analyzed": self.analyzed,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "seconds_since_frame": round(time.monotonic() - self.last_frame_at, 1) if self.last_frame_at else None,
+        }
+
+
+def load_cameras(path, default_interval_s=5.0):
+    with open(path) as f:
+        entries = json.load(f)
+    cameras = []
+    for i, entry in enumerate(entries):
+        location = {}
+        if entry.get("tower"):
+            location["tower_id"] = str(entry["tower"])
+        if entry.get("level") is not None:
+            location["level"] = int(entry["level"])
+        if entry.get("plant"):
+            location["plant_id"] = str(entry["plant"])
+        cameras.append(CameraStream(entry.get("name") or f"camera-{i}", entry["url"], location,
+                                    float(entry.get("interval_s", default_interval_s))))
+    return cameras
+
+
+class StreamIngest:
+    def __init__(self, cameras, analyze, max_concurrent=4, connect_timeout=5.0, stall_timeout=15.0,
+                 backoff_base=1.0, backoff_max=60.0):
+        self.cameras = cameras
+        self.analyze = analyze
+        self.max_concurrent = max_concurrent
+        self.connect_timeout = connect_timeout
+        self.stall_timeout = stall_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._executor = None
+        self._loop = None
+        self._stop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self.started_at = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._executor = ThreadPoolExecutor(self.max_concurrent, thread_name_prefix="stream-analysis")
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name="stream-ingest", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        self.started_at = time.monotonic()
+        return self
+
+    def stop(self, timeout=10.0):
+        if self._thread is None:
+            return
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout)
+        self._thread = None
+        self._executor.shutdown(wait=False)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        tasks = [asyncio.create_task(self._run_camera(camera)) for camera in self.cameras]
+        self._ready.set()
+        await self._stop.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_camera(self, camera):
+        delay = self.backoff_base
+        while True:
+            frames_before = camera.frames + (camera.parser.frames if camera.parser else 0)
+            try:
+                await self._read_stream(camera)
+                camera.last_error = "stream ended"
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, StreamError) as e:
+                camera.last_error = f"{type(e).__name__}: {e}"
+            finally:
+                camera.connected = False
+                if camera.parser is not None:
+                    camera.frames += camera.parser.frames
+                    camera.skipped += camera.parser.skipped
+                    camera.corrupt += camera.parser.corrupt
+                    camera.parser = None
+            if camera.frames > frames_before:
+                # The connection worked for a while; retry quickly
+                delay = self.backoff_base
+            camera.reconnects += 1
+            log.warning("Camera %s disconnected (%s), retrying in about %.0f s", camera.name, camera.last_error, delay)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, self.backoff_max)
+
+    async def _read_stream(self, camera):
+        parts = urlsplit(camera.url)
+        if parts.scheme not in ("http", "https"):
+            raise StreamError(f"Unsupported stream URL {camera.url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=parts.scheme == "https"), self.connect_timeout)
+        try:
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAccept: multipart/x-mixed-replace\r\n"
+                         f"Connection: close\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.stall_timeout)
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            if len(status_line.split()) < 2 or status_line.split()[1] != "200":
+                raise StreamError(f"Camera answered {status_line!r}")
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            boundary = None
+            for param in headers.get("content-type", "").split(";")[1:]:
+                key, _, value = param.strip().partition("=")
+                if key.lower() == "boundary":
+                    boundary = value.strip('"')
+            # Some servers write the boundary with its leading dashes
+            if boundary and boundary.startswith("--"):
+                boundary = boundary[2:]
+            decoder = ChunkedDecoder() if "chunked" in headers.get("transfer-encoding", "").lower() else None
+            camera.parser = parser = MultipartJpegParser(boundary, camera.wants_frame)
+            camera.connected = True
+
+            while True:
+                data = await asyncio.wait_for(reader.read(READ_SIZE), self.stall_timeout)
+                if not data:
+                    return
+                camera.bytes += len(data)
+                if decoder is not None:
+                    data = decoder.feed(data)
+                for frame in parser.feed(data):
+                    camera.last_frame_at = time.monotonic()
+                    self._submit(camera, frame)
+        finally:
+            writer.close()
+
+    def _submit(self, camera, frame):
+        camera.busy = True
+        future = self._loop.run_in_executor(self._executor, self.analyze, frame, camera.location, camera.name)
+
+        def done(f):
+            camera.busy = False
+            try:
+                body, status = f.result()
+            except Exception as e:
+                camera.failed += 1
+                camera.last_error = f"analysis failed: {e}"
+                return
+            if status == 200:
+                camera.analyzed += 1
+                camera.last_result = body
+                if body.get("next_inspection_s"):
+                    camera.next_due = max(camera.next_due, time.monotonic() + body["next_inspection_s"])
+            else:
+                camera.failed += 1
+                camera.last_error = f"analysis returned {status}: {body}"
+
+        future.add_done_callback(done)
+
+    def stats(self):
+        cameras = {camera.name: camera.stats() for camera in self.cameras}
+        totals = {key: sum(c[key] for c in cameras.values())
+                  for key in ("frames", "skipped", "corrupt", "analyzed", "failed", "bytes", "reconnects")}
+        totals["connected"] = sum(1 for c in cameras.values() if c["connected"])
+        totals["cameras"] = len(cameras)
+        return {"totals": totals, "cameras": cameras}
+
+
+def main():
+    from fake_mjpeg_server import FakeMjpegServer
+    from frame_decode import decode_for_model, jpeg_dimensions
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", help="JSON list of cameras")
+    parser.add_argument("--fake", type=int, default=0, metavar="N", help="Start a fake server with N cameras")
+    parser.add_argument("--fake-fps", type=float, default=10.0)
+    parser.add_argument("--fake-drop-after", type=int, default=0, help="Fake cameras hang up after this many frames")
+    parser.add_argument("--interval", type=float, default=5.0, help="Default seconds between analyzed frames")
+    parser.add_argument("--decode", action="store_true", help="Also decode sampled frames at model size")
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    fake = None
+    if args.fake:
+        fake = FakeMjpegServer(cameras=args.fake, fps=args.fake_fps, drop_after=args.fake_drop_after).start()
+        cameras = [CameraStream(f"fake-{i}", f"{fake.url}/stream/{i}", {"tower_id": f"fake-{i}"}, args.interval)
+                   for i in range(args.fake)]
+    elif args.config:
+        cameras = load_cameras(args.config, args.interval)
+    else:
+        raise SystemExit("Give --config or --fake")
+
+    def check_frame(data, location, source):
+        # Stand-in for the server's analysis: header parse, optionally a reduced decode
+        if jpeg_dimensions(data) is None:
+            return {"error": "no JPEG header"}, 400
+        if args.decode and decode_for_model(data, 640)[0] is None:
+            return {"error": "decode failed"}, 400
+        return {"bytes": len(data)}, 200
+
+    ingest = StreamIngest(cameras, check_frame).start()
+    cpu_started, started = time.process_time(), time.monotonic()
+    time.sleep(args.duration)
+    cpu, elapsed = time.process_time() - cpu_started, time.monotonic() - started
+    totals = ingest.stats()["totals"]
+    ingest.stop()
+    if fake is not None:
+        fake.stop()
+
+    print(f"Cameras: {totals['cameras']} ({totals['connected']} connected at the end), {elapsed:.1f} s")
+    print(f"Frames: {totals['frames']} ({totals['frames'] / elapsed:.1f}/s), "
+          f"{totals['bytes'] / elapsed / 2**20:.1f} MB/s, analyzed {totals['analyzed']}, "
+          f"skipped {totals['skipped']}, corrupt {totals['corrupt']}, failed {totals['failed']}")
+    print(f"Reconnects: {totals['reconnects']}  CPU: {100 * cpu / elapsed:.1f}% of one core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import pytest
+
+from inference_engine import BatchInferenceEngine
+
+
+class SlowModel:
+    """Returns the frames themselves, holding each call until ``release`` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.batches = []
+
+    def __call__(self, frames):
+        self.release.wait(5)
+        self.batches.append(list(frames))
+        return list(frames)
+
+
+def test_submit_returns_the_result_for_its_frame():
+    model = SlowModel()
+    model.release.set()
+    engine = BatchInferenceEngine(model, max_wait_ms=1).start()
+    try:
+        assert engine.submit("a", timeout=2) == "a"
+    finally:
+        engine.stop()
+
+
+def test_timed_out_frame_is_dropped_from_its_batch():
+    model = SlowModel()
+    engine = BatchInferenceEngine(model, max_batch_size=1, max_wait_ms=1).start()
+    try:
+        # "first" occupies the model, so "late" is still queued when it times out
+        first = threading.Thread(target=engine.submit, args=("first", 5))
+        first.start()
+        with pytest.raises(FutureTimeoutError):
+            engine.submit("late", timeout=0.1)
+        model.release.set()
+        first.join()
+        assert engine.submit("next", timeout=2) == "next"
+    finally:
+        engine.stop()
+    assert ["late"] not in model.batches
+    assert engine.stats()["timeouts"] == 1
+
+
+def test_stop_fails_frames_still_queued():
+    engine = BatchInferenceEngine(SlowModel())
+    # Never started, so the frame stays in the queue
+    future = Future()
+    engine._queue.put_nowait(("frame", future, 0.0))
+    engine.stop()
+    with pytest.raises(RuntimeError):
+        future.result(timeout=0)
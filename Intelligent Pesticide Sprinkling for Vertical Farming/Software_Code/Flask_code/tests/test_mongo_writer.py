@@ -0,0 +1,167 @@
+import os
+import time
+
+import mongomock
+import pytest
+from bson import json_util
+from pymongo.errors import ServerSelectionTimeoutError
+
+from mongo_writer import BufferedMongoWriter
+
+
+class FlakyCollection:
+    """mongomock collection whose insert_many fails while ``down`` is set."""
+
+    def __init__(self):
+        self.collection = mongomock.MongoClient().db.analysis_data
+        self.down = False
+        self.calls = 0
+
+    def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        if self.down:
+            raise ServerSelectionTimeoutError("MongoDB is down")
+        return self.collection.insert_many(documents, ordered=ordered)
+
+    def count_documents(self, query):
+        return self.collection.count_documents(query)
+
+
+@pytest.fixture
+def collection():
+    return FlakyCollection()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return str(tmp_path / "mongo_journal.jsonl")
+
+
+def read_journal(path):
+    with open(path, encoding="utf-8") as f:
+        return [json_util.loads(line) for line in f if line.strip()]
+
+
+def test_flush_inserts_buffered_documents(collection, journal):
+    writer = BufferedMongoWriter(collection, journal_path=journal)
+    ids = [writer.write({"n": i}) for i in range(3)]
+
+    assert collection.count_documents({}) == 0
+    assert writer.flush() == 3
+    assert collection.count_documents({"_id": {"$in": ids}}) == 3
+    assert not os.path.exists(journal)
+
+
+def test_failed_flush_is_journaled_and_replayed(collection, journal):
+    writer = BufferedMongoWriter(collection, journal_path=journal)
+    collection.down = True
+    ids = [writer.write({"n": i}) for i in range(3)]
+
+    assert writer.flush() == 0
+    assert [doc["_id"] for doc in read_journal(journal)] == ids
+    assert writer.stats()["journaled"] == 3
+
+    collection.down = False
+    assert writer.replay_journal() == 3
+    assert collection.count_documents({}) == 3
+    assert not os.path.exists(journal)
+    assert not os.path.exists(journal + ".replaying")
+
+
+def test_replay_keeps_documents_while_still_down(collection, journal):
+    writer = BufferedMongoWriter(collection, journal_path=journal)
+    collection.down = True
+    writer.write({"n": 1})
+    writer.flush()
+
+    assert writer.replay_journal() == 0
+    assert len(read_journal(journal)) == 1
+    assert not os.path.exists(journal + ".replaying")
+
+
+def test_replay_is_idempotent_for_already_inserted_documents(collection, journal):
+    writer = BufferedMongoWriter(collection, journal_path=journal)
+    document = {"n": 1}
+    writer.write(document)
+    writer.flush()
+    # A crash between insert and journal removal replays the same _id again
+    writer._append_journal([document])
+
+    assert writer.replay_journal() == 1
+    assert collection.count_documents({}) == 1
+
+
+def test_leftover_replaying_file_is_replayed_first(collection, journal):
+    writer = BufferedMongoWriter(collection, journal_path=journal)
+    writer._append_journal([{"n": 1}, {"n": 2}])
+    # As if the process died between the rename and the remove
+    os.replace(journal, journal + ".replaying")
+
+    assert not os.path.exists(journal)
+    assert writer.replay_journal() == 2
+    assert collection.count_documents({}) == 2
+    assert not os.path.exists(journal + ".replaying")
+
+
+def test_unreadable_journal_lines_are_moved_aside(collection, journal):
+    writer = BufferedMongoWriter(collection, journal_path=journal)
+    writer._append_journal([{"n": 1}, {"n": 2}])
+    # A crash in the middle of a write leaves a truncated last line
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('{"n": 3, "_id": {"$oid"')
+
+    assert writer.replay_journal() == 2
+    assert collection.count_documents({}) == 2
+    assert writer.stats()["bad_journal_lines"] == 1
+    with open(journal + ".bad", encoding="utf-8") as f:
+        assert f.read() == '{"n": 3, "_id": {"$oid"\n'
+
+
+def test_backlog_past_max_buffered_spills_to_journal(collection, journal):
+    writer = BufferedMongoWriter(collection, batch_size=2, max_buffered=4, journal_path=journal)
+    for i in range(5):
+        writer.write({"n": i})
+
+    assert len(read_journal(journal)) == 3
+    assert writer.stats()["buffered"] == 2
+
+
+def test_background_thread_skips_replay_and_backs_off_while_down(collection, journal):
+    writer = BufferedMongoWriter(collection, batch_size=1, flush_interval=0.05, max_backoff=0.2,
+                                 journal_path=journal).start()
+    try:
+        collection.down = True
+        writer.write({"n": 1})
+        time.sleep(0.5)
+        # Without backoff, and with a replay after every failed flush, this
+        # would be around 20 attempts
+        assert 1 <= collection.calls <= 6
+        assert writer.stats()["backoff_s"] == 0.2
+
+        collection.down = False
+        deadline = time.monotonic() + 2
+        while collection.count_documents({}) < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert collection.count_documents({}) == 1
+    finally:
+        writer.close()
+    assert writer.stats()["backoff_s"] == 0.0
+
+
+def test_background_thread_survives_exceptions(collection, journal):
+    def on_flush(seconds, count):
+        raise RuntimeError("metrics broke")
+
+    writer = BufferedMongoWriter(collection, batch_size=1, flush_interval=0.05, max_backoff=0.05,
+                                 journal_path=journal, on_flush=on_flush).start()
+    try:
+        writer.write({"n": 1})
+        time.sleep(0.2)
+        writer.write({"n": 2})
+        deadline = time.monotonic() + 2
+        while collection.count_documents({}) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert collection.count_documents({}) == 2
+        assert writer._thread.is_alive()
+    finally:
+        writer.close()
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+# Bucket widths supported by /api/analysis/trends, as $dateToString formats
+BUCKET_FORMATS = {
+    "minute": "%Y-%m-%dT%H:%M:00Z",
+    "hour": "%Y-%m-%dT%H:00:00Z",
+    "day": "%Y-%m-%dT00:00:00Z",
+}
+
+# Which plant identifier fields each group_by level adds to the bucket key
+GROUP_FIELDS = {
+    "none": [],
+    "tower": ["tower_id"],
+    "level": ["tower_id", "level"],
+    "plant": ["tower_id", "level", "plant_id"],
+}
+
+DEFAULT_WINDOW = timedelta(days=7)
+
+
+def build_trend_pipeline(bucket="hour", group_by="none", time_from=None, time_to=None, location=None):
+    """Builds the aggregation pipeline for infection trends per time bucket.
+
+    ``location`` optionally restricts the data to a tower/level/plant, e.g.
+    ``{"tower_id": "tower-1", "level": 0}``.
+    """
+    if bucket not in BUCKET_FORMATS:
+        raise ValueError(f"Unknown bucket '{bucket}', expected one of {sorted(BUCKET_FORMATS)}")
+    if group_by not in GROUP_FIELDS:
+        raise ValueError(f"Unknown group_by '{group_by}', expected one of {sorted(GROUP_FIELDS)}")
+
+    if time_to is None:
+        time_to = datetime.now(timezone.utc)
+    if time_from is None:
+        time_from = time_to - DEFAULT_WINDOW
+
+    match = {"timestamp": {"$gte": time_from, "$lt": time_to}}
+    if location:
+        match.update(location)
+
+    group_key = {"bucket": {"$dateToString": {"format": BUCKET_FORMATS[bucket], "date": "$timestamp"}}}
+    for field in GROUP_FIELDS[group_by]:
+        group_key[field] = f"${field}"
+
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": group_key,
+            "samples": {"$sum": 1},
+            "mean_infected_percentage": {"$avg": "$infected_percentage"},
+            "max_infected_percentage": {"$max": "$infected_percentage"},
+            "healthy_total": {"$sum": "$healthy_count"},
+            "infected_total": {"$sum": "$infected_count"},
+        }},
+        {"$sort": {"_id.bucket": 1}},
+    ]
+
+
+def format_trend_rows(rows):
+    """Flattens the aggregation output into JSON-friendly rows."""
+    formatted = []
+    for row in rows:
+        key = row.pop("_id")
+        mean = row["mean_infected_percentage"]
+        row["mean_infected_percentage"] = round(mean, 2) if mean is not None else None
+        formatted.append({**key, **row})
+    return formatted
@@ -1,88 +1,199 @@
-import cv2
+import argparse
+import os
+import sys
+import threading
 import time
-from ultralytics import YOLO
-
-# Load your custom-trained YOLOv8 model
-model = YOLO(r'C:\Users\9c23o\Plant Infection Level Detection ML model Using YOLOV8\best.pt')
-
-# Open the webcam
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("Error: Could not open webcam.")
-    exit()
-
-print("Starting live analysis. Press 'q' to quit.")
-
-# --- Variables for Counting and Time-based Updates ---
-last_update_time = time.time()
-update_interval = 5  # Update every 5 seconds
-healthy_count = 0
-infected_count = 0
-healthy_percentage = 0  # Initialize percentage variables
-infected_percentage = 0 # Initialize percentage variables
-
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    # Run object detection on the frame. verbose=False hides unnecessary output.
-    results = model(frame, stream=True, verbose=False)
-
-    # Reset counts for the current frame
-    current_healthy = 0
-    current_infected = 0
-
-    # Process detections
-    for r in results:
-        boxes = r.boxes
-        for box in boxes:
-            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-            confidence = box.conf[0].cpu().numpy()
-            class_id = int(box.cls[0].cpu().numpy())
-            class_name = model.names[class_id]
-            
-            # --- CRITICAL FIX: Correct the class names to match your dataset ---
-            if class_name == 'Healthy_leaves':
-                current_healthy += 1
-                color = (0, 255, 0)
-            elif class_name == 'Infected_leaves':
-                current_infected += 1
-                color = (0, 0, 255)
-            else: # Handle the 'background' class if your model has it
-                color = (128, 128, 128) # Gray color for background
-            
-            # Draw the bounding box and label
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            label = f'{class_name}: {confidence:.2f}'
-            cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-
-    # --- Update Counts and Display Percentage Every 5 Seconds ---
-    if time.time() - last_update_time >= update_interval:
-        total_plants = current_healthy + current_infected
-        if total_plants > 0:
-            healthy_percentage = (current_healthy / total_plants) * 100
-            infected_percentage = (current_infected / total_plants) * 100
-        else:
-            healthy_percentage = 0
-            infected_percentage = 0
-        
-        healthy_count = current_healthy
-        infected_count = current_infected
-        
-        last_update_time = time.time()
-
-    # Display the counts and percentages on the frame
-    cv2.putText(frame, f"Healthy: {healthy_count} ({healthy_percentage:.1f}%)", (20, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-    cv2.putText(frame, f"Infected: {infected_count} ({infected_percentage:.1f}%)", (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-
-    # Show the frame
-    cv2.imshow('Live Plant Disease Detection', frame)
-    
-    # Break the loop on 'q' key press
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-# Release resources
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+
+import cv2
+
+# Shared model backends and detection post-processing live with the Flask server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Flask_code"))
+from inference_backends import load_backend
+from detection_postprocess import ClassMap, summarize
+from inference_engine import StageTimer
+
+DEFAULT_MODEL = r'C:\Users\9c23o\Plant Infection Level Detection ML model Using YOLOV8\best.pt'
+
+
+class LatestFrame:
+    """Single-slot mailbox: writers overwrite, readers always get the newest item."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+        self.overwritten = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.overwritten += 1
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, last_seq, timeout=0.5):
+        """Waits for an item newer than ``last_seq``. Returns (seq, item) or (last_seq, None)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq, timeout=timeout)
+            if self._seq <= last_seq:
+                return last_seq, None
+            item, self._item = self._item, None
+            return self._seq, item
+
+
+class IntervalStats:
+    """Healthy/infected totals over every inferred frame in the current interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._reset(time.time())
+        self.display = {"healthy": 0.0, "infected": 0.0, "healthy_pct": 0.0, "infected_pct": 0.0, "frames": 0}
+
+    def _reset(self, now):
+        self.started = now
+        self.frames = 0
+        self.healthy = 0
+        self.infected = 0
+
+    def add(self, summary):
+        with self._lock:
+            self.frames += 1
+            self.healthy += summary["healthy_count"]
+            self.infected += summary["infected_count"]
+            now = time.time()
+            if now - self.started >= self.interval:
+                total = self.healthy + self.infected
+                self.display = {
+                    "healthy": self.healthy / self.frames,
+                    "infected": self.infected / self.frames,
+                    "healthy_pct": self.healthy / total * 100 if total else 0.0,
+                    "infected_pct": self.infected / total * 100 if total else 0.0,
+                    "frames": self.frames,
+                }
+                self._reset(now)
+
+
+def capture_loop(cap, frames, stop, timer):
+    while not stop.is_set():
+        started = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            stop.set()
+            break
+        timer.record((time.perf_counter() - started) * 1000)
+        frames.put(frame)
+
+
+def inference_loop(model, class_map, frames, results, stats, stop, stride, timer):
+    seq = 0
+    last_analysed = -stride
+    while not stop.is_set():
+        seq, frame = frames.get(seq)
+        if frame is None:
+            continue
+        # With a stride of N only every Nth captured frame is analysed
+        if seq - last_analysed < stride:
+            continue
+        last_analysed = seq
+        started = time.perf_counter()
+        detections = model([frame])[0]
+        summary = summarize(detections, class_map)
+        timer.record((time.perf_counter() - started) * 1000)
+        stats.add(summary)
+        results.put(detections)
+
+
+def draw_overlay(frame, display):
+    cv2.putText(frame, f"Healthy: {display['healthy']:.1f} ({display['healthy_pct']:.1f}%)", (20, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+    cv2.putText(frame, f"Infected: {display['infected']:.1f} ({display['infected_pct']:.1f}%)", (20, 60),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+    cv2.putText(frame, f"Frames in last interval: {display['frames']}", (20, 90),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+    return frame
+
+
+def print_report(elapsed, timers, frames, results):
+    print("\n--- Pipeline report ---")
+    print(f"Run time: {elapsed:.1f} s")
+    for name, timer in timers.items():
+        snap = timer.snapshot()
+        fps = snap["count"] / elapsed if elapsed else 0.0
+        print(f"{name:<10} {fps:6.1f} FPS  mean={snap['mean_ms']:.1f} ms  p50={snap['p50_ms']:.1f} ms  "
+              f"p95={snap['p95_ms']:.1f} ms  frames={snap['count']}")
+    print(f"Captured frames replaced before inference: {frames.overwritten}")
+    print(f"Results replaced before display: {results.overwritten}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live plant infection detection from a camera.")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Path to best.pt or an exported model")
+    parser.add_argument("--backend", default="ultralytics", help="ultralytics, onnx or openvino")
+    parser.add_argument("--source", default="0", help="Camera index, video file or stream URL")
+    parser.add_argument("--stride", type=int, default=1, help="Analyse only every Nth captured frame")
+    parser.add_argument("--interval", type=float, default=5.0, help="Statistics window in seconds")
+    parser.add_argument("--headless", action="store_true", help="Don't open a window")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0 = until 'q' or Ctrl+C)")
+    args = parser.parse_args()
+
+    # Load your custom-trained YOLOv8 model
+    model = load_backend(args.backend, args.model)
+    class_map = ClassMap.from_names(model.names)
+
+    # Open the webcam
+    cap = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+    if not cap.isOpened():
+        print("Error: Could not open webcam.")
+        sys.exit(1)
+
+    print("Starting live analysis. Press 'q' to quit." if not args.headless else "Starting headless live analysis.")
+
+    frames = LatestFrame()
+    results = LatestFrame()
+    stats = IntervalStats(args.interval)
+    stop = threading.Event()
+    timers = {"capture": StageTimer(), "inference": StageTimer(), "render": StageTimer()}
+
+    threads = [
+        threading.Thread(target=capture_loop, args=(cap, frames, stop, timers["capture"]), daemon=True),
+        threading.Thread(target=inference_loop,
+                         args=(model, class_map, frames, results, stats, stop, args.stride, timers["inference"]),
+                         daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    started = time.time()
+    seq = 0
+    try:
+        # The renderer stays on the main thread, which is where OpenCV's GUI wants to be
+        while not stop.is_set():
+            if args.duration and time.time() - started >= args.duration:
+                break
+            seq, detections = results.get(seq, timeout=0.1)
+            if detections is not None:
+                render_started = time.perf_counter()
+                frame = draw_overlay(detections.plot(), stats.display)
+                if not args.headless:
+                    cv2.imshow('Live Plant Disease Detection', frame)
+                timers["render"].record((time.perf_counter() - render_started) * 1000)
+            # Break the loop on 'q' key press
+            if not args.headless and cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=2.0)
+        # Release resources
+        cap.release()
+        if not args.headless:
+            cv2.destroyAllWindows()
+        print_report(time.time() - started, timers, frames, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,378 @@
+"""Builds the YOLO train/val(/test) dataset from Pascal VOC annotations.
+
+    python Spliting_dataset.py "C:/.../Real_Dataset"
+    python Spliting_dataset.py Real_Dataset --val 0.15 --test 0.05 --workers 8
+
+Expects ``<data_dir>/images/*.jpg`` and ``<data_dir>/annotations/*.xml`` and
+writes ``images/<split>/`` and ``labels/<split>/`` next to them, which is the
+layout data.yaml points at. The source files are never moved:
+
+* images and XMLs are paired by file stem; unpaired files are reported;
+* XMLs are converted in a process pool, each with a streaming (iterparse)
+  parser; malformed ones are reported and their pair is left out;
+* images are hardlinked into their split (copied if the filesystem can't);
+* splits are stratified by which classes an image contains, so val gets its
+  share of infected plants;
+* a manifest remembers every pair's mtime/size and split. Re-running only
+  converts new or changed annotations, and an image keeps its split, so
+  validation images never leak into training.
+"""
+import argparse
+import hashlib
+import json
 import os
 import shutil
-from sklearn.model_selection import train_test_split
+import time
 import xml.etree.ElementTree as ET
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SPLITS = ("train", "val", "test")
+MANIFEST_NAME = ".dataset_manifest.json"
+DEFAULT_DATA_DIR = r"C:\Users\9c23o\Plant Infection Level Detection Website\Real_Dataset"
+DATA_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.yaml")
+
+
+def read_class_names(data_yaml):
+    import yaml
+
+    with open(data_yaml) as f:
+        names = yaml.safe_load(f)["names"]
+    return list(names.values()) if isinstance(names, dict) else list(names)
+
+
+def scan(directory, extensions):
+    """Maps file stem -> (path, mtime_ns, size) for the files directly in ``directory``."""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                stat = entry.stat()
+                files[os.path.splitext(entry.name)[0]] = (entry.path, stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def image_size(path):
+    # Only used when the XML has no <size>; PIL reads just the header
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size
+
+
+def convert_pascal_to_yolo(task):
+    """Converts one VOC XML to YOLO label lines.
+
+    ``task`` is (stem, xml_path, image_path, class_names). Returns
+    (stem, lines, class_ids, unknown_names, error), where ``error`` is None,
+    or describes why the file could not be read and the rest is empty.
+    Runs in a worker process.
+    """
+    stem = task[0]
+    try:
+        return _convert(*task) + (None,)
+    except (ET.ParseError, ValueError, KeyError, TypeError, OSError) as e:
+        return stem, [], [], [], f"{type(e).__name__}: {e}"
+
+
+def _convert(stem, xml_path, image_path, class_names):
+    class_index = {name: i for i, name in enumerate(class_names)}
+    width = height = 0
+    lines = []
+    class_ids = set()
+    unknown = []
+    obj = None
+    # Stream the XML and clear finished elements instead of building the whole tree
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "object":
+                obj = {}
+            continue
+        tag = elem.tag
+        if tag == "width" and obj is None:
+            width = int(float(elem.text))
+        elif tag == "height" and obj is None:
+            height = int(float(elem.text))
+        elif obj is not None and tag in ("name", "xmin", "ymin", "xmax", "ymax"):
+            obj[tag] = (elem.text or "").strip()
+        elif tag == "object":
+            name = obj.get("name")
+            if name in class_index:
+                if not (width and height):
+                    width, height = image_size(image_path)
+                xmin, ymin, xmax, ymax = (float(obj[k]) for k in ("xmin", "ymin", "xmax", "ymax"))
+                cls = class_index[name]
+                class_ids.add(cls)
+                lines.append(f"{cls} {(xmin + xmax) / 2 / width:.6f} {(ymin + ymax) / 2 / height:.6f} "
+                             f"{(xmax - xmin) / width:.6f} {(ymax - ymin) / height:.6f}")
+            else:
+                unknown.append(name)
+            obj = None
+            elem.clear()
+    return stem, lines, sorted(class_ids), unknown
+
+
+def stratum(class_ids):
+    return ",".join(str(c) for c in class_ids) or "empty"
+
 
-def convert_pascal_to_yolo(xml_dir, img_dir, output_dir, classes):
-    # This is a helper function to convert annotations
-    # ( ... function implementation as provided in a previous response ... )
-    pass  # Placeholder, as the full function is long
+def assign_splits(new_items, existing, ratios, seed):
+    """Assigns splits to new pairs, stratified by the set of classes they contain.
 
-def split_and_prepare_dataset(data_dir, classes_list, split_ratio=0.8):
-    """Splits dataset into training and validation sets and converts annotations."""
+    ``new_items`` maps stem -> stratum, ``existing`` maps stem -> (stratum, split)
+    for pairs that already have a split. Within each stratum, new pairs are
+    ordered by a seeded hash and handed to whichever split is furthest below
+    its target share, counting the pairs already assigned.
+    """
+    by_stratum = {}
+    for stem, key in new_items.items():
+        by_stratum.setdefault(key, []).append(stem)
+    counts = {}
+    for key, split in existing.values():
+        counts.setdefault(key, dict.fromkeys(SPLITS, 0))[split] += 1
+
+    assigned = {}
+    for key, stems in by_stratum.items():
+        stems.sort(key=lambda s: hashlib.blake2b(f"{seed}:{s}".encode(), digest_size=8).digest())
+        split_counts = counts.setdefault(key, dict.fromkeys(SPLITS, 0))
+        for stem in stems:
+            total = sum(split_counts.values()) + 1
+            split = max(SPLITS, key=lambda s: ratios[s] * total - split_counts[s])
+            split_counts[split] += 1
+            assigned[stem] = split
+    return assigned
+
+
+def place_image(src, dst, copy):
+    if os.path.exists(dst):
+        os.remove(dst)
+    if not copy:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass  # other drive, or a filesystem without hardlinks
+    shutil.copy2(src, dst)
+
+
+def remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def split_and_prepare_dataset(data_dir, classes_list, val_ratio=0.2, test_ratio=0.0, output_dir=None,
+                              workers=None, seed=42, use_hash=False, copy=False, reshuffle=False):
+    """Pairs, converts and splits the dataset. Returns a summary dict."""
+    started = time.perf_counter()
+    output_dir = output_dir or data_dir
     images_dir = os.path.join(data_dir, 'images')
     annotations_dir = os.path.join(data_dir, 'annotations')
-    
-    # Create new directories for the split dataset
-    os.makedirs(os.path.join(data_dir, 'images', 'train'), exist_ok=True)
-    os.makedirs(os.path.join(data_dir, 'images', 'val'), exist_ok=True)
-    os.makedirs(os.path.join(data_dir, 'labels', 'train'), exist_ok=True)
-    os.makedirs(os.path.join(data_dir, 'labels', 'val'), exist_ok=True)
-    
-    image_files = [f for f in os.listdir(images_dir) if f.endswith(('.jpg', '.png'))]
-    xml_files = [f for f in os.listdir(annotations_dir) if f.endswith('.xml')]
-
-    # Split the dataset
-    train_images, val_images, train_xmls, val_xmls = train_test_split(
-        image_files, xml_files, test_size=1-split_ratio, random_state=42
-    )
+    ratios = {"train": 1.0 - val_ratio - test_ratio, "val": val_ratio, "test": test_ratio}
+
+    for split in SPLITS:
+        if ratios[split] > 0:
+            os.makedirs(os.path.join(output_dir, 'images', split), exist_ok=True)
+            os.makedirs(os.path.join(output_dir, 'labels', split), exist_ok=True)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {"classes": classes_list, "pairs": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    previous = manifest["pairs"]
+    # A different class list changes every label file
+    classes_changed = manifest.get("classes") != classes_list
+
+    # Pair images and annotations by stem
+    images = scan(images_dir, IMAGE_EXTENSIONS)
+    xmls = scan(annotations_dir, (".xml",))
+    stems = images.keys() & xmls.keys()
+    unpaired_images = sorted(images.keys() - xmls.keys())
+    unpaired_xmls = sorted(xmls.keys() - images.keys())
 
-    # Move files to the new directories
-    for img_file, xml_file in zip(train_images, train_xmls):
-        shutil.move(os.path.join(images_dir, img_file), os.path.join(data_dir, 'images', 'train'))
-        shutil.move(os.path.join(annotations_dir, xml_file), os.path.join(data_dir, 'labels_temp', 'train'))
+    # Work out what needs converting
+    to_convert = []
+    unchanged = {}
+    for stem in stems:
+        xml_path, xml_mtime, xml_size = xmls[stem]
+        old = previous.get(stem)
+        current = {"xml_mtime_ns": xml_mtime, "xml_size": xml_size,
+                   "image_mtime_ns": images[stem][1], "image_size": images[stem][2]}
+        if old and not classes_changed and all(old.get(k) == v for k, v in current.items()):
+            unchanged[stem] = old
+            continue
+        if old and use_hash and not classes_changed and old.get("xml_hash") == file_hash(xml_path) \
+                and old.get("image_size") == images[stem][2]:
+            # Touched but not modified
+            unchanged[stem] = dict(old, **current)
+            continue
+        to_convert.append(stem)
+    scanned = time.perf_counter()
 
-    for img_file, xml_file in zip(val_images, val_xmls):
-        shutil.move(os.path.join(images_dir, img_file), os.path.join(data_dir, 'images', 'val'))
-        shutil.move(os.path.join(annotations_dir, xml_file), os.path.join(data_dir, 'labels_temp', 'val'))
+    converted = {}
+    unknown_names = {}
+    malformed = {}
+    if to_convert:
+        tasks = [(stem, xmls[stem][0], images[stem][0], classes_list) for stem in to_convert]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+            for stem, lines, class_ids, unknown, error in pool.map(convert_pascal_to_yolo, tasks,
+                                                                   chunksize=chunksize):
+                if error:
+                    malformed[stem] = error
+                    continue
+                converted[stem] = (lines, class_ids)
+                for name in unknown:
+                    unknown_names[name] = unknown_names.get(name, 0) + 1
+    # Left out like an unpaired file: earlier outputs are removed below, and
+    # without a manifest entry the pair is converted again on the next run
+    stems -= malformed.keys()
+    parsed = time.perf_counter()
+
+    # Splits: existing pairs keep theirs unless asked to reshuffle
+    existing = {}
+    if not reshuffle:
+        for stem in stems:
+            old = previous.get(stem)
+            if old and ratios.get(old["split"], 0) > 0:
+                classes = converted[stem][1] if stem in converted else old["classes"]
+                existing[stem] = (stratum(classes), old["split"])
+    new_items = {}
+    for stem in stems:
+        if stem not in existing:
+            classes = converted[stem][1] if stem in converted else unchanged[stem]["classes"]
+            new_items[stem] = stratum(classes)
+    splits = {stem: split for stem, (_, split) in existing.items()}
+    splits.update(assign_splits(new_items, existing, ratios, seed))
+
+    # Remove outputs of pairs that disappeared; images that moved to another
+    # split are placed again below and their label file is moved along
+    for stem, old in previous.items():
+        if stem not in stems:
+            remove_if_exists(os.path.join(output_dir, "labels", old["split"], stem + ".txt"))
+        if stem not in stems or splits[stem] != old["split"] \
+                or old["image_name"] != os.path.basename(images[stem][0]):
+            remove_if_exists(os.path.join(output_dir, "images", old["split"], old["image_name"]))
+
+    # Write labels and place images
+    pairs = {}
+    written = 0
+    for stem in stems:
+        image_path = images[stem][0]
+        image_name = os.path.basename(image_path)
+        split = splits[stem]
+        old = previous.get(stem)
+        moved = not old or old["split"] != split or old["image_name"] != image_name
+        entry = dict(unchanged.get(stem) or {})
+        if stem in converted:
+            lines, class_ids = converted[stem]
+            with open(os.path.join(output_dir, 'labels', split, stem + '.txt'), 'w') as f:
+                f.write("\n".join(lines) + ("\n" if lines else ""))
+            entry["classes"] = class_ids
+            entry["boxes"] = len(lines)
+        elif moved:
+            # Unchanged annotation, new split: move the existing label file
+            old_label = os.path.join(output_dir, 'labels', old["split"], stem + '.txt') if old else None
+            new_label = os.path.join(output_dir, 'labels', split, stem + '.txt')
+            if old_label and os.path.exists(old_label):
+                os.replace(old_label, new_label)
+        if stem in converted or moved:
+            place_image(image_path, os.path.join(output_dir, 'images', split, image_name), copy)
+            written += 1
+        entry.update({
+            "split": split,
+            "image_name": image_name,
+            "xml_mtime_ns": xmls[stem][1],
+            "xml_size": xmls[stem][2],
+            "image_mtime_ns": images[stem][1],
+            "image_size": images[stem][2],
+        })
+        if use_hash and stem in converted:
+            entry["xml_hash"] = file_hash(xmls[stem][0])
+        pairs[stem] = entry
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"classes": classes_list, "pairs": pairs}, f)
+    os.replace(tmp_path, manifest_path)
+    finished = time.perf_counter()
+
+    split_counts = {split: 0 for split in SPLITS}
+    class_counts = {split: [0] * len(classes_list) for split in SPLITS}
+    for entry in pairs.values():
+        split_counts[entry["split"]] += 1
+        for cls in entry["classes"]:
+            class_counts[entry["split"]][cls] += 1
+    return {
+        "pairs": len(pairs),
+        "converted": len(converted),
+        "unchanged": len(unchanged),
+        "images_placed": written,
+        "unpaired_images": unpaired_images,
+        "unpaired_annotations": unpaired_xmls,
+        "unknown_class_names": unknown_names,
+        "malformed_annotations": malformed,
+        "split_counts": split_counts,
+        "images_with_class": class_counts,
+        "timings_s": {
+            "scan": round(scanned - started, 3),
+            "convert": round(parsed - scanned, 3),
+            "write": round(finished - parsed, 3),
+            "total": round(finished - started, 3),
+        },
+    }
+
+
+def print_summary(summary, classes_list):
+    print(f"Pairs: {summary['pairs']}  converted: {summary['converted']}  unchanged: {summary['unchanged']}  "
+          f"images placed: {summary['images_placed']}")
+    for label, key in (("images without annotation", "unpaired_images"),
+                       ("annotations without image", "unpaired_annotations")):
+        if summary[key]:
+            print(f"[WARNING] {len(summary[key])} {label}, e.g. {summary[key][:5]}")
+    if summary["malformed_annotations"]:
+        malformed = summary["malformed_annotations"]
+        examples = "; ".join(f"{stem}.xml ({error})" for stem, error in sorted(malformed.items())[:5])
+        print(f"[WARNING] {len(malformed)} malformed annotations skipped, e.g. {examples}")
+    if summary["unknown_class_names"]:
+        print(f"[WARNING] Objects skipped, class not in {classes_list}: {summary['unknown_class_names']}")
+    for split, count in summary["split_counts"].items():
+        if count:
+            per_class = ", ".join(f"{name}={n}" for name, n in zip(classes_list, summary["images_with_class"][split]))
+            print(f"{split:<5} {count:7d} images  (images containing {per_class})")
+    timings = summary["timings_s"]
+    print(f"Time: scan {timings['scan']:.2f} s, convert {timings['convert']:.2f} s, "
+          f"write {timings['write']:.2f} s, total {timings['total']:.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir", nargs="?", default=DEFAULT_DATA_DIR,
+                        help="Folder with images/ and annotations/")
+    parser.add_argument("--output", help="Where to write images/<split> and labels/<split> (default: data_dir)")
+    parser.add_argument("--classes", nargs="+", help="Class names in label order (default: names in data.yaml)")
+    parser.add_argument("--val", type=float, default=0.2, help="Share of images for validation")
+    parser.add_argument("--test", type=float, default=0.0, help="Share of images for a test split")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, help="Conversion processes (default: all cores)")
+    parser.add_argument("--hash", action="store_true",
+                        help="Hash annotations whose mtime changed, and skip them if the content didn't")
+    parser.add_argument("--copy", action="store_true", help="Copy images instead of hardlinking them")
+    parser.add_argument("--reshuffle", action="store_true", help="Re-assign every image to a split")
+    args = parser.parse_args()
+
+    my_classes = args.classes or read_class_names(DATA_YAML)
+    summary = split_and_prepare_dataset(
+        args.data_dir, my_classes, val_ratio=args.val, test_ratio=args.test, output_dir=args.output,
+        workers=args.workers, seed=args.seed, use_hash=args.hash, copy=args.copy, reshuffle=args.reshuffle,
+    )
+    print_summary(summary, my_classes)
 
-    # Convert annotations
-    convert_pascal_to_yolo(os.path.join(data_dir, 'labels_temp', 'train'), 
-                           os.path.join(data_dir, 'images', 'train'), 
-                           os.path.join(data_dir, 'labels', 'train'), classes_list)
-    convert_pascal_to_yolo(os.path.join(data_dir, 'labels_temp', 'val'), 
-                           os.path.join(data_dir, 'images', 'val'), 
-                           os.path.join(data_dir, 'labels', 'val'), classes_list)
 
 if __name__ == '__main__':
-    data_directory = r"C:\Users\9c23o\Plant Infection Level Detection Website\Real_Dataset"
-    my_classes = ['Healthy_Plant', 'Infected_Plant']
-    
-    split_and_prepare_dataset(data_directory, my_classes)
\ No newline at end of file
+    main()
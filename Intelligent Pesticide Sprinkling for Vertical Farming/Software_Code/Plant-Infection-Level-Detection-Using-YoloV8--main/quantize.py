@@ -0,0 +1,428 @@
+"""Quantizes the exported ONNX model to static INT8 and measures what it costs and what it buys.
+
+    python ../Flask_code/export_model.py --weights runs/detect/train/weights/best.pt --format onnx
+    python quantize.py --model runs/detect/train/weights/best.onnx
+    MODEL_BACKEND=onnx MODEL_PATH=models/best-int8-<version>.onnx python ../Flask_code/server.py
+
+1. Calibration: --calib images drawn at random (seeded) from the train split of
+   data.yaml, found the way train.py finds it (train_config.yaml, --set
+   dataset_path=...), and letterboxed exactly as OnnxBackend does when serving.
+   ONNX Runtime runs the FP32 model over them and records the range of every
+   activation (--method).
+2. Quantization: QDQ format, int8 weights per output channel, uint8
+   activations. The detection head's box decoding (DFL softmax, anchor
+   arithmetic, class sigmoid, final concat) stays in float, since in 8 bits
+   box coordinates would snap to steps of several pixels; the head's
+   convolutions are quantized like the rest.
+3. Evaluation on the val split against its labels, FP32 and INT8 through the
+   same OnnxBackend: mAP@0.5 and mAP@0.5:0.95 per class (101 recall points,
+   as COCO), and per image the healthy/infected counts and infected
+   percentage at the server's counting confidence, against the labels and
+   against FP32.
+4. Benchmark, each model in a fresh process: file size, memory after loading
+   and at peak (RSS), latency at batch 1 and throughput at --batch.
+
+Written to --out:
+
+    best-int8-<version>.onnx   the model; its metadata keeps the class names and adds the version and settings
+    best-int8-<version>.json   settings, calibration images, dataset hash, accuracy and benchmark of both models
+
+<version> is the first 12 hex digits of the SHA-256 of the quantized graph
+as ONNX Runtime wrote it, before the metadata above is added, so it is not
+the hash of the shipped file (the report has that as int8.sha256). The
+server reads it from the metadata and stores it as ``model_version`` with
+every analysis; reanalyze.py reads the same metadata for rescored ones.
+
+Static INT8 pays off on CPUs with VNNI (AVX-512 VNNI, AVX-VNNI) or ARM
+dot-product instructions; on older x86 cores the int8 kernels can be no
+faster than FP32, which the benchmark shows before anything is deployed.
+
+Needs onnx and onnxruntime (pip install onnx onnxruntime).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+try:
+    from onnxruntime.quantization import CalibrationDataReader
+except ImportError:
+    raise SystemExit("quantize.py needs onnx and onnxruntime (pip install onnx onnxruntime)")
+
+from train import DEFAULT_CONFIG, dataset_fingerprint, file_sha256, label_path, load_config, resolve_dataset
+
+# Shared model backends and detection post-processing live with the Flask server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Flask_code"))
+from compare_backends import box_iou
+from detection_postprocess import ClassMap, summarize
+from inference_backends import OnnxBackend
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+METHODS = ("minmax", "entropy", "percentile")
+
+
+def read_labels(image_path, width, height):
+    """Ground-truth (xyxy in pixels, class ids) from the YOLO label file of an image."""
+    path = label_path(image_path)
+    rows = np.loadtxt(path, ndmin=2, dtype=np.float32) if os.path.exists(path) else np.zeros((0, 5), np.float32)
+    rows = rows.reshape(-1, 5)
+    cx, cy, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    xyxy = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    return xyxy, rows[:, 0].astype(np.int64)
+
+
+def match_predictions(pred_xyxy, pred_cls, gt_xyxy, gt_cls):
+    """(N preds, 10 IoU thresholds) bool: whether each prediction is a true positive at each threshold."""
+    correct = np.zeros((len(pred_cls), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(pred_cls) or not len(gt_cls):
+        return correct
+    iou = box_iou(gt_xyxy, pred_xyxy) * (gt_cls[:, None] == pred_cls[None, :])
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        gt_index, pred_index = np.nonzero(iou >= threshold)
+        if not len(gt_index):
+            continue
+        # Best IoU first; each ground truth and each prediction is matched at most once
+        order = iou[gt_index, pred_index].argsort()[::-1]
+        gt_index, pred_index = gt_index[order], pred_index[order]
+        _, first = np.unique(pred_index, return_index=True)
+        gt_index, pred_index = gt_index[first], pred_index[first]
+        _, first = np.unique(gt_index, return_index=True)
+        correct[pred_index[first], t] = True
+    return correct
+
+
+def average_precision(recall, precision):
+    """The precision envelope read at 101 recall points and averaged, as COCO does."""
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision)))
+    index = np.searchsorted(recall, np.linspace(0, 1, 101), side="left")
+    # Recall levels never reached count as zero precision
+    return float(np.where(index < len(recall), envelope[np.minimum(index, len(recall) - 1)], 0.0).mean())
+
+
+def detection_map(correct, conf, pred_cls, gt_cls, names):
+    """Per-class and mean AP@0.5 and AP@0.5:0.95."""
+    order = np.argsort(-conf)
+    correct, pred_cls = correct[order], pred_cls[order]
+    per_class = {}
+    for class_id, name in sorted(names.items()):
+        found = correct[pred_cls == class_id]
+        labelled = int(np.count_nonzero(gt_cls == class_id))
+        if not labelled:
+            continue
+        tp = np.cumsum(found, axis=0)
+        fp = np.cumsum(~found, axis=0)
+        recall = tp / labelled
+        precision = tp / np.maximum(tp + fp, 1)
+        ap = [average_precision(recall[:, t], precision[:, t]) if len(found) else 0.0
+              for t in range(len(IOU_THRESHOLDS))]
+        per_class[name] = {"labels": labelled, "ap50": round(ap[0], 4), "ap50_95": round(float(np.mean(ap)), 4)}
+    return {
+        "map50": round(float(np.mean([c["ap50"] for c in per_class.values()])), 4) if per_class else 0.0,
+        "map50_95": round(float(np.mean([c["ap50_95"] for c in per_class.values()])), 4) if per_class else 0.0,
+        "per_class": per_class,
+    }
+
+
+def evaluate(model, images, class_map, count_conf):
+    """mAP against the labels, and the per-image counts, for one model."""
+    correct, conf, pred_cls, gt_cls, counts = [], [], [], [], []
+    for path in images:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        gt_xyxy, labels = read_labels(path, frame.shape[1], frame.shape[0])
+        detections = model([frame])[0]
+        correct.append(match_predictions(detections.xyxy, detections.cls, gt_xyxy, labels))
+        conf.append(detections.conf)
+        pred_cls.append(detections.cls)
+        gt_cls.append(labels)
+        predicted = summarize(detections, class_map, conf_threshold=count_conf)
+        labelled = np.bincount(labels, minlength=class_map.num_classes)
+        healthy, infected = int(labelled[class_map.healthy_id]), int(labelled[class_map.infected_id])
+        counts.append({
+            "image": os.path.basename(path),
+            "healthy": predicted["healthy_count"],
+            "infected": predicted["infected_count"],
+            "infected_percentage": predicted["infected_percentage"],
+            "labelled_healthy": healthy,
+            "labelled_infected": infected,
+            "labelled_infected_percentage": infected / (healthy + infected) * 100 if healthy + infected else 0.0,
+        })
+    if not counts:
+        raise SystemExit("None of the val images could be read, nothing to evaluate")
+    metrics = detection_map(np.concatenate(correct), np.concatenate(conf), np.concatenate(pred_cls),
+                            np.concatenate(gt_cls), model.names)
+    metrics["counts"] = count_errors(counts, "labelled_")
+    return metrics, counts
+
+
+def count_errors(counts, prefix, reference=None):
+    """Mean absolute count and percentage errors against the labels or, with ``reference``, another model."""
+    reference = reference or counts
+
+    def errors(key):
+        return np.abs(np.array([c[key] for c in counts], dtype=np.float64)
+                      - np.array([r[prefix + key] for r in reference], dtype=np.float64))
+
+    healthy, infected, percentage = errors("healthy"), errors("infected"), errors("infected_percentage")
+    return {
+        "images": len(counts),
+        "healthy_mae": round(float(healthy.mean()), 3),
+        "infected_mae": round(float(infected.mean()), 3),
+        "exact_counts": round(float(np.mean((healthy == 0) & (infected == 0))), 4),
+        "infected_percentage_mae": round(float(percentage.mean()), 3),
+        "infected_percentage_max_error": round(float(percentage.max()), 3),
+    }
+
+
+class CalibrationImages(CalibrationDataReader):
+    """Feeds letterboxed calibration images to ONNX Runtime's calibrator, one at a time."""
+
+    def __init__(self, paths, backend):
+        self.paths = iter(paths)
+        self.backend = backend
+        self.used = []
+
+    def get_next(self):
+        for path in self.paths:
+            frame = cv2.imread(path)
+            if frame is None:
+                continue
+            self.used.append(path)
+            batch, _ = self.backend.preprocess([frame])
+            # The batch is a reused buffer, and the calibrator may keep it
+            return {self.backend.input_name: batch.copy()}
+        return None
+
+
+def head_nodes_to_exclude(model):
+    """Non-convolution nodes of the module that produces the output (YOLOv8's Detect head)."""
+    output = model.graph.output[0].name
+    producer = next((node for node in model.graph.node if output in node.output), None)
+    if producer is None or not producer.name.startswith("/") or producer.name.count("/") < 2:
+        print("[WARNING] Can't tell the detection head from the node names; quantizing the whole model")
+        return []
+    prefix = producer.name[:producer.name.index("/", 1) + 1]  # e.g. /model.22/
+    return [node.name for node in model.graph.node if node.name.startswith(prefix) and node.op_type != "Conv"]
+
+
+def quantize(model_path, calibration, output_path, method, quantize_head):
+    """Writes the static INT8 model. Returns the settings used."""
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    workdir = tempfile.mkdtemp()
+    try:
+        prepared = os.path.join(workdir, "prepared.onnx")
+        try:
+            # Shape inference and constant folding, so more of the graph can be quantized; ONNX's
+            # own shape inference is enough for YOLOv8, whose only dynamic axis is the batch
+            quant_pre_process(model_path, prepared, skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"[WARNING] ONNX pre-processing failed ({e}); quantizing the model as exported")
+            shutil.copyfile(model_path, prepared)
+        excluded = [] if quantize_head else head_nodes_to_exclude(onnx.load(prepared))
+        quantize_static(
+            prepared,
+            output_path,
+            calibration,
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            weight_type=QuantType.QInt8,
+            activation_type=QuantType.QUInt8,
+            calibrate_method={"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy,
+                              "percentile": CalibrationMethod.Percentile}[method],
+            nodes_to_exclude=excluded,
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"format": "QDQ", "weights": "int8 per channel", "activations": "uint8", "calibration": method,
+            "nodes_kept_in_float": len(excluded)}
+
+
+def write_metadata(fp32_path, int8_path, output_path, extra):
+    """Copies the FP32 model's metadata (class names, stride, ...) to the INT8 model and adds ``extra``."""
+    import onnx
+
+    source = onnx.load(fp32_path, load_external_data=False)
+    model = onnx.load(int8_path)
+    values = {prop.key: prop.value for prop in source.metadata_props}
+    values.update(extra)
+    del model.metadata_props[:]
+    for key, value in values.items():
+        model.metadata_props.add(key=key, value=value)
+    onnx.save(model, output_path)
+
+
+def _rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _peak_rss():
+    import resource
+
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def benchmark(model_path, images, batch, runs, threads):
+    """Runs in a fresh process, so memory figures belong to this model alone."""
+    frames = [frame for frame in (cv2.imread(p) for p in images) if frame is not None]
+    if not frames:
+        raise SystemExit("None of the benchmark images could be read")
+    before = _rss()
+    started = time.perf_counter()
+    model = OnnxBackend(model_path, threads=threads)
+    load_s = time.perf_counter() - started
+    loaded = _rss()
+    for _ in range(3):
+        model(frames[:1])
+
+    latencies = []
+    for _ in range(runs):
+        for frame in frames:
+            started = time.perf_counter()
+            model([frame])
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    batches = [frames[i:i + batch] for i in range(0, len(frames), batch)]
+    model(batches[0])
+    started = time.perf_counter()
+    for _ in range(runs):
+        for chunk in batches:
+            model(chunk)
+    elapsed = time.perf_counter() - started
+    return {
+        "file_bytes": os.path.getsize(model_path),
+        "load_s": round(load_s, 3),
+        "rss_after_load_bytes": loaded - before,
+        "peak_rss_bytes": _peak_rss(),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "latency_mean_ms": round(float(np.mean(latencies)), 2),
+        f"images_per_s_batch{batch}": round(runs * len(frames) / elapsed, 2),
+    }
+
+
+def run_benchmark(model_path, images, batch, runs, threads):
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(benchmark, model_path, images, batch, runs, threads).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="FP32 ONNX model from export_model.py")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a config value, e.g. dataset_path=D:/Real_Dataset (repeatable)")
+    parser.add_argument("--out", default="models", help="Folder for the INT8 model and its report")
+    parser.add_argument("--calib", type=int, default=300, help="Calibration images from the train split")
+    parser.add_argument("--method", choices=METHODS, default="minmax", help="How activation ranges are set")
+    parser.add_argument("--quantize-head", action="store_true",
+                        help="Also quantize the detection head's box decoding")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--val-limit", type=int, default=0, help="Evaluate on at most this many val images")
+    parser.add_argument("--eval-conf", type=float, default=0.001, help="Detection confidence for mAP")
+    parser.add_argument("--count-conf", type=float, default=float(os.environ.get("COUNT_CONF_THRESHOLD", 0.25)),
+                        help="Confidence at which leaves are counted, as in the server")
+    parser.add_argument("--bench-images", type=int, default=50, help="Val images used for the benchmark")
+    parser.add_argument("--batch", type=int, default=8, help="Batch size for the throughput run")
+    parser.add_argument("--runs", type=int, default=3, help="Benchmark passes over the images")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime threads (0 = all cores)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        raise SystemExit(f"Model file not found: {args.model}")
+    config = load_config(args.config, args.set)
+    data, splits = resolve_dataset(config)
+    if not splits.get("train") or not splits.get("val"):
+        raise SystemExit(f"data.yaml under {data['path']} needs both a train and a val split")
+    val_images = splits["val"][:args.val_limit] if args.val_limit else splits["val"]
+    # Fail before the slow quantization step rather than after it
+    if not any(cv2.imread(p) is not None for p in val_images):
+        raise SystemExit(f"None of the {len(val_images)} val images could be read, nothing to evaluate")
+    if args.bench_images < 1 or not any(cv2.imread(p) is not None for p in val_images[:args.bench_images]):
+        raise SystemExit("No readable benchmark images, check --bench-images")
+
+    fp32 = OnnxBackend(args.model, conf=args.eval_conf)
+    class_map = ClassMap.from_names(fp32.names)
+    calibration_images = random.Random(args.seed).sample(splits["train"], min(args.calib, len(splits["train"])))
+    calibration = CalibrationImages(calibration_images, fp32)
+
+    os.makedirs(args.out, exist_ok=True)
+    fd, quantized_path = tempfile.mkstemp(suffix=".onnx", dir=args.out)
+    os.close(fd)
+    try:
+        started = time.perf_counter()
+        settings = quantize(args.model, calibration, quantized_path, args.method, args.quantize_head)
+        settings.update(calibration_images=len(calibration.used), seed=args.seed,
+                        seconds=round(time.perf_counter() - started, 1))
+        print(f"[INFO] Quantized with {len(calibration.used)} calibration images in {settings['seconds']} s")
+        # Hash of the graph before write_metadata() adds the version to it
+        version = file_sha256(quantized_path)[:12]
+        model_path = os.path.join(args.out, f"{os.path.splitext(os.path.basename(args.model))[0]}-int8-{version}.onnx")
+        write_metadata(args.model, quantized_path, model_path, {
+            "model_version": version,
+            "quantization": json.dumps(settings),
+            "source_sha256": file_sha256(args.model),
+        })
+    finally:
+        os.remove(quantized_path)
+    print(f"[INFO] INT8 model written to {model_path}")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "model_version": version,
+        "fp32": {"path": args.model, "sha256": file_sha256(args.model)},
+        "int8": {"path": model_path, "sha256": file_sha256(model_path)},
+        "quantization": settings,
+        "dataset": {"path": data["path"], "sha256": dataset_fingerprint(splits), "val_images": len(val_images),
+                    "calibration_images": [os.path.basename(p) for p in calibration.used]},
+        "eval_conf": args.eval_conf,
+        "count_conf": args.count_conf,
+    }
+
+    int8 = OnnxBackend(model_path, conf=args.eval_conf)
+    fp32_metrics, fp32_counts = evaluate(fp32, val_images, class_map, args.count_conf)
+    int8_metrics, int8_counts = evaluate(int8, val_images, class_map, args.count_conf)
+    # How far the INT8 counts move from what the FP32 model says on the same images
+    int8_metrics["counts_vs_fp32"] = count_errors(int8_counts, "", fp32_counts)
+    report["accuracy"] = {"fp32": fp32_metrics, "int8": int8_metrics}
+
+    bench_images = val_images[:args.bench_images]
+    report["benchmark"] = {label: run_benchmark(path, bench_images, args.batch, args.runs, args.threads)
+                           for label, path in (("fp32", args.model), ("int8", model_path))}
+
+    report_path = os.path.splitext(model_path)[0] + ".json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'':<6} {'mAP50':>7} {'mAP50-95':>9} {'count MAE h/i':>14} {'inf% MAE':>9} "
+          f"{'p50 ms':>8} {'img/s':>8} {'RSS MB':>8} {'file MB':>8}")
+    for label in ("fp32", "int8"):
+        metrics, bench = report["accuracy"][label], report["benchmark"][label]
+        counts = metrics["counts"]
+        print(f"{label:<6} {metrics['map50']:>7.4f} {metrics['map50_95']:>9.4f} "
+              f"{counts['healthy_mae']:>6.2f}/{counts['infected_mae']:<7.2f} {counts['infected_percentage_mae']:>9.2f} "
+              f"{bench['latency_p50_ms']:>8.1f} {bench[f'images_per_s_batch{args.batch}']:>8.1f} "
+              f"{bench['peak_rss_bytes'] / 2**20:>8.0f} {bench['file_bytes'] / 2**20:>8.1f}")
+    vs_fp32 = int8_metrics["counts_vs_fp32"]
+    print(f"[INFO] INT8 vs FP32 counts: same on {vs_fp32['exact_counts'] * 100:.1f}% of images, "
+          f"infected % off by {vs_fp32['infected_percentage_mae']:.2f} on average "
+          f"(max {vs_fp32['infected_percentage_max_error']:.2f})")
+    print(f"[INFO] Report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
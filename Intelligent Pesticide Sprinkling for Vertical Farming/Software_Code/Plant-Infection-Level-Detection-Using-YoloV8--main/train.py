@@ -1,3 +1,350 @@
-from ultralytics import YOLO
-model = YOLO('yolov8n.pt') 
-results = model.train(data='data.yaml', epochs=100)
\ No newline at end of file
+"""Trains the leaf detector from train_config.yaml and records how it was made.
+
+    python train.py
+    python train.py --set epochs=50 --set dataset_path=D:/Real_Dataset
+    python train.py --prepare-only --benchmark 500   # build the cache, compare loading speed
+
+On CPU build boxes an epoch is mostly JPEG decoding and resizing. Before
+training, every image is decoded once, resized to ``imgsz`` on its long side
+and saved as ``<image>.npy`` next to it; ultralytics loads that file instead
+of the JPEG whenever it exists, so the work isn't repeated every epoch. Those
+files are plain arrays, so reading them is a copy out of the page cache.
+Whether the decoded images are then also held in RAM, kept on disk only, or
+not cached at all depends on how much memory and disk is free.
+
+Every run writes train_manifest.json to its run folder: the resolved config,
+a fingerprint of the dataset, library versions, the cache decision, the time
+of every epoch and the final metrics, plus a hash of the best.pt produced.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = os.path.join(HERE, "train_config.yaml")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_config(path, overrides):
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    for override in overrides:
+        key, _, value = override.partition("=")
+        if key not in config:
+            raise SystemExit(f"Unknown config key '{key}' in --set {override}")
+        config[key] = yaml.safe_load(value)
+    return config
+
+
+def resolve_dataset(config):
+    """Loads data.yaml, applies dataset_path, and lists the image files of every split."""
+    data_yaml = os.path.join(HERE, config["data"]) if not os.path.isabs(config["data"]) else config["data"]
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    if config.get("dataset_path"):
+        data["path"] = config["dataset_path"]
+    root = data["path"]
+    splits = {}
+    for split in ("train", "val", "test"):
+        if not data.get(split):
+            continue
+        directory = os.path.normpath(os.path.join(root, data[split]))
+        splits[split] = sorted(p for p in glob.glob(os.path.join(directory, "*"))
+                               if p.lower().endswith(IMAGE_EXTENSIONS))
+    return data, splits
+
+
+def label_path(image_path):
+    # ultralytics' convention: .../images/<split>/x.jpg -> .../labels/<split>/x.txt
+    marker = os.sep + "images" + os.sep
+    normalized = os.path.normpath(image_path)
+    if marker not in normalized:
+        raise SystemExit(f"{image_path} is not under an images/ folder; the dataset needs the "
+                         f"images/<split> and labels/<split> layout that Spliting_dataset.py writes")
+    head, tail = normalized.rsplit(marker, 1)
+    return os.path.join(head, "labels", os.path.splitext(tail)[0] + ".txt")
+
+
+def dataset_fingerprint(splits, hash_images=False):
+    """Hash of every split's file list, image sizes and label contents.
+
+    Image contents are only hashed with ``hash_images`` (slow on large sets);
+    otherwise a same-size replacement image goes unnoticed.
+    """
+    digest = hashlib.sha256()
+    for split, images in sorted(splits.items()):
+        for image in images:
+            digest.update(f"{split}/{os.path.basename(image)}:{os.path.getsize(image)}\n".encode())
+            if hash_images:
+                with open(image, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            label = label_path(image)
+            if os.path.exists(label):
+                with open(label, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+def npy_path(image_path):
+    return os.path.splitext(image_path)[0] + ".npy"
+
+
+def decode_resized(image_path, imgsz):
+    """Decodes an image and resizes its long side to ``imgsz``, as ultralytics would."""
+    frame = cv2.imread(image_path)
+    h, w = frame.shape[:2]
+    r = imgsz / max(h, w)
+    if r < 1:
+        frame = cv2.resize(frame, (max(1, round(w * r)), max(1, round(h * r))), interpolation=cv2.INTER_AREA)
+    elif r > 1:
+        frame = cv2.resize(frame, (max(1, round(w * r)), max(1, round(h * r))), interpolation=cv2.INTER_LINEAR)
+    return frame
+
+
+def cache_one(task):
+    """Writes one .npy cache file unless an up-to-date one exists. Returns bytes written."""
+    image_path, imgsz = task
+    target = npy_path(image_path)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(image_path):
+        # Only the header is read to check the cached size
+        if max(np.load(target, mmap_mode="r").shape[:2]) == imgsz:
+            return 0
+    frame = decode_resized(image_path, imgsz)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".npy.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, frame)
+    os.replace(tmp_path, target)
+    return frame.nbytes
+
+
+def estimate_cache_bytes(images, imgsz, sample=32):
+    """Decoded size of the dataset at ``imgsz``, extrapolated from a sample of images."""
+    if not images:
+        return 0
+    step = max(1, len(images) // sample)
+    sizes = [decode_resized(p, imgsz).nbytes for p in images[::step][:sample]]
+    return int(np.mean(sizes) * len(images))
+
+
+def available_ram():
+    try:
+        import psutil
+
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        # Windows without psutil (ultralytics normally installs it): assume
+        # no spare RAM, so the cache goes to disk instead
+        return 0
+
+
+def choose_cache(config, images):
+    """Returns (ultralytics cache argument, whether to build .npy files, details)."""
+    requested = str(config.get("cache", "auto")).lower()
+    needed = estimate_cache_bytes(images, config["imgsz"])
+    ram = available_ram()
+    disk = shutil.disk_usage(os.path.dirname(images[0])).free if images else 0
+    details = {"requested": requested, "estimated_bytes": needed, "available_ram_bytes": ram,
+               "free_disk_bytes": disk}
+    if requested in ("off", "false", "none"):
+        return False, False, dict(details, mode="off")
+    fits_ram = needed <= config.get("ram_fraction", 0.5) * ram
+    fits_disk = needed <= 0.9 * disk
+    if requested == "ram" or (requested == "auto" and fits_ram):
+        # The .npy files make filling the RAM cache fast too, if the disk has room
+        return "ram", fits_disk, dict(details, mode="ram")
+    if fits_disk:
+        return "disk", True, dict(details, mode="disk")
+    print(f"[WARNING] Decoded dataset (~{needed / 2**30:.1f} GB) fits neither RAM nor disk; training uncached")
+    return False, False, dict(details, mode="off")
+
+
+def build_cache(images, imgsz, workers):
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        written = sum(pool.map(cache_one, [(p, imgsz) for p in images], chunksize=32))
+    return written, time.perf_counter() - started
+
+
+def cpu_workers(config):
+    """Dataloader workers. On CPU the model itself needs most cores, so use about a quarter."""
+    if config.get("workers", "auto") != "auto":
+        return int(config["workers"])
+    cores = os.cpu_count() or 1
+    if str(config.get("device", "cpu")) == "cpu":
+        return max(1, min(8, cores // 4))
+    return min(8, cores)
+
+
+def benchmark_loading(images, imgsz, count):
+    """Images/s of the cold path (JPEG decode + resize) and the cached path (.npy read)."""
+    images = images[:count]
+    results = {}
+    for label, load in (("cold", lambda p: decode_resized(p, imgsz)),
+                        ("cached", lambda p: np.load(npy_path(p)))):
+        started = time.perf_counter()
+        for path in images:
+            load(path)
+        elapsed = time.perf_counter() - started
+        results[label] = {"images": len(images), "seconds": round(elapsed, 3),
+                          "images_per_s": round(len(images) / elapsed, 1) if elapsed else 0.0}
+    return results
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def train(config, data, cache, workers, manifest, manifest_path):
+    from ultralytics import YOLO
+    import torch
+    import ultralytics
+
+    manifest["versions"].update({"ultralytics": ultralytics.__version__, "torch": torch.__version__})
+
+    # A copy of data.yaml with the resolved dataset path, stored with the run
+    run_dir = os.path.join(config["project"], config["name"])
+    os.makedirs(run_dir, exist_ok=True)
+    data_yaml = os.path.join(run_dir, "data.resolved.yaml")
+    with open(data_yaml, "w") as f:
+        yaml.safe_dump(data, f)
+
+    epochs = []
+    epoch_started = {}
+
+    def on_train_epoch_start(trainer):
+        epoch_started["t"] = time.perf_counter()
+
+    def on_fit_epoch_end(trainer):
+        epochs.append({
+            "epoch": trainer.epoch + 1,
+            "seconds": round(time.perf_counter() - epoch_started["t"], 2),
+            "metrics": {k: round(float(v), 5) for k, v in trainer.metrics.items()},
+        })
+        manifest["epochs"] = epochs
+        write_manifest(manifest, manifest_path)
+
+    model = YOLO(config["model"])
+    model.add_callback("on_train_epoch_start", on_train_epoch_start)
+    model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+    started = time.perf_counter()
+    model.train(
+        data=data_yaml,
+        epochs=config["epochs"],
+        imgsz=config["imgsz"],
+        batch=config["batch"],
+        device=config["device"],
+        seed=config["seed"],
+        deterministic=True,
+        patience=config["patience"],
+        lr0=config["lr0"],
+        optimizer=config["optimizer"],
+        cache=cache,
+        workers=workers,
+        project=config["project"],
+        name=config["name"],
+        exist_ok=True,
+    )
+    trainer = model.trainer
+    manifest["train_seconds"] = round(time.perf_counter() - started, 1)
+    manifest["final_metrics"] = {k: round(float(v), 5) for k, v in trainer.metrics.items()}
+    best = str(trainer.best)
+    if os.path.exists(best):
+        manifest["best_pt"] = {"path": best, "sha256": file_sha256(best)}
+
+
+def write_manifest(manifest, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a config value (repeatable)")
+    parser.add_argument("--prepare-only", action="store_true", help="Build the cache and manifest, don't train")
+    parser.add_argument("--benchmark", type=int, default=0, metavar="N",
+                        help="Compare loading N training images cold vs from the cache")
+    parser.add_argument("--hash-images", action="store_true", help="Include image contents in the dataset hash")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.set)
+    data, splits = resolve_dataset(config)
+    images = [p for split_images in splits.values() for p in split_images]
+    if not splits.get("train"):
+        raise SystemExit(f"No training images found under {data['path']}")
+
+    workers = cpu_workers(config)
+    manifest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": config,
+        "git_commit": git_commit(),
+        "versions": {"python": platform.python_version(), "opencv": cv2.__version__, "numpy": np.__version__},
+        "dataset": {
+            "path": data["path"],
+            "images": {split: len(split_images) for split, split_images in splits.items()},
+            "sha256": dataset_fingerprint(splits, args.hash_images),
+            "includes_image_contents": args.hash_images,
+        },
+        "dataloader_workers": workers,
+    }
+
+    cache, build_npy, cache_details = choose_cache(config, images)
+    if build_npy:
+        written, seconds = build_cache(images, config["imgsz"], os.cpu_count())
+        cache_details.update({"npy_bytes_written": written, "build_seconds": round(seconds, 2)})
+        print(f"[INFO] Image cache ready ({written / 2**20:.0f} MB written in {seconds:.1f} s)")
+    manifest["cache"] = cache_details
+    print(f"[INFO] Cache mode: {cache_details['mode']}, dataloader workers: {workers}")
+
+    if args.benchmark:
+        if not build_npy:
+            print("[WARNING] No .npy cache was built, skipping the loading benchmark")
+        else:
+            results = benchmark_loading(splits["train"], config["imgsz"], args.benchmark)
+            manifest["loading_benchmark"] = results
+            print(f"[INFO] Loading {results['cold']['images']} images: "
+                  f"cold {results['cold']['images_per_s']} img/s, cached {results['cached']['images_per_s']} img/s "
+                  f"({results['cold']['seconds'] / max(results['cached']['seconds'], 1e-9):.1f}x faster)")
+
+    run_dir = os.path.join(config["project"], config["name"])
+    os.makedirs(run_dir, exist_ok=True)
+    manifest_path = os.path.join(run_dir, "train_manifest.json")
+    if not args.prepare_only:
+        train(config, data, cache, workers, manifest, manifest_path)
+    write_manifest(manifest, manifest_path)
+    print(f"[INFO] Manifest written to {manifest_path}")
+
+
+if __name__ == "__main__":
+    main()